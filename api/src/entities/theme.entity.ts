@@ -21,4 +21,14 @@ export class Theme extends BaseEntity {
 
   @Column({ type: 'jsonb', nullable: true })
   summary?: Record<string, unknown> | null;
+
+  // Clustering state used for incremental assignment; the centroid itself is a pgvector column
+  @Column({ type: 'int', nullable: true })
+  sectionCount?: number | null;
+
+  @Column({ type: 'real', nullable: true })
+  meanSqDistance?: number | null;
+
+  @Column({ type: 'real', nullable: true })
+  maxDistance?: number | null;
 }
@@ -0,0 +1,19 @@
+import { MigrationInterface, QueryRunner } from 'typeorm';
+
+export class ThemeCentroids1700000003000 implements MigrationInterface {
+  name = 'ThemeCentroids1700000003000';
+
+  public async up(queryRunner: QueryRunner): Promise<void> {
+    await queryRunner.query(`ALTER TABLE themes ADD COLUMN IF NOT EXISTS centroid vector(384)`);
+    await queryRunner.query(`ALTER TABLE themes ADD COLUMN IF NOT EXISTS "sectionCount" int`);
+    await queryRunner.query(`ALTER TABLE themes ADD COLUMN IF NOT EXISTS "meanSqDistance" real`);
+    await queryRunner.query(`ALTER TABLE themes ADD COLUMN IF NOT EXISTS "maxDistance" real`);
+  }
+
+  public async down(queryRunner: QueryRunner): Promise<void> {
+    await queryRunner.query(`ALTER TABLE themes DROP COLUMN IF EXISTS "maxDistance"`);
+    await queryRunner.query(`ALTER TABLE themes DROP COLUMN IF EXISTS "meanSqDistance"`);
+    await queryRunner.query(`ALTER TABLE themes DROP COLUMN IF EXISTS "sectionCount"`);
+    await queryRunner.query(`ALTER TABLE themes DROP COLUMN IF EXISTS centroid`);
+  }
+}
@@ -0,0 +1,28 @@
+import { MigrationInterface, QueryRunner } from 'typeorm';
+
+export class ContentCache1700000004000 implements MigrationInterface {
+  name = 'ContentCache1700000004000';
+
+  public async up(queryRunner: QueryRunner): Promise<void> {
+    // Parsed sections keyed by the MD5 of the PDF bytes, shared across projects
+    await queryRunner.query(`CREATE TABLE IF NOT EXISTS content_cache (
+      hash varchar(64) PRIMARY KEY,
+      sections jsonb NOT NULL,
+      "createdAt" timestamptz NOT NULL DEFAULT now()
+    )`);
+    // Section vectors per content hash and embedding model; ordinal is 1-based into content_cache.sections
+    await queryRunner.query(`CREATE TABLE IF NOT EXISTS content_embedding_cache (
+      hash varchar(64) NOT NULL REFERENCES content_cache(hash) ON DELETE CASCADE,
+      model varchar(256) NOT NULL,
+      ordinal int NOT NULL,
+      embedding vector(384) NOT NULL,
+      "createdAt" timestamptz NOT NULL DEFAULT now(),
+      PRIMARY KEY (hash, model, ordinal)
+    )`);
+  }
+
+  public async down(queryRunner: QueryRunner): Promise<void> {
+    await queryRunner.query(`DROP TABLE IF EXISTS content_embedding_cache`);
+    await queryRunner.query(`DROP TABLE IF EXISTS content_cache`);
+  }
+}
@@ -0,0 +1,38 @@
+import { MigrationInterface, QueryRunner } from 'typeorm';
+
+export class SectionChunks1700000005000 implements MigrationInterface {
+  name = 'SectionChunks1700000005000';
+
+  public async up(queryRunner: QueryRunner): Promise<void> {
+    // Overlapping token windows of sections longer than the embedding model's input;
+    // startChar/endChar slice sections.text
+    await queryRunner.query(`CREATE TABLE IF NOT EXISTS section_chunks (
+      "sectionId" uuid NOT NULL REFERENCES sections(id) ON DELETE CASCADE,
+      ordinal smallint NOT NULL,
+      "startChar" int NOT NULL,
+      "endChar" int NOT NULL,
+      embedding vector(384) NOT NULL,
+      PRIMARY KEY ("sectionId", ordinal)
+    )`);
+    await queryRunner.query(
+      `CREATE INDEX IF NOT EXISTS idx_section_chunks_embedding ON section_chunks USING hnsw (embedding vector_cosine_ops)`
+    );
+    // Chunk vectors of cached content, alongside content_embedding_cache
+    await queryRunner.query(`CREATE TABLE IF NOT EXISTS content_chunk_cache (
+      hash varchar(64) NOT NULL REFERENCES content_cache(hash) ON DELETE CASCADE,
+      model varchar(256) NOT NULL,
+      ordinal int NOT NULL,
+      chunk smallint NOT NULL,
+      "startChar" int NOT NULL,
+      "endChar" int NOT NULL,
+      embedding vector(384) NOT NULL,
+      PRIMARY KEY (hash, model, ordinal, chunk)
+    )`);
+  }
+
+  public async down(queryRunner: QueryRunner): Promise<void> {
+    await queryRunner.query(`DROP TABLE IF EXISTS content_chunk_cache`);
+    await queryRunner.query(`DROP INDEX IF EXISTS idx_section_chunks_embedding`);
+    await queryRunner.query(`DROP TABLE IF EXISTS section_chunks`);
+  }
+}
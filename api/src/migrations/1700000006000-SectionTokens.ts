@@ -0,0 +1,15 @@
+import { MigrationInterface, QueryRunner } from 'typeorm';
+
+export class SectionTokens1700000006000 implements MigrationInterface {
+  name = 'SectionTokens1700000006000';
+
+  public async up(queryRunner: QueryRunner): Promise<void> {
+    // Term ids of sections.text (crc32 of each normalised token), packed little-endian uint32;
+    // written once at ingest and read by labeling and the lexical index instead of the text
+    await queryRunner.query(`ALTER TABLE sections ADD COLUMN IF NOT EXISTS "tokenIds" bytea`);
+  }
+
+  public async down(queryRunner: QueryRunner): Promise<void> {
+    await queryRunner.query(`ALTER TABLE sections DROP COLUMN IF EXISTS "tokenIds"`);
+  }
+}
@@ -0,0 +1,33 @@
+import { MigrationInterface, QueryRunner } from 'typeorm';
+
+export class MatrixExtraction1700000007000 implements MigrationInterface {
+  name = 'MatrixExtraction1700000007000';
+
+  public async up(queryRunner: QueryRunner): Promise<void> {
+    // Rows extracted by the matrix worker belong to a document; methods and datasets are
+    // upserted on (documentId, name), metrics of a document are replaced per run
+    for (const table of ['methods', 'metrics', 'datasets']) {
+      await queryRunner.query(
+        `ALTER TABLE ${table} ADD COLUMN IF NOT EXISTS "documentId" uuid REFERENCES documents(id) ON DELETE CASCADE`
+      );
+    }
+    await queryRunner.query(`ALTER TABLE metrics ADD COLUMN IF NOT EXISTS value double precision`);
+    await queryRunner.query(
+      `CREATE UNIQUE INDEX IF NOT EXISTS uq_methods_document_name ON methods ("documentId", name)`
+    );
+    await queryRunner.query(
+      `CREATE UNIQUE INDEX IF NOT EXISTS uq_datasets_document_name ON datasets ("documentId", name)`
+    );
+    await queryRunner.query(`CREATE INDEX IF NOT EXISTS idx_metrics_document ON metrics ("documentId")`);
+  }
+
+  public async down(queryRunner: QueryRunner): Promise<void> {
+    await queryRunner.query(`DROP INDEX IF EXISTS idx_metrics_document`);
+    await queryRunner.query(`DROP INDEX IF EXISTS uq_datasets_document_name`);
+    await queryRunner.query(`DROP INDEX IF EXISTS uq_methods_document_name`);
+    await queryRunner.query(`ALTER TABLE metrics DROP COLUMN IF EXISTS value`);
+    for (const table of ['datasets', 'metrics', 'methods']) {
+      await queryRunner.query(`ALTER TABLE ${table} DROP COLUMN IF EXISTS "documentId"`);
+    }
+  }
+}
@@ -0,0 +1,20 @@
+import { MigrationInterface, QueryRunner } from 'typeorm';
+
+export class DocumentContentHash1700000008000 implements MigrationInterface {
+  name = 'DocumentContentHash1700000008000';
+
+  public async up(queryRunner: QueryRunner): Promise<void> {
+    // MD5 of the parsed PDF's bytes, set by the pdf worker at ingest and keying content_cache.
+    // Unlike documents.hash it is not unique: re-uploads of one PDF share it, so their
+    // section embeddings are copied from content_embedding_cache instead of re-encoded
+    await queryRunner.query(`ALTER TABLE documents ADD COLUMN IF NOT EXISTS "contentHash" varchar(64)`);
+    await queryRunner.query(
+      `CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents ("contentHash")`
+    );
+  }
+
+  public async down(queryRunner: QueryRunner): Promise<void> {
+    await queryRunner.query(`DROP INDEX IF EXISTS idx_documents_content_hash`);
+    await queryRunner.query(`ALTER TABLE documents DROP COLUMN IF EXISTS "contentHash"`);
+  }
+}
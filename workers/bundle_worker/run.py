@@ -4,6 +4,7 @@ import json
 import bibtexparser
 from nats.aio.client import Client as NATS
 from workers.common.db import create_db_engine, fetch_theme_papers_for_bundle, insert_citation_bundle
+from workers.common.runtime import WorkerRuntime
 
 
 def generate_bibtex(papers):
@@ -63,6 +64,7 @@ async def main():
     nc = NATS()
     await nc.connect(os.getenv("NATS_URL", "nats://localhost:4222"))
     engine = create_db_engine()
+    runtime = WorkerRuntime("bundle", processes=0)
 
     async def handle(msg):
         data = msg.data.decode()
@@ -74,7 +76,7 @@ async def main():
         except Exception:
             return
 
-        papers = fetch_theme_papers_for_bundle(engine, theme_id, k)
+        papers = await runtime.run_io(fetch_theme_papers_for_bundle, engine, theme_id, k)
         if not papers:
             return
             
@@ -89,9 +91,9 @@ async def main():
             "csl": csl
         }
         
-        insert_citation_bundle(engine, project_id, theme_id, bundle_data)
+        await runtime.run_io(insert_citation_bundle, engine, project_id, theme_id, bundle_data)
 
-    await nc.subscribe("bundle.make", cb=handle)
+    await runtime.subscribe(nc, "bundle.make", handle)
     while True:
         await asyncio.sleep(5)
 
@@ -1,12 +1,53 @@
 import os
 import asyncio
 import json
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import pairwise_distances_argmin_min, silhouette_score
 from sklearn.preprocessing import StandardScaler
 from nats.aio.client import Client as NATS
-from workers.common.db import create_db_engine, fetch_project_sections_with_embeddings, reset_project_themes, insert_theme, insert_theme_assignments
+from workers.common.db import (
+    create_db_engine,
+    fetch_project_embedding_matrix,
+    fetch_project_theme_centroids,
+    fetch_unassigned_section_embeddings,
+    insert_theme,
+    insert_theme_assignments,
+    reset_project_themes,
+    update_theme_centroids,
+)
+from workers.common.runtime import WorkerRuntime
+
+
+def evaluate_k_block(embeddings, k_values, random_state, sample_size):
+    """Score a contiguous run of k values, warm-starting each fit from the previous k.
+
+    Runs in a worker process; returns [(k, sampled silhouette score), ...].
+    """
+    scores = []
+    centers = None
+    for k in k_values:
+        if centers is None:
+            kmeans = MiniBatchKMeans(n_clusters=k, random_state=random_state, n_init=3)
+        else:
+            # Previous centers plus the section farthest from all of them
+            _, nearest = pairwise_distances_argmin_min(embeddings, centers)
+            init = np.vstack([centers, embeddings[np.argmax(nearest)]])
+            kmeans = MiniBatchKMeans(n_clusters=k, random_state=random_state, init=init, n_init=1)
+        cluster_labels = kmeans.fit_predict(embeddings)
+        centers = kmeans.cluster_centers_
+
+        if len(set(cluster_labels)) > 1:
+            score = silhouette_score(
+                embeddings, cluster_labels,
+                sample_size=min(sample_size, len(embeddings)), random_state=random_state
+            )
+        else:
+            score = 0
+        scores.append((k, float(score)))
+    return scores
 
 
 class ClusteringWorker:
@@ -14,8 +55,14 @@ class ClusteringWorker:
         self.min_clusters = 3
         self.max_clusters = 20
         self.random_state = 42
+        self.selection_mode = os.getenv("CLUSTER_SELECTION_MODE", "fast")
+        self.silhouette_sample_size = int(os.getenv("CLUSTER_SILHOUETTE_SAMPLE", "2000"))
+        self.selection_processes = int(os.getenv("CLUSTER_SELECTION_PROCESSES", str(os.cpu_count() or 1)))
+        # Drift thresholds above which incremental assignment gives way to a full re-cluster
+        self.max_new_share = float(os.getenv("CLUSTER_MAX_NEW_SHARE", "0.2"))
+        self.max_inertia_growth = float(os.getenv("CLUSTER_MAX_INERTIA_GROWTH", "1.5"))
         
-    def determine_optimal_clusters(self, embeddings, max_clusters=None):
+    def determine_optimal_clusters(self, embeddings, max_clusters=None, mode=None, executor=None):
         """Determine optimal number of clusters using silhouette analysis"""
         if max_clusters is None:
             max_clusters = min(self.max_clusters, len(embeddings) // 10)
@@ -23,7 +70,10 @@ class ClusteringWorker:
         max_clusters = min(max_clusters, len(embeddings) - 1)
         
         if max_clusters < self.min_clusters:
-            return self.min_clusters
+            return self.min_clusters, 0.0
+
+        if (mode or self.selection_mode) == 'fast':
+            return self.select_clusters_fast(embeddings, max_clusters, executor=executor)
         
         silhouette_scores = []
         k_values = range(self.min_clusters, max_clusters + 1)
@@ -42,134 +92,183 @@ class ClusteringWorker:
         optimal_k = k_values[np.argmax(silhouette_scores)]
         return optimal_k, max(silhouette_scores)
     
+    def select_clusters_fast(self, embeddings, max_clusters, executor=None):
+        """MiniBatchKMeans + sampled silhouette, with k ranges spread over a process pool"""
+        k_values = np.arange(self.min_clusters, max_clusters + 1)
+        n_blocks = max(1, min(self.selection_processes, len(k_values)))
+        # Contiguous blocks so each process can warm-start k from k - 1
+        blocks = [block.tolist() for block in np.array_split(k_values, n_blocks)]
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+        args = (
+            [embeddings] * n_blocks,
+            blocks,
+            [self.random_state] * n_blocks,
+            [self.silhouette_sample_size] * n_blocks
+        )
+        if n_blocks == 1:
+            results = [evaluate_k_block(*(arg[0] for arg in args))]
+        elif executor is not None:
+            results = list(executor.map(evaluate_k_block, *args))
+        else:
+            with ProcessPoolExecutor(max_workers=n_blocks) as pool:
+                results = list(pool.map(evaluate_k_block, *args))
+
+        scores = [score for block_scores in results for score in block_scores]
+        optimal_k, best_score = max(scores, key=lambda item: item[1])
+        return int(optimal_k), best_score
+
     def perform_clustering(self, embeddings, n_clusters):
         """Perform K-means clustering"""
         # Standardize embeddings
         scaler = StandardScaler()
         embeddings_scaled = scaler.fit_transform(embeddings)
         
-        # Perform clustering
-        kmeans = KMeans(n_clusters=n_clusters, random_state=self.random_state, n_init=10)
+        # Perform clustering; one k-means++ init (sklearn >= 1.4's default) instead of ten
+        kmeans = KMeans(n_clusters=n_clusters, random_state=self.random_state, n_init=1)
         cluster_labels = kmeans.fit_predict(embeddings_scaled)
         
-        # Calculate silhouette score
-        silhouette_avg = silhouette_score(embeddings_scaled, cluster_labels)
+        # Sampled silhouette, as in k selection, keeps this pass linear in n
+        if len(set(cluster_labels)) > 1:
+            silhouette_avg = silhouette_score(
+                embeddings_scaled, cluster_labels,
+                sample_size=min(self.silhouette_sample_size, len(embeddings_scaled)), random_state=self.random_state
+            )
+        else:
+            silhouette_avg = 0.0
         
-        return cluster_labels, silhouette_avg, kmeans.cluster_centers_
+        # Report centers in embedding space so distances to raw embeddings are meaningful
+        cluster_centers = scaler.inverse_transform(kmeans.cluster_centers_).astype(np.float32)
+
+        return cluster_labels, silhouette_avg, cluster_centers
+
+    def compute_center_distances(self, embeddings, cluster_centers):
+        """Euclidean distance from every section to every center as one (n, k) matrix"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        cluster_centers = np.asarray(cluster_centers, dtype=np.float32)
+        squared = (
+            np.einsum('ij,ij->i', embeddings, embeddings)[:, None]
+            + np.einsum('ij,ij->i', cluster_centers, cluster_centers)[None, :]
+            - 2.0 * embeddings @ cluster_centers.T
+        )
+        return np.sqrt(np.maximum(squared, 0.0))
     
-    def build_theme_hierarchy(self, cluster_labels, cluster_centers, embeddings):
+    def build_theme_hierarchy(self, cluster_labels, cluster_centers, distances):
         """Build theme hierarchy from clusters"""
         themes = []
+        cluster_labels = np.asarray(cluster_labels)
+
+        # Farthest section from each center, computed once for all themes
+        max_distances = distances.max(axis=0)
         
         for cluster_id in range(len(cluster_centers)):
             # Find sections in this cluster
-            cluster_sections = [i for i, label in enumerate(cluster_labels) if label == cluster_id]
+            cluster_sections = np.flatnonzero(cluster_labels == cluster_id)
             
-            if not cluster_sections:
+            if not len(cluster_sections):
                 continue
             
-            # Calculate cluster characteristics
-            cluster_embeddings = [embeddings[i] for i in cluster_sections]
-            cluster_center = cluster_centers[cluster_id]
-            
             # Calculate average distance to center
-            distances = [np.linalg.norm(emb - cluster_center) for emb in cluster_embeddings]
-            avg_distance = np.mean(distances)
+            section_distances = distances[cluster_sections, cluster_id]
+            avg_distance = section_distances.mean()
+
+            # Weight sections by closeness to the center, relative to the farthest section overall
+            max_distance = max_distances[cluster_id]
+            if max_distance > 0:
+                weights = np.maximum(0.1, 1.0 - section_distances / max_distance)
+            else:
+                weights = np.ones(len(cluster_sections))
             
             # Determine if this is a main theme or subtheme
             is_main_theme = len(cluster_sections) >= 5  # Threshold for main theme
             
             themes.append({
                 'cluster_id': cluster_id,
-                'section_indices': cluster_sections,
-                'center': cluster_center,
+                'section_indices': cluster_sections.tolist(),
+                'section_weights': weights.tolist(),
+                'center': cluster_centers[cluster_id],
                 'avg_distance': avg_distance,
+                'mean_sq_distance': float(np.mean(section_distances ** 2)),
+                'max_distance': float(max_distance),
                 'size': len(cluster_sections),
                 'is_main_theme': is_main_theme
             })
         
         return themes
 
+    def assign_incrementally(self, new_embeddings, themes, centroids):
+        """Assign new sections to their nearest existing centroid and measure drift.
+
+        Returns (assignments, updates, drift) where assignments maps theme index to
+        [(new section index, weight)], updates holds the refreshed centroid state per
+        touched theme, and drift is None or a short reason a full re-cluster is needed.
+        """
+        distances = self.compute_center_distances(new_embeddings, centroids)
+        nearest = distances.argmin(axis=1)
+        nearest_distances = distances[np.arange(len(nearest)), nearest]
+
+        counts = np.array([theme['section_count'] for theme in themes], dtype=np.float64)
+        mean_sq = np.array([theme['mean_sq_distance'] for theme in themes], dtype=np.float64)
+
+        # Drift: too many new points, or new points sit much farther out than the existing ones
+        new_share = len(nearest) / (counts.sum() + len(nearest))
+        baseline = np.average(mean_sq, weights=counts) if counts.sum() > 0 else 0.0
+        inertia_growth = float(np.mean(nearest_distances ** 2) / baseline) if baseline > 0 else float('inf')
+        if new_share > self.max_new_share:
+            return {}, [], f"new share {new_share:.2f} > {self.max_new_share}"
+        if inertia_growth > self.max_inertia_growth:
+            return {}, [], f"inertia growth {inertia_growth:.2f} > {self.max_inertia_growth}"
+
+        assignments, updates = {}, []
+        for theme_idx in np.unique(nearest):
+            members = np.flatnonzero(nearest == theme_idx)
+            theme = themes[theme_idx]
+            count = theme['section_count'] + len(members)
+            member_distances = nearest_distances[members]
+            max_distance = max(theme['max_distance'], float(member_distances.max()))
+
+            if max_distance > 0:
+                weights = np.maximum(0.1, 1.0 - member_distances / max_distance)
+            else:
+                weights = np.ones(len(members))
+            assignments[int(theme_idx)] = list(zip(members.tolist(), weights.tolist(), strict=True))
+
+            # Running means over old and new members
+            updates.append({
+                'id': theme['id'],
+                'centroid': (centroids[theme_idx] * theme['section_count'] + new_embeddings[members].sum(axis=0)) / count,
+                'section_count': count,
+                'mean_sq_distance': (theme['mean_sq_distance'] * theme['section_count'] + float(np.sum(member_distances ** 2))) / count,
+                'max_distance': max_distance
+            })
+
+        return assignments, updates, None
+
 
 async def main():
     nc = NATS()
     await nc.connect(os.getenv("NATS_URL", "nats://localhost:4222"))
     engine = create_db_engine()
     worker = ClusteringWorker()
+    runtime = WorkerRuntime("cluster")
+    # Runs for the same project must not interleave their theme resets and inserts
+    project_locks = defaultdict(asyncio.Lock)
 
     async def handle(msg):
         data = msg.data.decode()
         try:
             payload = json.loads(data)
             project_id = payload["projectId"]
+            mode = payload.get("mode", "incremental")
         except Exception:
             return
 
         try:
-            # Fetch sections with embeddings
-            sections_data = fetch_project_sections_with_embeddings(engine, project_id)
-            
-            if not sections_data or len(sections_data) < 10:
-                print(f"Insufficient data for clustering: {len(sections_data)} sections")
-                return
-            
-            # Extract embeddings and metadata
-            embeddings = []
-            section_metadata = []
-            
-            for section in sections_data:
-                if section['embedding']:
-                    embeddings.append(section['embedding'])
-                    section_metadata.append({
-                        'id': section['id'],
-                        'document_id': section['document_id'],
-                        'text': section['text']
-                    })
-            
-            if not embeddings:
-                print("No embeddings found for clustering")
-                return
-            
-            # Convert to numpy array
-            embeddings_array = np.array(embeddings)
-            
-            # Determine optimal number of clusters
-            optimal_k, silhouette_score = worker.determine_optimal_clusters(embeddings_array)
-            print(f"Optimal clusters: {optimal_k}, Silhouette score: {silhouette_score:.3f}")
-            
-            # Perform clustering
-            cluster_labels, actual_silhouette, cluster_centers = worker.perform_clustering(
-                embeddings_array, optimal_k
-            )
-            
-            # Build theme hierarchy
-            themes = worker.build_theme_hierarchy(cluster_labels, cluster_centers, embeddings_array)
-            
-            # Reset existing themes for project
-            reset_project_themes(engine, project_id)
-            
-            # Create themes and assignments
-            for theme in themes:
-                # Create theme record
-                theme_id = insert_theme(engine, project_id, f"Theme {theme['cluster_id']}", {
-                    'method': 'kmeans',
-                    'silhouette': actual_silhouette,
-                    'cluster_id': theme['cluster_id'],
-                    'size': theme['size'],
-                    'avg_distance': float(theme['avg_distance']),
-                    'is_main_theme': theme['is_main_theme']
-                })
-                
-                # Create theme assignments
-                doc_weight_items = []
-                for section_idx in theme['section_indices']:
-                    section_meta = section_metadata[section_idx]
-                    # Calculate weight based on distance to center
-                    distance = np.linalg.norm(embeddings_array[section_idx] - theme['center'])
-                    weight = max(0.1, 1.0 - distance / np.max([np.linalg.norm(emb - theme['center']) for emb in embeddings_array]))
-                    doc_weight_items.append((section_meta['document_id'], weight))
-                
-                insert_theme_assignments(engine, theme_id, doc_weight_items)
+            async with project_locks[project_id]:
+                if mode != "full" and await run_incremental(project_id):
+                    return
+                if not await run_full(project_id):
+                    return
             
             # Trigger labeling
             await nc.publish("label.run", json.dumps({
@@ -179,7 +278,90 @@ async def main():
         except Exception as e:
             print(f"Error in clustering: {e}")
 
-    await nc.subscribe("cluster.run", cb=handle)
+    async def run_full(project_id):
+        """Re-cluster the whole project and replace its themes; False when there was too little data"""
+        # Read all embeddings into one contiguous float32 matrix
+        section_metadata, embeddings_array = await runtime.run_io(fetch_project_embedding_matrix, engine, project_id)
+
+        if len(embeddings_array) < 10:
+            print(f"Insufficient data for clustering: {len(embeddings_array)} sections")
+            return False
+
+        # Determine optimal number of clusters; fast mode fans k blocks out over the process pool
+        optimal_k, silhouette_score = await runtime.run_io(
+            worker.determine_optimal_clusters, embeddings_array, executor=runtime.process_pool
+        )
+        print(f"Optimal clusters: {optimal_k}, Silhouette score: {silhouette_score:.3f}")
+
+        # Perform clustering
+        cluster_labels, actual_silhouette, cluster_centers = await runtime.run_cpu(
+            worker.perform_clustering, embeddings_array, optimal_k
+        )
+
+        # Build theme hierarchy from a single section-to-center distance matrix
+        distances = await runtime.run_io(worker.compute_center_distances, embeddings_array, cluster_centers)
+        themes = worker.build_theme_hierarchy(cluster_labels, cluster_centers, distances)
+
+        await runtime.run_io(write_themes, project_id, themes, section_metadata, actual_silhouette)
+        return True
+
+    def write_themes(project_id, themes, section_metadata, actual_silhouette):
+        # Reset existing themes for project
+        reset_project_themes(engine, project_id)
+
+        # Create themes and assignments
+        for theme in themes:
+            # Create theme record
+            theme_id = insert_theme(engine, project_id, f"Theme {theme['cluster_id']}", {
+                'method': 'kmeans',
+                'silhouette': actual_silhouette,
+                'cluster_id': theme['cluster_id'],
+                'size': theme['size'],
+                'avg_distance': float(theme['avg_distance']),
+                'is_main_theme': theme['is_main_theme']
+            }, centroid=theme['center'], section_count=theme['size'],
+                mean_sq_distance=theme['mean_sq_distance'], max_distance=theme['max_distance'])
+
+            # Create theme assignments
+            doc_weight_items = [
+                (section_metadata[section_idx]['document_id'], weight)
+                for section_idx, weight in zip(theme['section_indices'], theme['section_weights'], strict=True)
+            ]
+
+            insert_theme_assignments(engine, theme_id, doc_weight_items)
+
+    async def run_incremental(project_id):
+        """Fold newly embedded sections into existing themes; False means a full run is needed"""
+        themes, centroids = await runtime.run_io(fetch_project_theme_centroids, engine, project_id)
+        if not themes:
+            return False
+
+        section_metadata, new_embeddings = await runtime.run_io(fetch_unassigned_section_embeddings, engine, project_id)
+        if not len(new_embeddings):
+            print(f"No new sections to cluster for project {project_id}")
+            return True
+
+        assignments, updates, drift = await runtime.run_io(worker.assign_incrementally, new_embeddings, themes, centroids)
+        if drift:
+            print(f"Re-clustering project {project_id} from scratch: {drift}")
+            return False
+
+        for theme_idx, members in assignments.items():
+            await runtime.run_io(insert_theme_assignments, engine, themes[theme_idx]['id'], [
+                (section_metadata[section_idx]['document_id'], weight) for section_idx, weight in members
+            ])
+        await runtime.run_io(update_theme_centroids, engine, updates)
+
+        # Relabel only the themes that gained sections, in one project-wide labeling pass
+        await nc.publish("label.run", json.dumps({
+            "projectId": project_id,
+            "themeIds": [str(update['id']) for update in updates]
+        }))
+
+        print(f"Assigned {len(new_embeddings)} new sections to {len(updates)} existing themes")
+        return True
+
+    await runtime.subscribe(nc, "cluster.run", handle)
     while True:
         await asyncio.sleep(5)
 
@@ -1,6 +1,32 @@
+import io
+import json
 import os
+import struct
+import uuid
+
+import numpy as np
+from psycopg2.extensions import AsIs, register_adapter
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+
+EMBEDDING_DIM = 384
+EMBEDDING_WRITE_BATCH_SIZE = int(os.getenv("EMBEDDING_WRITE_BATCH_SIZE", "2000"))
+READ_CHUNK_SIZE = int(os.getenv("DB_READ_CHUNK_SIZE", "1000"))
+ANN_EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", "40"))
+# pgvector rejects hnsw.ef_search outside [1, 1000]
+ANN_MAX_EF_SEARCH = 1000
+# Upper bound on index tuples an iterative HNSW scan visits to fill a filtered LIMIT
+ANN_MAX_SCAN_TUPLES = int(os.getenv("ANN_MAX_SCAN_TUPLES", "20000"))
+
+_MIN_UUID = "00000000-0000-0000-0000-000000000000"
+
+# pgvector binary wire format (vector_send/vector_recv): int16 dim, int16 unused,
+# then dim big-endian float4 values. COPY binary wraps each field in an int32 length.
+_VECTOR_HEADER_BYTES = 4
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack("!h", -1)
+_COPY_FIELD_TYPES = {"uuid": "S16", "int2": ">i2", "int4": ">i4", "float4": ">f4", "float8": ">f8"}
 
 
 def get_database_url() -> str:
@@ -12,63 +38,472 @@ def get_database_url() -> str:
     return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}"
 
 
+class PgVector:
+    """A 1-D float vector bound as a pgvector `vector` query parameter.
+
+    Only this wrapper is adapted, so other numpy bind parameters keep psycopg2's handling.
+    Bulk writes of stored vectors go through binary COPY instead (see encode_copy_binary).
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32)
+        if self.values.ndim != 1:
+            raise ValueError(f"PgVector needs a 1-D array, got shape {self.values.shape}")
+
+
+def _adapt_vector(vector: PgVector):
+    # psycopg2 only sends text parameters; 9 significant digits round-trip any float32
+    values = ",".join(f"{v:.9g}" for v in vector.values.tolist())
+    return AsIs(f"'[{values}]'::vector")
+
+
+def register_vector_codec() -> None:
+    """Let PgVector values be passed straight through as `vector` bind parameters."""
+    register_adapter(PgVector, _adapt_vector)
+
+
 def create_db_engine() -> Engine:
+    register_vector_codec()
     return create_engine(get_database_url(), pool_pre_ping=True, future=True)
 
 
-def fetch_sections_without_embeddings(engine: Engine, project_id: str):
+def encode_copy_binary(columns) -> bytes:
+    """Pack columns into a COPY ... (FORMAT binary) payload without per-element Python values.
+
+    `columns` is a list of (kind, values) pairs, one per table column in COPY order. kind is
+    "uuid", "int2", "int4", "float4", "float8" or "vector" (a 2-D float array, sent as vector_send);
+    NULLs are not supported.
+    """
+    n = len(columns[0][1]) if columns else 0
+    fields = [("nfields", ">i2")]
+    for i, (kind, values) in enumerate(columns):
+        fields.append((f"len{i}", ">i4"))
+        if kind == "vector":
+            dim = np.shape(values)[1]
+            fields += [(f"dim{i}", ">i2"), (f"unused{i}", ">i2"), (f"value{i}", ">f4", (dim,))]
+        else:
+            fields.append((f"value{i}", _COPY_FIELD_TYPES[kind]))
+    rows = np.empty(n, dtype=np.dtype(fields))
+    rows["nfields"] = len(columns)
+    for i, (kind, values) in enumerate(columns):
+        size = rows.dtype[f"value{i}"].itemsize
+        if kind == "uuid":
+            values = [uuid.UUID(str(v)).bytes for v in values]
+        elif kind == "vector":
+            rows[f"dim{i}"] = np.shape(values)[1]
+            rows[f"unused{i}"] = 0
+            size += _VECTOR_HEADER_BYTES
+        rows[f"len{i}"] = size
+        rows[f"value{i}"] = values
+    return _PGCOPY_HEADER + rows.tobytes() + _PGCOPY_TRAILER
+
+
+def encode_vectors_copy_binary(section_ids, vectors) -> bytes:
+    """Pack (uuid, vector) rows into a COPY ... (FORMAT binary) payload."""
+    return encode_copy_binary([("uuid", section_ids), ("vector", np.asarray(vectors, dtype=np.float32))])
+
+
+def _copy_binary(conn, target: str, payload: bytes) -> None:
+    """COPY a binary payload into `target` ("table (column, ...)") within the connection's transaction."""
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {target} FROM STDIN WITH (FORMAT binary)", io.BytesIO(payload))
+    finally:
+        cursor.close()
+
+
+def decode_vectors_into(buffers, out: np.ndarray) -> np.ndarray:
+    """Decode vector_send() buffers row by row into a preallocated float32 matrix."""
+    dim = out.shape[1]
+    for i, buf in enumerate(buffers):
+        out[i] = np.frombuffer(buf, dtype=">f4", count=dim, offset=_VECTOR_HEADER_BYTES)
+    return out
+
+
+def _iter_keyset_chunks(engine: Engine, sql, params: dict, chunk_size: int | None = None):
+    """Page through `sql` by keyset on s.id, yielding lists of at most `chunk_size` rows.
+
+    `sql` must filter on `s.id > :last_id` and end with `ORDER BY s.id LIMIT :limit`.
+    LIMIT bounds each page, so it is fetched whole on its own short-lived connection and
+    a slow consumer never pins a transaction open across the whole scan.
+    """
+    chunk_size = chunk_size or READ_CHUNK_SIZE
+    last_id = _MIN_UUID
+    while True:
+        with engine.connect() as conn:
+            chunk = conn.execute(sql, {**params, "last_id": last_id, "limit": chunk_size}).mappings().all()
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]["id"]
+
+
+def iter_sections_without_embeddings(engine: Engine, project_id: str, chunk_size: int | None = None):
     sql = text(
         """
         SELECT s.id, s.text
         FROM sections s
         JOIN documents d ON d.id = s."documentId"
-        WHERE d."projectId" = :project_id AND s.embedding IS NULL
-        LIMIT 5000
+        WHERE d."projectId" = :project_id AND s.embedding IS NULL AND s.id > :last_id
+        ORDER BY s.id
+        LIMIT :limit
         """
     )
-    with engine.connect() as conn:
-        rows = conn.execute(sql, {"project_id": project_id}).mappings().all()
-    return rows
+    yield from _iter_keyset_chunks(engine, sql, {"project_id": project_id}, chunk_size)
 
 
 def upsert_section_embeddings(engine: Engine, id_to_vector):
-    # id_to_vector: dict[str, list[float]]
-    sql = text("UPDATE sections SET embedding = :embedding WHERE id = :id")
+    # id_to_vector: dict[str, array-like of float]
+    bulk_upsert_section_embeddings(engine, list(id_to_vector.keys()), list(id_to_vector.values()))
+
+
+def bulk_upsert_section_embeddings(engine: Engine, section_ids, vectors, batch_size: int | None = None):
+    """Write embeddings with one binary COPY + one merging UPDATE per batch instead of one UPDATE per section."""
+    batch_size = batch_size or EMBEDDING_WRITE_BATCH_SIZE
+    vectors = np.asarray(vectors, dtype=np.float32)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TEMP TABLE IF NOT EXISTS tmp_section_embeddings "
+            "(id uuid PRIMARY KEY, embedding vector(384)) ON COMMIT DROP"
+        ))
+        for start in range(0, len(section_ids), batch_size):
+            _copy_binary(conn, "tmp_section_embeddings (id, embedding)", encode_vectors_copy_binary(
+                section_ids[start:start + batch_size], vectors[start:start + batch_size]
+            ))
+            conn.execute(text(
+                "UPDATE sections s SET embedding = t.embedding "
+                "FROM tmp_section_embeddings t WHERE s.id = t.id"
+            ))
+            conn.execute(text("TRUNCATE tmp_section_embeddings"))
+
+
+def insert_section_chunks(engine: Engine, chunks):
+    """Replace the chunk rows of the given sections with one binary COPY + one INSERT ... SELECT.
+
+    `chunks` is a list of dicts with section_id, ordinal, start_char, end_char and embedding.
+    """
+    if not chunks:
+        return
+    payload = encode_copy_binary([
+        ("uuid", [chunk["section_id"] for chunk in chunks]),
+        ("int2", [chunk["ordinal"] for chunk in chunks]),
+        ("int4", [chunk["start_char"] for chunk in chunks]),
+        ("int4", [chunk["end_char"] for chunk in chunks]),
+        ("vector", np.asarray([chunk["embedding"] for chunk in chunks], dtype=np.float32)),
+    ])
     with engine.begin() as conn:
-        for sid, vec in id_to_vector.items():
-            conn.execute(sql, {"id": sid, "embedding": vec})
+        conn.execute(
+            text('DELETE FROM section_chunks WHERE "sectionId" = ANY(CAST(:ids AS uuid[]))'),
+            {"ids": list({str(chunk["section_id"]) for chunk in chunks})},
+        )
+        conn.execute(text(
+            "CREATE TEMP TABLE IF NOT EXISTS tmp_section_chunks "
+            '("sectionId" uuid, ordinal smallint, "startChar" int, "endChar" int, embedding vector(384)) '
+            "ON COMMIT DROP"
+        ))
+        _copy_binary(conn, 'tmp_section_chunks ("sectionId", ordinal, "startChar", "endChar", embedding)', payload)
+        conn.execute(text(
+            'INSERT INTO section_chunks ("sectionId", ordinal, "startChar", "endChar", embedding) '
+            'SELECT "sectionId", ordinal, "startChar", "endChar", embedding FROM tmp_section_chunks'
+        ))
+
+
+def _iter_project_embedding_rows(engine: Engine, project_id: str, chunk_size: int | None = None,
+                                 unassigned_only: bool = False):
+    # Unassigned = the section's document has no theme assignment in this project yet
+    unassigned_sql = (
+        """ AND NOT EXISTS (
+            SELECT 1 FROM theme_assignments ta JOIN themes t ON t.id = ta."themeId"
+            WHERE ta."documentId" = d.id AND t."projectId" = :project_id
+        )"""
+        if unassigned_only else ""
+    )
+    sql = text(
+        f"""
+        SELECT s.id, s.text, d.id as document_id, vector_send(s.embedding) AS embedding
+        FROM sections s
+        JOIN documents d ON d.id = s."documentId"
+        WHERE d."projectId" = :project_id AND s.embedding IS NOT NULL AND s.id > :last_id{unassigned_sql}
+        ORDER BY s.id
+        LIMIT :limit
+        """
+    )
+    yield from _iter_keyset_chunks(engine, sql, {"project_id": project_id}, chunk_size)
 
 
-def fetch_project_sections_with_embeddings(engine: Engine, project_id: str):
+def _section_rows(chunk):
+    return [{"id": row["id"], "text": row["text"], "document_id": row["document_id"]} for row in chunk]
+
+
+def count_project_sections_with_embeddings(engine: Engine, project_id: str) -> int:
     sql = text(
         """
-        SELECT s.id, s.text, d.id as document_id, s.embedding
+        SELECT count(*)
         FROM sections s
         JOIN documents d ON d.id = s."documentId"
         WHERE d."projectId" = :project_id AND s.embedding IS NOT NULL
-        LIMIT 20000
         """
     )
     with engine.connect() as conn:
-        rows = conn.execute(sql, {"project_id": project_id}).mappings().all()
+        return conn.execute(sql, {"project_id": project_id}).scalar_one()
+
+
+def fetch_project_embedding_matrix(engine: Engine, project_id: str):
+    """Return (rows, embeddings) for the whole project, filling one preallocated (n, 384) float32 matrix."""
+    capacity = count_project_sections_with_embeddings(engine, project_id)
+    embeddings = np.empty((capacity, EMBEDDING_DIM), dtype=np.float32)
+    rows = []
+    for chunk in _iter_project_embedding_rows(engine, project_id):
+        # Sections embedded after the count are picked up on the next run
+        chunk = chunk[:capacity - len(rows)]
+        decode_vectors_into((row["embedding"] for row in chunk), embeddings[len(rows):len(rows) + len(chunk)])
+        rows.extend(_section_rows(chunk))
+        if len(rows) == capacity:
+            break
+    return rows, embeddings[:len(rows)]
+
+
+def _document_filter_sql(filters: dict | None, params: dict) -> str:
+    """Translate Q&A document filters into extra WHERE clauses on `d`, filling `params`."""
+    filters = filters or {}
+    clauses = []
+    if filters.get("year"):
+        clauses.append("d.year = :year")
+        params["year"] = int(filters["year"])
+    if filters.get("min_year"):
+        clauses.append("d.year >= :min_year")
+        params["min_year"] = int(filters["min_year"])
+    if filters.get("max_year"):
+        clauses.append("d.year <= :max_year")
+        params["max_year"] = int(filters["max_year"])
+    if filters.get("venue"):
+        clauses.append("lower(d.venue) = lower(:venue)")
+        params["venue"] = filters["venue"]
+    if filters.get("documentIds"):
+        clauses.append("d.id = ANY(CAST(:document_ids AS uuid[]))")
+        params["document_ids"] = list(filters["documentIds"])
+    if filters.get("themeId"):
+        clauses.append(
+            'EXISTS (SELECT 1 FROM theme_assignments ta WHERE ta."documentId" = d.id AND ta."themeId" = :theme_id)'
+        )
+        params["theme_id"] = filters["themeId"]
+    return "".join(f" AND {clause}" for clause in clauses)
+
+
+def _configure_hnsw_scan(conn, k: int, ef_search: int | None = None) -> None:
+    """Set transaction-local HNSW search options for a filtered top-k query.
+
+    The project and document filters are applied after the index scan, so a plain scan
+    returns only the ef_search nearest rows of the whole table. An iterative scan
+    (pgvector >= 0.8) keeps walking the graph until LIMIT is filled or
+    ANN_MAX_SCAN_TUPLES is reached. Older pgvector versions reject the option; callers
+    fall back to exact scoring when they get fewer than k rows.
+    """
+    # ef_search below k would cap the candidate list, so never go under it
+    ef_search = min(max(ef_search or ANN_EF_SEARCH, k), ANN_MAX_EF_SEARCH)
+    conn.execute(text("SELECT set_config('hnsw.ef_search', :ef, true)"), {"ef": str(ef_search)})
+    try:
+        with conn.begin_nested():
+            conn.execute(text("SELECT set_config('hnsw.iterative_scan', 'relaxed_order', true)"))
+            conn.execute(
+                text("SELECT set_config('hnsw.max_scan_tuples', :tuples, true)"), {"tuples": str(ANN_MAX_SCAN_TUPLES)}
+            )
+    except DBAPIError:
+        pass
+
+
+def search_similar_sections(engine: Engine, project_id: str, query_vector, k: int,
+                            ef_search: int | None = None, filters: dict | None = None):
+    """Nearest sections by cosine distance, served by the HNSW index on sections.embedding."""
+    params = {"project_id": project_id, "query": PgVector(query_vector), "k": k}
+    filter_sql = _document_filter_sql(filters, params)
+    # relaxed_order may return rows slightly out of order, so re-sort the materialized hits
+    sql = text(
+        f"""
+        WITH hits AS MATERIALIZED (
+            SELECT s.id, s.text, d.id as document_id, d.title, s.embedding <=> :query AS distance
+            FROM sections s
+            JOIN documents d ON d.id = s."documentId"
+            WHERE d."projectId" = :project_id AND s.embedding IS NOT NULL{filter_sql}
+            ORDER BY s.embedding <=> :query
+            LIMIT :k
+        )
+        SELECT id, text, document_id, title, 1 - distance AS similarity
+        FROM hits
+        ORDER BY distance
+        """
+    )
+    with engine.begin() as conn:
+        _configure_hnsw_scan(conn, k, ef_search)
+        rows = conn.execute(sql, params).mappings().all()
+    return rows
+
+
+def search_similar_chunks(engine: Engine, project_id: str, query_vector, k: int,
+                          ef_search: int | None = None, filters: dict | None = None):
+    """Nearest chunks of long sections, with the character span of the matching passage."""
+    params = {"project_id": project_id, "query": PgVector(query_vector), "k": k}
+    filter_sql = _document_filter_sql(filters, params)
+    sql = text(
+        f"""
+        WITH hits AS MATERIALIZED (
+            SELECT s.id, s.text, d.id as document_id, d.title,
+                   c."startChar" AS start_char, c."endChar" AS end_char,
+                   c.embedding <=> :query AS distance
+            FROM section_chunks c
+            JOIN sections s ON s.id = c."sectionId"
+            JOIN documents d ON d.id = s."documentId"
+            WHERE d."projectId" = :project_id{filter_sql}
+            ORDER BY c.embedding <=> :query
+            LIMIT :k
+        )
+        SELECT id, text, document_id, title, start_char, end_char, 1 - distance AS similarity
+        FROM hits
+        ORDER BY distance
+        """
+    )
+    with engine.begin() as conn:
+        _configure_hnsw_scan(conn, k, ef_search)
+        rows = conn.execute(sql, params).mappings().all()
     return rows
 
 
+def fetch_sections_by_ids(engine: Engine, project_id: str, section_ids, query_vector,
+                          filters: dict | None = None):
+    """Load candidate sections by id with their cosine similarity to `query_vector`, applying Q&A filters."""
+    if not section_ids:
+        return []
+    params = {
+        "project_id": project_id,
+        "ids": list(section_ids),
+        "query": PgVector(query_vector),
+    }
+    filter_sql = _document_filter_sql(filters, params)
+    sql = text(
+        f"""
+        SELECT s.id, s.text, d.id as document_id, d.title,
+               COALESCE(1 - (s.embedding <=> :query), 0) AS similarity
+        FROM sections s
+        JOIN documents d ON d.id = s."documentId"
+        WHERE d."projectId" = :project_id AND s.id = ANY(CAST(:ids AS uuid[])){filter_sql}
+        """
+    )
+    with engine.connect() as conn:
+        rows = conn.execute(sql, params).mappings().all()
+    return rows
+
+
+def fetch_unassigned_section_embeddings(engine: Engine, project_id: str):
+    """Return (rows, embeddings) for embedded sections whose documents are not yet assigned to a theme."""
+    rows, chunks = [], []
+    for chunk in _iter_project_embedding_rows(engine, project_id, unassigned_only=True):
+        embeddings = np.empty((len(chunk), EMBEDDING_DIM), dtype=np.float32)
+        chunks.append(decode_vectors_into((row["embedding"] for row in chunk), embeddings))
+        rows.extend(_section_rows(chunk))
+    if not chunks:
+        return rows, np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    return rows, np.concatenate(chunks)
+
+
+def fetch_filtered_document_ids(engine: Engine, project_id: str, filters: dict | None = None):
+    params = {"project_id": project_id}
+    filter_sql = _document_filter_sql(filters, params)
+    sql = text(f'SELECT d.id FROM documents d WHERE d."projectId" = :project_id{filter_sql}')
+    with engine.connect() as conn:
+        return conn.execute(sql, params).scalars().all()
+
+
+def fetch_document_project_id(engine: Engine, document_id: str):
+    sql = text('SELECT "projectId" FROM documents WHERE id = :doc_id')
+    with engine.connect() as conn:
+        return conn.execute(sql, {"doc_id": document_id}).scalar()
+
+
 def reset_project_themes(engine: Engine, project_id: str):
     with engine.begin() as conn:
         conn.execute(text('DELETE FROM theme_assignments USING themes t WHERE theme_assignments."themeId" = t.id AND t."projectId" = :pid'), {"pid": project_id})
         conn.execute(text('DELETE FROM themes WHERE "projectId" = :pid'), {"pid": project_id})
 
 
-def insert_theme(engine: Engine, project_id: str, label: str, provenance: dict) -> str:
+def insert_theme(engine: Engine, project_id: str, label: str, provenance: dict, centroid=None,
+                 section_count: int | None = None, mean_sq_distance: float | None = None,
+                 max_distance: float | None = None) -> str:
     sql = text(
-        'INSERT INTO themes ("projectId", label, provenance) VALUES (:pid, :label, :prov) RETURNING id'
+        'INSERT INTO themes ("projectId", label, provenance, centroid, "sectionCount", "meanSqDistance", "maxDistance") '
+        'VALUES (:pid, :label, :prov, :centroid, :count, :mean_sq, :max_dist) RETURNING id'
     )
     with engine.begin() as conn:
-        row = conn.execute(sql, {"pid": project_id, "label": label, "prov": provenance}).first()
+        row = conn.execute(sql, {
+            "pid": project_id,
+            "label": label,
+            "prov": provenance,
+            "centroid": None if centroid is None else PgVector(centroid),
+            "count": section_count,
+            "mean_sq": mean_sq_distance,
+            "max_dist": max_distance
+        }).first()
         return row[0]
 
 
+def fetch_project_theme_centroids(engine: Engine, project_id: str):
+    """Return (themes, centroids) for themes that carry clustering state; centroids is (k, 384) float32."""
+    sql = text(
+        """
+        SELECT id, "sectionCount", "meanSqDistance", "maxDistance", vector_send(centroid) AS centroid
+        FROM themes
+        WHERE "projectId" = :pid AND centroid IS NOT NULL
+        ORDER BY id
+        """
+    )
+    with engine.connect() as conn:
+        rows = conn.execute(sql, {"pid": project_id}).mappings().all()
+    centroids = decode_vectors_into(
+        (row["centroid"] for row in rows), np.empty((len(rows), EMBEDDING_DIM), dtype=np.float32)
+    )
+    themes = [
+        {
+            "id": row["id"],
+            "section_count": row["sectionCount"] or 0,
+            "mean_sq_distance": row["meanSqDistance"] or 0.0,
+            "max_distance": row["maxDistance"] or 0.0
+        }
+        for row in rows
+    ]
+    return themes, centroids
+
+
+def update_theme_centroids(engine: Engine, updates):
+    """Write incremental clustering state with one binary COPY and one UPDATE instead of one UPDATE per theme."""
+    # updates: list[dict(id, centroid, section_count, mean_sq_distance, max_distance)]
+    if not updates:
+        return
+    payload = encode_copy_binary([
+        ("uuid", [update["id"] for update in updates]),
+        ("vector", np.array([update["centroid"] for update in updates], dtype=np.float32)),
+        ("int4", [int(update["section_count"]) for update in updates]),
+        ("float4", [float(update["mean_sq_distance"]) for update in updates]),
+        ("float4", [float(update["max_distance"]) for update in updates]),
+    ])
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TEMP TABLE IF NOT EXISTS tmp_theme_centroids "
+            '(id uuid PRIMARY KEY, centroid vector, "sectionCount" int, "meanSqDistance" real, "maxDistance" real) '
+            "ON COMMIT DROP"
+        ))
+        _copy_binary(
+            conn, 'tmp_theme_centroids (id, centroid, "sectionCount", "meanSqDistance", "maxDistance")', payload
+        )
+        conn.execute(text(
+            'UPDATE themes t SET centroid = v.centroid, "sectionCount" = v."sectionCount", '
+            '"meanSqDistance" = v."meanSqDistance", "maxDistance" = v."maxDistance" '
+            "FROM tmp_theme_centroids v WHERE t.id = v.id"
+        ))
+
+
 def insert_theme_assignments(engine: Engine, theme_id: str, doc_weight_items):
     # doc_weight_items: list[tuple[doc_id, weight]]
     sql = text(
@@ -80,26 +515,134 @@ def insert_theme_assignments(engine: Engine, theme_id: str, doc_weight_items):
             conn.execute(sql, {"tid": theme_id, "did": doc_id, "w": float(weight)})
 
 
-def fetch_theme_sections_for_labeling(engine: Engine, theme_id: str):
+def fetch_project_theme_assignments(engine: Engine, project_id: str):
+    """(theme_id, document_id) pairs for every theme of a project"""
     sql = text(
         """
-        SELECT s.text
+        SELECT ta."themeId" AS theme_id, ta."documentId" AS document_id
         FROM theme_assignments ta
-        JOIN documents d ON d.id = ta."documentId"
-        JOIN sections s ON s."documentId" = d.id
-        WHERE ta."themeId" = :tid
-        LIMIT 10000
+        JOIN themes t ON t.id = ta."themeId"
+        WHERE t."projectId" = :pid
         """
     )
     with engine.connect() as conn:
-        rows = conn.execute(sql, {"tid": theme_id}).scalars().all()
-    return rows
+        return conn.execute(sql, {"pid": project_id}).mappings().all()
+
+
+def iter_project_sections_for_labeling(engine: Engine, project_id: str, chunk_size: int | None = None):
+    """Each section of the project's theme-assigned documents, once, in keyset-paginated chunks"""
+    sql = text(
+        """
+        SELECT s.id, s.text, s."documentId" AS document_id
+        FROM sections s
+        JOIN documents d ON d.id = s."documentId"
+        WHERE d."projectId" = :pid AND s.id > :last_id
+          AND EXISTS (SELECT 1 FROM theme_assignments ta WHERE ta."documentId" = d.id)
+        ORDER BY s.id
+        LIMIT :limit
+        """
+    )
+    yield from _iter_keyset_chunks(engine, sql, {"pid": project_id}, chunk_size)
+
+
+def iter_project_section_tokens(engine: Engine, project_id: str, chunk_size: int | None = None):
+    """Like iter_project_sections_for_labeling, but with the stored term ids instead of the text.
+
+    text is only returned for sections ingested before "tokenIds" existed.
+    """
+    sql = text(
+        """
+        SELECT s.id, s."documentId" AS document_id, s."tokenIds" AS token_ids,
+               CASE WHEN s."tokenIds" IS NULL THEN s.text END AS text
+        FROM sections s
+        JOIN documents d ON d.id = s."documentId"
+        WHERE d."projectId" = :pid AND s.id > :last_id
+          AND EXISTS (SELECT 1 FROM theme_assignments ta WHERE ta."documentId" = d.id)
+        ORDER BY s.id
+        LIMIT :limit
+        """
+    )
+    yield from _iter_keyset_chunks(engine, sql, {"pid": project_id}, chunk_size)
+
+
+def iter_project_section_terms(engine: Engine, project_id: str, chunk_size: int | None = None):
+    """Stored term ids of every section of a project (text only where "tokenIds" is missing)"""
+    sql = text(
+        """
+        SELECT s.id, s."tokenIds" AS token_ids, CASE WHEN s."tokenIds" IS NULL THEN s.text END AS text
+        FROM sections s
+        JOIN documents d ON d.id = s."documentId"
+        WHERE d."projectId" = :pid AND s.id > :last_id
+        ORDER BY s.id
+        LIMIT :limit
+        """
+    )
+    yield from _iter_keyset_chunks(engine, sql, {"pid": project_id}, chunk_size)
+
+
+def fetch_project_section_fingerprint(engine: Engine, project_id: str):
+    """[count, sum] over the project's section ids; see lexical_index.section_fingerprint"""
+    sql = text(
+        """
+        SELECT count(*), COALESCE(sum(('x' || substr(replace(s.id::text, '-', ''), 1, 15))::bit(60)::bigint), 0)
+        FROM sections s
+        JOIN documents d ON d.id = s."documentId"
+        WHERE d."projectId" = :pid
+        """
+    )
+    with engine.connect() as conn:
+        count, total = conn.execute(sql, {"pid": project_id}).one()
+    return [int(count), int(total)]
+
+
+def store_section_token_ids(engine: Engine, section_ids, token_ids):
+    """Backfill packed term ids of existing sections in one UPDATE"""
+    if not section_ids:
+        return
+    sql = text(
+        """
+        UPDATE sections SET "tokenIds" = t.tokens
+        FROM unnest(CAST(:ids AS uuid[]), CAST(:tokens AS bytea[])) AS t(id, tokens)
+        WHERE sections.id = t.id
+        """
+    )
+    with engine.begin() as conn:
+        conn.execute(sql, {"ids": [str(i) for i in section_ids], "tokens": list(token_ids)})
+
 
+def fetch_section_texts(engine: Engine, section_ids):
+    """{section_id: text} for the given sections"""
+    if not section_ids:
+        return {}
+    sql = text('SELECT id, text FROM sections WHERE id = ANY(CAST(:ids AS uuid[]))')
+    with engine.connect() as conn:
+        rows = conn.execute(sql, {"ids": [str(i) for i in section_ids]}).all()
+    return {str(row[0]): row[1] for row in rows}
 
-def update_theme_label_and_provenance(engine: Engine, theme_id: str, label: str, provenance: dict):
-    sql = text('UPDATE themes SET label = :label, provenance = :prov WHERE id = :id')
+
+def fetch_theme_project_id(engine: Engine, theme_id: str):
+    sql = text('SELECT "projectId" FROM themes WHERE id = :tid')
+    with engine.connect() as conn:
+        return conn.execute(sql, {"tid": theme_id}).scalar()
+
+
+def update_theme_labels_and_provenance(engine: Engine, updates):
+    """Write many (theme_id, label, provenance) updates with one UPDATE in one transaction"""
+    if not updates:
+        return
+    sql = text(
+        """
+        UPDATE themes SET label = u.label, provenance = CAST(u.prov AS jsonb)
+        FROM unnest(CAST(:ids AS uuid[]), CAST(:labels AS varchar[]), CAST(:provs AS text[])) AS u(id, label, prov)
+        WHERE themes.id = u.id
+        """
+    )
     with engine.begin() as conn:
-        conn.execute(sql, {"label": label, "prov": provenance, "id": theme_id})
+        conn.execute(sql, {
+            "ids": [str(theme_id) for theme_id, _, _ in updates],
+            "labels": [label for _, label, _ in updates],
+            "provs": [json.dumps(provenance) for _, _, provenance in updates],
+        })
 
 
 def fetch_theme_sections_for_summary(engine: Engine, theme_id: str):
@@ -231,6 +774,219 @@ def update_document_status(engine: Engine, document_id: str, status: str):
         conn.execute(sql, {"status": status, "doc_id": document_id})
 
 
+def fetch_cached_sections(engine: Engine, content_hash: str):
+    """Sections previously extracted from a PDF with this content hash, or None"""
+    sql = text("SELECT sections FROM content_cache WHERE hash = :hash")
+    with engine.connect() as conn:
+        return conn.execute(sql, {"hash": content_hash}).scalar()
+
+
+def store_cached_sections(engine: Engine, content_hash: str, sections):
+    sql = text("INSERT INTO content_cache (hash, sections) VALUES (:hash, :sections) ON CONFLICT (hash) DO NOTHING")
+    with engine.begin() as conn:
+        conn.execute(sql, {"hash": content_hash, "sections": json.dumps(sections)})
+
+
+def _content_scope_sql(document_id: str | None, project_id: str | None, params: dict) -> str:
+    if document_id:
+        params["doc_id"] = document_id
+        return 'd.id = :doc_id'
+    params["project_id"] = project_id
+    return 'd."projectId" = :project_id'
+
+
+# Documents point at their parsed content by "contentHash" (set at ingest; documents.hash stays
+# unset for duplicates). Sections line up with it by text; ordinals index content_cache.sections
+_CACHED_CONTENT_JOIN = """
+    FROM documents d
+    JOIN content_cache cc ON cc.hash = d."contentHash"
+    CROSS JOIN LATERAL jsonb_array_elements(cc.sections) WITH ORDINALITY AS e(section, ordinal)
+"""
+
+
+def copy_cached_section_embeddings(engine: Engine, model: str, document_id: str | None = None,
+                                   project_id: str | None = None) -> int:
+    """Fill missing section embeddings from the content cache; returns the number of sections filled"""
+    params = {"model": model}
+    scope_sql = _content_scope_sql(document_id, project_id, params)
+    chunks_sql = text(
+        f"""
+        INSERT INTO section_chunks ("sectionId", ordinal, "startChar", "endChar", embedding)
+        SELECT s.id, c.chunk, c."startChar", c."endChar", c.embedding
+        {_CACHED_CONTENT_JOIN}
+        JOIN content_chunk_cache c ON c.hash = cc.hash AND c.model = :model AND c.ordinal = e.ordinal
+        JOIN sections s ON s."documentId" = d.id AND s.text = e.section->>'text'
+        WHERE {scope_sql} AND s.embedding IS NULL
+        ON CONFLICT ("sectionId", ordinal) DO NOTHING
+        """
+    )
+    sql = text(
+        f"""
+        UPDATE sections s
+        SET embedding = c.embedding
+        {_CACHED_CONTENT_JOIN}
+        JOIN content_embedding_cache c ON c.hash = cc.hash AND c.model = :model AND c.ordinal = e.ordinal
+        WHERE s."documentId" = d.id AND {scope_sql}
+          AND s.embedding IS NULL AND s.text = e.section->>'text'
+        """
+    )
+    with engine.begin() as conn:
+        conn.execute(chunks_sql, params)
+        return conn.execute(sql, params).rowcount
+
+
+def cache_section_embeddings(engine: Engine, model: str, document_id: str | None = None,
+                             project_id: str | None = None):
+    """Record the embeddings of cached-content sections so other copies of the PDF can reuse them"""
+    params = {"model": model}
+    scope_sql = _content_scope_sql(document_id, project_id, params)
+    sql = text(
+        f"""
+        INSERT INTO content_embedding_cache (hash, model, ordinal, embedding)
+        SELECT DISTINCT ON (cc.hash, e.ordinal) cc.hash, :model, e.ordinal, s.embedding
+        {_CACHED_CONTENT_JOIN}
+        JOIN sections s ON s."documentId" = d.id AND s.text = e.section->>'text'
+        WHERE {scope_sql} AND s.embedding IS NOT NULL
+        ON CONFLICT (hash, model, ordinal) DO NOTHING
+        """
+    )
+    chunks_sql = text(
+        f"""
+        INSERT INTO content_chunk_cache (hash, model, ordinal, chunk, "startChar", "endChar", embedding)
+        SELECT cc.hash, :model, e.ordinal, sc.ordinal, sc."startChar", sc."endChar", sc.embedding
+        {_CACHED_CONTENT_JOIN}
+        JOIN sections s ON s."documentId" = d.id AND s.text = e.section->>'text'
+        JOIN section_chunks sc ON sc."sectionId" = s.id
+        WHERE {scope_sql}
+        ON CONFLICT (hash, model, ordinal, chunk) DO NOTHING
+        """
+    )
+    with engine.begin() as conn:
+        conn.execute(sql, params)
+        conn.execute(chunks_sql, params)
+
+
+def ingest_document_sections(engine: Engine, document_id: str, sections, status: str = "parsed", token_ids=None,
+                             content_hash: str | None = None):
+    """Write all sections of a document with one multi-row INSERT and set its status in the same transaction.
+
+    Section ids are generated here so callers can index the sections without a RETURNING
+    round trip. `token_ids` holds each section's packed term ids (see tokens.pack_term_ids);
+    `content_hash` (the content_cache key of the parsed PDF) is stored as documents."contentHash".
+    Returns (section_ids, project_id).
+    """
+    section_ids = [str(uuid.uuid4()) for _ in sections]
+    insert_sql = text(
+        """
+        INSERT INTO sections (id, "documentId", label, text, "pageNumber", "tokenIds")
+        SELECT s.id, :doc_id, s.label, s.text, s.page, s.tokens
+        FROM unnest(
+            CAST(:ids AS uuid[]), CAST(:labels AS varchar[]), CAST(:texts AS text[]), CAST(:pages AS int[]),
+            CAST(:tokens AS bytea[])
+        ) AS s(id, label, text, page, tokens)
+        """
+    )
+    status_sql = text(
+        'UPDATE documents SET status = :status, "contentHash" = COALESCE(:content_hash, "contentHash") '
+        'WHERE id = :doc_id RETURNING "projectId"'
+    )
+    with engine.begin() as conn:
+        if sections:
+            conn.execute(insert_sql, {
+                "doc_id": document_id,
+                "ids": section_ids,
+                "labels": [section['label'] for section in sections],
+                "texts": [section['text'] for section in sections],
+                "pages": [section['page'] for section in sections],
+                "tokens": list(token_ids) if token_ids is not None else [None] * len(sections),
+            })
+        project_id = conn.execute(
+            status_sql, {"status": status, "content_hash": content_hash, "doc_id": document_id}
+        ).scalar()
+    return section_ids, project_id
+
+
+def fetch_parsed_document_ids(engine: Engine, project_id: str):
+    """Ids of the project's parsed documents, in id order"""
+    sql = text('SELECT id FROM documents WHERE "projectId" = :pid AND status = \'parsed\' ORDER BY id')
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(sql, {"pid": project_id})]
+
+
+def iter_document_sections(engine: Engine, document_ids, chunk_size: int | None = None):
+    """Sections of the given documents in keyset-paginated chunks"""
+    sql = text(
+        """
+        SELECT s.id, s."documentId" AS document_id, s.text
+        FROM sections s
+        WHERE s."documentId" = ANY(CAST(:doc_ids AS uuid[])) AND s.id > :last_id
+        ORDER BY s.id
+        LIMIT :limit
+        """
+    )
+    yield from _iter_keyset_chunks(engine, sql, {"doc_ids": [str(i) for i in document_ids]}, chunk_size)
+
+
+def write_extracted_rows(engine: Engine, document_ids, methods, metrics, datasets):
+    """Write the matrix rows of a run of documents with one multi-row statement per table, in one transaction.
+
+    `methods` holds (document_id, name), `metrics` (document_id, name, value, unit) and
+    `datasets` (document_id, name, size, type) tuples; methods and datasets must be unique
+    on (document_id, name). Metrics of `document_ids` are replaced rather than appended.
+    """
+    methods_sql = text(
+        """
+        INSERT INTO methods ("documentId", name, meta)
+        SELECT m.doc_id, m.name, jsonb_build_object('extracted', true)
+        FROM unnest(CAST(:doc_ids AS uuid[]), CAST(:names AS varchar[])) AS m(doc_id, name)
+        ON CONFLICT ("documentId", name) DO UPDATE SET meta = EXCLUDED.meta, "updatedAt" = now()
+        """
+    )
+    delete_metrics_sql = text('DELETE FROM metrics WHERE "documentId" = ANY(CAST(:doc_ids AS uuid[]))')
+    metrics_sql = text(
+        """
+        INSERT INTO metrics ("documentId", name, value, unit, meta)
+        SELECT m.doc_id, m.name, m.value, m.unit, jsonb_build_object('extracted', true)
+        FROM unnest(
+            CAST(:doc_ids AS uuid[]), CAST(:names AS varchar[]), CAST(:values AS double precision[]),
+            CAST(:units AS varchar[])
+        ) AS m(doc_id, name, value, unit)
+        """
+    )
+    datasets_sql = text(
+        """
+        INSERT INTO datasets ("documentId", name, size, meta)
+        SELECT d.doc_id, d.name, d.size, jsonb_build_object('extracted', true, 'type', d.type)
+        FROM unnest(
+            CAST(:doc_ids AS uuid[]), CAST(:names AS varchar[]), CAST(:sizes AS int[]), CAST(:types AS text[])
+        ) AS d(doc_id, name, size, type)
+        ON CONFLICT ("documentId", name) DO UPDATE
+        SET size = COALESCE(EXCLUDED.size, datasets.size), meta = EXCLUDED.meta, "updatedAt" = now()
+        """
+    )
+    with engine.begin() as conn:
+        if methods:
+            doc_ids, names = zip(*methods, strict=True)
+            conn.execute(methods_sql, {"doc_ids": [str(i) for i in doc_ids], "names": list(names)})
+        conn.execute(delete_metrics_sql, {"doc_ids": [str(i) for i in document_ids]})
+        if metrics:
+            doc_ids, names, values, units = zip(*metrics, strict=True)
+            conn.execute(metrics_sql, {
+                "doc_ids": [str(i) for i in doc_ids],
+                "names": list(names),
+                "values": list(values),
+                "units": list(units),
+            })
+        if datasets:
+            doc_ids, names, sizes, types = zip(*datasets, strict=True)
+            conn.execute(datasets_sql, {
+                "doc_ids": [str(i) for i in doc_ids],
+                "names": list(names),
+                "sizes": list(sizes),
+                "types": list(types),
+            })
+
+
 def fetch_theme_summary_for_export(engine: Engine, project_id: str):
     sql = text(
         """
@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+EMBED_POOL_THREADS = int(os.getenv("EMBED_POOL_THREADS", "2"))
+# Opt-in: each process holds its own model copy. 0 (the default) encodes in the worker's own
+# process; cpu_count // EMBED_POOL_THREADS keeps every core busy on a dedicated host
+EMBED_POOL_PROCESSES = int(os.getenv("EMBED_POOL_PROCESSES", "0"))
+
+
+def _slot_view(shm, slot, slot_rows, dim):
+    return np.ndarray((slot_rows, dim), dtype=np.float32, buffer=shm.buf, offset=slot * slot_rows * dim * 4)
+
+
+def _pool_process(shm_name, slot_rows, dim, threads, tasks, results):
+    """Encode loop of one pool process: texts in over `tasks`, vectors out through shared memory"""
+    import torch
+    from workers.common.encoder import load_embedding_model
+
+    torch.set_num_threads(threads)
+    model = load_embedding_model()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            task_id, slot, texts = task
+            try:
+                vectors = model.encode(texts, batch_size=len(texts), show_progress_bar=False, convert_to_numpy=True)
+                _slot_view(shm, slot, slot_rows, dim)[:len(texts)] = vectors
+                results.put((task_id, slot, len(texts), None))
+            except Exception as e:
+                results.put((task_id, slot, 0, repr(e)))
+    finally:
+        shm.close()
+
+
+class EmbeddingPool:
+    """N long-lived processes, each loading the embedding model once with a pinned torch thread count.
+
+    `submit` sends a batch of texts to whichever process is free; the process writes the
+    float32 vectors into a slot of one shared-memory block and only (task, slot, rows) comes
+    back over the result queue. Batches may hold at most `slot_rows` texts.
+    """
+
+    def __init__(self, dim, processes=EMBED_POOL_PROCESSES, threads=EMBED_POOL_THREADS, slot_rows=256):
+        self.dim = dim
+        self.slot_rows = slot_rows
+        n_slots = 2 * processes
+        self._shm = shared_memory.SharedMemory(create=True, size=n_slots * slot_rows * dim * 4)
+        self._free_slots = queue.Queue()
+        for slot in range(n_slots):
+            self._free_slots.put(slot)
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._error = None
+
+        # Spawned, not forked: the parent runs an event loop and executor threads
+        context = multiprocessing.get_context("spawn")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._processes = [
+            context.Process(
+                target=_pool_process,
+                args=(self._shm.name, slot_rows, dim, threads, self._tasks, self._results),
+                daemon=True
+            )
+            for _ in range(processes)
+        ]
+        for process in self._processes:
+            process.start()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def submit(self, texts) -> Future:
+        """Encode up to `slot_rows` texts; the future resolves to a (len(texts), dim) float32 array"""
+        if len(texts) > self.slot_rows:
+            raise ValueError(f"Batch of {len(texts)} texts exceeds the pool slot size of {self.slot_rows}")
+        future = Future()
+        while True:
+            if self._error:
+                raise self._error
+            try:
+                slot = self._free_slots.get(timeout=1.0)
+                break
+            except queue.Empty:
+                continue
+        task_id = uuid.uuid4().hex
+        with self._lock:
+            self._futures[task_id] = future
+        self._tasks.put((task_id, slot, list(texts)))
+        return future
+
+    def _collect(self):
+        while True:
+            try:
+                task_id, slot, rows, error = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self._processes):
+                    self._fail_pending(RuntimeError("An embedding pool process exited"))
+                    return
+                continue
+            if task_id is None:
+                return
+            vectors = _slot_view(self._shm, slot, self.slot_rows, self.dim)[:rows].copy()
+            self._free_slots.put(slot)
+            with self._lock:
+                future = self._futures.pop(task_id)
+            if error:
+                future.set_exception(RuntimeError(f"Embedding pool task failed: {error}"))
+            else:
+                future.set_result(vectors)
+
+    def _fail_pending(self, error):
+        self._error = error
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.set_exception(error)
+
+    def close(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+        self._results.put((None, None, 0, None))
+        self._collector.join(timeout=5)
+        self._shm.close()
+        self._shm.unlink()
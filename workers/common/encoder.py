@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from functools import cache
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# "torch" runs SentenceTransformer; "onnx" runs an exported, int8-quantized graph under ONNX Runtime
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Local model directory; when set nothing is downloaded at startup
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH") or None
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "model_quantized.onnx")
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))
+# Identifies the vectors a deployment produces; caches key on it so backends never mix
+EMBEDDING_MODEL_KEY = (
+    EMBEDDING_MODEL_NAME if EMBEDDING_BACKEND == "torch"
+    else f"{EMBEDDING_MODEL_NAME}@{EMBEDDING_BACKEND}/{EMBEDDING_ONNX_FILE}"
+)
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "32"))
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "5"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+
+
+class OnnxSentenceEncoder:
+    """SentenceTransformer-compatible encoder running an exported model under ONNX Runtime.
+
+    `model_path` is a SentenceTransformer directory (as written by `embed_worker.bench
+    export`) holding the tokenizer, the pooling/normalize config and the ONNX graph.
+    Only the parts of the SentenceTransformer API the workers use are provided:
+    `encode`, `tokenizer`, `max_seq_length` and `get_sentence_embedding_dimension`.
+    """
+
+    def __init__(self, model_path, onnx_file=EMBEDDING_ONNX_FILE, threads=EMBEDDING_ONNX_THREADS):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("EMBEDDING_BACKEND=onnx needs onnxruntime (pip install .[onnx])") from e
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path, local_files_only=True)
+        self.max_seq_length = self.tokenizer.model_max_length
+        config_path = os.path.join(model_path, "sentence_bert_config.json")
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                self.max_seq_length = json.load(f).get("max_seq_length", self.max_seq_length)
+        self.normalize = False
+        modules_path = os.path.join(model_path, "modules.json")
+        if os.path.exists(modules_path):
+            with open(modules_path) as f:
+                self.normalize = any(module["type"].endswith(".Normalize") for module in json.load(f))
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_path, onnx_file), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {graph_input.name for graph_input in self.session.get_inputs()}
+        self._dim = self.session.get_outputs()[0].shape[-1]
+
+    def get_sentence_embedding_dimension(self):
+        return self._dim
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True,
+               normalize_embeddings=False):
+        """Mean-pooled sentence embeddings as a float32 (len(sentences), dim) array"""
+        embeddings = np.empty((len(sentences), self._dim), dtype=np.float32)
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(
+                list(sentences[start:start + batch_size]),
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            feed = {name: array.astype(np.int64) for name, array in inputs.items() if name in self._input_names}
+            token_embeddings = self.session.run(None, feed)[0]
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            embeddings[start:start + batch_size] = (token_embeddings * mask).sum(axis=1) / np.maximum(
+                mask.sum(axis=1), 1e-9
+            )
+        if self.normalize or normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+
+@cache
+def load_embedding_model(model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND,
+                         model_path: str | None = EMBEDDING_MODEL_PATH):
+    """Load a sentence encoder once per process; every caller shares the instance."""
+    if backend == "onnx":
+        if not model_path:
+            raise ValueError("EMBEDDING_BACKEND=onnx needs EMBEDDING_MODEL_PATH pointing at an exported model")
+        return OnnxSentenceEncoder(model_path)
+    if backend != "torch":
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    return SentenceTransformer(model_path or model_name)
+
+
+class EmbeddingTokenizer:
+    """Tokenizer, max sequence length and output dimension of the embedding model, without its weights.
+
+    Stands in for the model in a process whose encoding happens elsewhere (the embed
+    worker's parent when EmbeddingPool is on): it provides `tokenizer`, `max_seq_length`
+    and `get_sentence_embedding_dimension` like the encoders above, but not `encode`.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, model_path=EMBEDDING_MODEL_PATH):
+        from huggingface_hub import snapshot_download
+        from transformers import AutoConfig, AutoTokenizer
+
+        if not model_path:
+            # Bare names resolve to the sentence-transformers organisation, as SentenceTransformer does
+            repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+            model_path = snapshot_download(repo_id, allow_patterns=["*.json", "*.txt", "*.model"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.max_seq_length = self.tokenizer.model_max_length
+        config = _read_json(os.path.join(model_path, "sentence_bert_config.json"))
+        if config:
+            self.max_seq_length = config.get("max_seq_length", self.max_seq_length)
+        # The transformer's width, unless a Dense module projects it
+        self._dim = AutoConfig.from_pretrained(model_path).hidden_size
+        for module in _read_json(os.path.join(model_path, "modules.json")) or []:
+            if module["type"].endswith(".Dense"):
+                self._dim = _read_json(os.path.join(model_path, module["path"], "config.json"))["out_features"]
+
+    def get_sentence_embedding_dimension(self):
+        return self._dim
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+class QueryEncoder:
+    """Encodes Q&A queries with the section embedding model.
+
+    Concurrent `encode` calls are collected for up to `max_wait_ms` and sent to the
+    model as one batch; identical in-flight queries share a single slot and recent
+    vectors are served from an LRU cache.
+    """
+
+    def __init__(self, model=None, max_batch_size=QUERY_BATCH_SIZE, max_wait_ms=QUERY_BATCH_WAIT_MS,
+                 cache_size=QUERY_CACHE_SIZE, executor=None):
+        self.model = model or load_embedding_model()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.cache_size = cache_size
+        self.executor = executor
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._queue = None
+        self._batcher = None
+
+    def warmup(self):
+        """Run one encode so the first real query does not pay for lazy initialisation"""
+        self._encode_batch(["warmup"])
+
+    async def encode(self, query):
+        """Return the normalised float32 embedding for `query`"""
+        key = " ".join(query.split())
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            self._ensure_batcher()
+            self._queue.put_nowait(key)
+        return await asyncio.shield(future)
+
+    def _ensure_batcher(self):
+        if self._batcher is None or self._batcher.done():
+            self._queue = asyncio.Queue()
+            self._batcher = asyncio.get_running_loop().create_task(self._run_batches())
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Give concurrent callers a short window to join this batch
+            await asyncio.sleep(self.max_wait)
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                vectors = await loop.run_in_executor(self.executor, self._encode_batch, batch)
+            except Exception as e:
+                for key in batch:
+                    self._pending.pop(key).set_exception(e)
+                continue
+
+            for key, vector in zip(batch, vectors, strict=True):
+                self._remember(key, vector)
+                self._pending.pop(key).set_result(vector)
+
+    def _encode_batch(self, queries):
+        embeddings = self.model.encode(
+            queries,
+            batch_size=self.max_batch_size,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    def _remember(self, key, vector):
+        self._cache[key] = vector
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+@cache
+def get_query_encoder() -> QueryEncoder:
+    """Process-wide query encoder sharing the loaded embedding model"""
+    return QueryEncoder()
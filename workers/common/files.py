@@ -0,0 +1,10 @@
+import hashlib
+
+
+def calculate_md5(file_path, chunk_size=1 << 20):
+    """Calculate MD5 hash of file; this is the content hash documents and caches are keyed by"""
+    hash_md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
@@ -0,0 +1,285 @@
+import fcntl
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+from workers.common.db import (
+    fetch_project_section_fingerprint,
+    iter_project_section_terms,
+    store_section_token_ids,
+)
+from workers.common.tokens import pack_term_ids, term_ids, tokenize, unpack_term_ids
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "/var/lib/airg/lexical")
+LEXICAL_MAX_SEGMENTS = int(os.getenv("LEXICAL_MAX_SEGMENTS", "8"))
+# How often a reader compares a project's index with its sections in Postgres
+LEXICAL_SYNC_SECONDS = float(os.getenv("LEXICAL_SYNC_SECONDS", "30"))
+
+_SEGMENT_ARRAYS = ("terms", "offsets", "docs", "tfs", "lengths", "ids")
+
+
+def _build_postings(doc_terms):
+    """Turn per-document term id arrays into (terms, offsets, docs, tfs) postings arrays.
+
+    `terms` is sorted and unique; postings of terms[i] live at docs/tfs[offsets[i]:offsets[i + 1]].
+    """
+    terms, docs, tfs = [], [], []
+    for doc, ids in enumerate(doc_terms):
+        uniq, counts = np.unique(ids, return_counts=True)
+        terms.append(uniq)
+        docs.append(np.full(len(uniq), doc, dtype=np.uint32))
+        tfs.append(counts)
+    return _sort_postings(
+        np.concatenate(terms) if terms else np.empty(0, dtype=np.uint32),
+        np.concatenate(docs) if docs else np.empty(0, dtype=np.uint32),
+        np.concatenate(tfs) if tfs else np.empty(0, dtype=np.uint16),
+    )
+
+
+def section_fingerprint(id_bytes):
+    """[count, sum] over section ids, matching db.fetch_project_section_fingerprint.
+
+    Each id contributes the integer of its first 15 hex digits, so the sum is additive
+    and can be kept up to date as segments are appended.
+    """
+    return [len(id_bytes), sum(int(raw.hex()[:15], 16) for raw in id_bytes)]
+
+
+def _sort_postings(terms, docs, tfs):
+    order = np.lexsort((docs, terms))
+    terms, docs, tfs = terms[order], docs[order], tfs[order]
+    uniq, starts = np.unique(terms, return_index=True)
+    offsets = np.append(starts, len(terms)).astype(np.int64)
+    return (
+        uniq.astype(np.uint32),
+        offsets,
+        docs.astype(np.uint32),
+        np.minimum(tfs, np.iinfo(np.uint16).max).astype(np.uint16),
+    )
+
+
+class _Segment:
+    """Immutable, memory-mapped slice of a project index"""
+
+    def __init__(self, directory, name):
+        for array in _SEGMENT_ARRAYS:
+            setattr(self, array, np.load(os.path.join(directory, f"{name}.{array}.npy"), mmap_mode="r"))
+        self.name = name
+
+    def postings(self, term):
+        i = np.searchsorted(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.docs[start:stop], self.tfs[start:stop]
+
+
+class LexicalIndex:
+    """Per-project BM25 inverted index stored as append-only segments on local disk.
+
+    Each `add_sections`/`add_section_terms` call writes one new segment of sorted uint32
+    term ids with array-backed postings; `manifest.json` lists the live segments and is
+    replaced atomically, so readers never see a half-written segment. Once the segment count
+    passes LEXICAL_MAX_SEGMENTS the writer merges them into one.
+
+    The index is a cache of sections."tokenIds": the manifest carries a fingerprint of the
+    indexed section ids, and `sync_project_index` rebuilds the index from Postgres when it
+    no longer matches the project (missing index, deletes, re-parses).
+    """
+
+    def __init__(self, project_id, root=LEXICAL_INDEX_DIR, k1=1.2, b=0.75):
+        self.directory = os.path.join(root, str(project_id))
+        self.k1 = k1
+        self.b = b
+        self._segments = {}
+        self.synced_at = None
+
+    def add_sections(self, sections):
+        """Index an iterable of (section_id, text) pairs"""
+        self.add_section_terms((section_id, term_ids(tokenize(text))) for section_id, text in sections)
+
+    def add_section_terms(self, sections):
+        """Index an iterable of (section_id, term id array) pairs, e.g. the stored sections.tokenIds"""
+        ids, doc_terms = [], []
+        for section_id, section_terms in sections:
+            ids.append(uuid.UUID(str(section_id)).bytes)
+            doc_terms.append(section_terms)
+        if not ids:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._write_lock():
+            name = self._write_segment(*self._segment_arrays(ids, doc_terms))
+            manifest = self._read_manifest()
+            manifest["segments"].append(name)
+            if "fingerprint" in manifest:
+                added = section_fingerprint(ids)
+                manifest["fingerprint"] = [a + b for a, b in zip(manifest["fingerprint"], added, strict=True)]
+            self._write_manifest(manifest)
+            if len(manifest["segments"]) > LEXICAL_MAX_SEGMENTS:
+                self._merge(manifest)
+
+    def rebuild(self, sections):
+        """Replace the whole index with an iterable of (section_id, term id array) pairs"""
+        ids, doc_terms = [], []
+        for section_id, section_terms in sections:
+            ids.append(uuid.UUID(str(section_id)).bytes)
+            doc_terms.append(section_terms)
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._write_lock():
+            retired = self._read_manifest()["segments"]
+            segments = [self._write_segment(*self._segment_arrays(ids, doc_terms))] if ids else []
+            self._write_manifest({"segments": segments, "fingerprint": section_fingerprint(ids)})
+            self._unlink_segments(retired)
+
+    def fingerprint(self):
+        """[count, sum] of the indexed section ids, or None for an index never rebuilt"""
+        return self._read_manifest().get("fingerprint")
+
+    def _segment_arrays(self, ids, doc_terms):
+        terms, offsets, docs, tfs = _build_postings(doc_terms)
+        lengths = np.fromiter((len(t) for t in doc_terms), dtype=np.uint32, count=len(doc_terms))
+        section_ids = np.frombuffer(b"".join(ids), dtype=np.uint8).reshape(-1, 16)
+        return terms, offsets, docs, tfs, lengths, section_ids
+
+    def search(self, query, k):
+        """Return up to k (section_id, bm25_score) pairs, best first"""
+        query_terms = np.unique(term_ids(tokenize(query)))
+        segments = self._load_segments()
+        if not len(query_terms) or not segments:
+            return []
+
+        num_docs = sum(len(segment.lengths) for segment in segments)
+        avg_length = max(1.0, sum(float(segment.lengths.sum()) for segment in segments) / num_docs)
+        postings = [[segment.postings(term) for term in query_terms] for segment in segments]
+        doc_freq = np.zeros(len(query_terms), dtype=np.float64)
+        for segment_postings in postings:
+            doc_freq += [len(p[0]) if p is not None else 0 for p in segment_postings]
+        idf = np.log1p((num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        candidates = []
+        for segment, segment_postings in zip(segments, postings, strict=True):
+            scores = np.zeros(len(segment.lengths), dtype=np.float32)
+            for term_idf, hit in zip(idf, segment_postings, strict=True):
+                if hit is None:
+                    continue
+                docs, tfs = hit
+                tfs = tfs.astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * segment.lengths[docs] / avg_length)
+                # Postings hold each doc at most once per term, so fancy-index add is safe
+                scores[docs] += term_idf * tfs * (self.k1 + 1) / (tfs + norm)
+            top = np.flatnonzero(scores)
+            if len(top) > k:
+                top = top[np.argpartition(scores[top], -k)[-k:]]
+            candidates.extend((float(scores[i]), str(uuid.UUID(bytes=segment.ids[i].tobytes()))) for i in top)
+
+        candidates.sort(reverse=True)
+        return [(section_id, score) for score, section_id in candidates[:k]]
+
+    def _load_segments(self):
+        for attempt in range(2):
+            names = self._read_manifest()["segments"]
+            try:
+                for name in names:
+                    if name not in self._segments:
+                        self._segments[name] = _Segment(self.directory, name)
+                break
+            except FileNotFoundError:
+                # A concurrent merge retired the segment after we read the manifest
+                if attempt:
+                    raise
+        self._segments = {name: self._segments[name] for name in names}
+        return list(self._segments.values())
+
+    def _merge(self, manifest):
+        segments = [_Segment(self.directory, name) for name in manifest["segments"]]
+        base, terms, docs, tfs = 0, [], [], []
+        for segment in segments:
+            terms.append(np.repeat(segment.terms, np.diff(segment.offsets)))
+            docs.append(segment.docs + np.uint32(base))
+            tfs.append(np.asarray(segment.tfs))
+            base += len(segment.lengths)
+        merged = _sort_postings(np.concatenate(terms), np.concatenate(docs), np.concatenate(tfs))
+        name = self._write_segment(
+            *merged,
+            np.concatenate([segment.lengths for segment in segments]),
+            np.concatenate([segment.ids for segment in segments]),
+        )
+        self._write_manifest({**manifest, "segments": [name]})
+        self._unlink_segments(segment.name for segment in segments)
+
+    def _unlink_segments(self, names):
+        for name in names:
+            for array in _SEGMENT_ARRAYS:
+                os.unlink(os.path.join(self.directory, f"{name}.{array}.npy"))
+
+    def _write_segment(self, terms, offsets, docs, tfs, lengths, ids):
+        name = f"seg-{uuid.uuid4().hex}"
+        arrays = {"terms": terms, "offsets": offsets, "docs": docs, "tfs": tfs, "lengths": lengths, "ids": ids}
+        for array in _SEGMENT_ARRAYS:
+            np.save(os.path.join(self.directory, f"{name}.{array}.npy"), arrays[array])
+        return name
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, "manifest.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": []}
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self.directory, "manifest.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(f"{path}.tmp", path)
+
+    @contextmanager
+    def _write_lock(self):
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@lru_cache(maxsize=256)
+def open_project_index(project_id) -> LexicalIndex:
+    return LexicalIndex(project_id)
+
+
+def sync_project_index(engine, project_id) -> LexicalIndex:
+    """The project's index, rebuilt from sections."tokenIds" if it no longer matches Postgres.
+
+    Covers an empty LEXICAL_INDEX_DIR (a fresh container, or sections ingested before the
+    index existed) as well as deleted and re-parsed documents. The comparison runs at
+    most every LEXICAL_SYNC_SECONDS per project and process.
+    """
+    index = open_project_index(project_id)
+    now = time.monotonic()
+    if index.synced_at is not None and now - index.synced_at < LEXICAL_SYNC_SECONDS:
+        return index
+    if index.fingerprint() != fetch_project_section_fingerprint(engine, project_id):
+        index.rebuild(_iter_stored_section_terms(engine, project_id))
+    index.synced_at = now
+    return index
+
+
+def _iter_stored_section_terms(engine, project_id):
+    """(section_id, term ids) of every section of a project, tokenizing (and storing) any without tokenIds"""
+    for rows in iter_project_section_terms(engine, project_id):
+        backfill = []
+        for row in rows:
+            if row["token_ids"] is not None:
+                yield row["id"], unpack_term_ids(row["token_ids"])
+                continue
+            ids = term_ids(tokenize(row["text"]))
+            backfill.append((row["id"], pack_term_ids(ids)))
+            yield row["id"], ids
+        if backfill:
+            store_section_token_ids(engine, [i for i, _ in backfill], [ids for _, ids in backfill])
@@ -0,0 +1,95 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "16"))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+
+_DONE = object()
+
+
+def worker_processes(worker, default=WORKER_PROCESSES):
+    """Per-worker process pool size from e.g. WORKER_PROCESSES_PDF, else the worker-wide default"""
+    env_name = "WORKER_PROCESSES_" + worker.upper().replace("-", "_")
+    return int(os.getenv(env_name, str(default)))
+
+
+def subject_concurrency(subject, default=WORKER_CONCURRENCY):
+    """Per-subject limit from e.g. WORKER_CONCURRENCY_EMBED_UPSERT, else the worker-wide default"""
+    env_name = "WORKER_CONCURRENCY_" + subject.upper().replace(".", "_").replace("-", "_")
+    return int(os.getenv(env_name, str(default)))
+
+
+class WorkerRuntime:
+    """Executors and message concurrency shared by a worker's NATS handlers.
+
+    CPU-bound work goes to a process pool (`run_cpu`; the callable and its arguments
+    must be picklable), blocking DB/network I/O to a thread pool (`run_io`). Handlers
+    registered through `subscribe` run as tasks, at most N at a time per subject, so
+    the event loop stays free for NATS heartbeats while messages are processed.
+
+    The process pool is sized per worker (`worker_processes`); workers that never call
+    `run_cpu` pass `processes=0` and get no pool at all.
+    """
+
+    def __init__(self, worker, processes=None, threads=WORKER_THREADS):
+        if processes is None:
+            processes = worker_processes(worker)
+        self.worker = worker
+        self.process_pool = ProcessPoolExecutor(max_workers=processes) if processes > 0 else None
+        self.thread_pool = ThreadPoolExecutor(max_workers=threads)
+        self._tasks = set()
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        if self.process_pool is None:
+            raise RuntimeError(f"{self.worker} runtime was created without a process pool")
+        return await asyncio.get_running_loop().run_in_executor(self.process_pool, partial(fn, *args, **kwargs))
+
+    async def run_io(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.thread_pool, partial(fn, *args, **kwargs))
+
+    async def iterate_io(self, iterator, prefetch=False):
+        """Drive a blocking iterator (e.g. a keyset DB reader) from the thread pool.
+
+        With `prefetch`, the next item is read while the caller is still working on the
+        current one.
+        """
+        iterator = iter(iterator)
+        loop = asyncio.get_running_loop()
+        pending = loop.run_in_executor(self.thread_pool, next, iterator, _DONE)
+        while True:
+            item = await pending
+            if item is _DONE:
+                return
+            pending = loop.run_in_executor(self.thread_pool, next, iterator, _DONE) if prefetch else None
+            yield item
+            if pending is None:
+                pending = loop.run_in_executor(self.thread_pool, next, iterator, _DONE)
+
+    async def subscribe(self, nc, subject, handler, concurrency=None):
+        """Subscribe `handler` so up to `concurrency` messages of `subject` are handled at once"""
+        semaphore = asyncio.Semaphore(concurrency or subject_concurrency(subject))
+
+        async def run(msg):
+            try:
+                await handler(msg)
+            except Exception as e:
+                print(f"Unhandled error on {subject}: {e}")
+            finally:
+                semaphore.release()
+
+        async def dispatch(msg):
+            # Waiting here applies backpressure: NATS buffers further messages for us
+            await semaphore.acquire()
+            task = asyncio.get_running_loop().create_task(run(msg))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        return await nc.subscribe(subject, cb=dispatch)
+
+    def shutdown(self):
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+        self.thread_pool.shutdown(wait=False, cancel_futures=True)
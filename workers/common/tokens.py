@@ -0,0 +1,63 @@
+import re
+import zlib
+
+import numpy as np
+
+STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
+    'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
+    'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
+    'should', 'may', 'might', 'can', 'this', 'that', 'these', 'those',
+    'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her',
+    'us', 'them', 'my', 'your', 'his', 'its', 'our', 'their'
+})
+
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+
+
+def tokenize(text):
+    """Lowercase, strip punctuation and drop stop words and tokens of two characters or fewer"""
+    words = _NON_WORD_RE.sub(' ', text.lower()).split()
+    return [word for word in words if word not in STOP_WORDS and len(word) > 2]
+
+
+def term_id(term):
+    """Stable 32-bit id for a term, shared by every worker and index"""
+    return zlib.crc32(term.encode('utf-8'))
+
+
+def term_ids(tokens):
+    """Map tokens to a uint32 array of term ids"""
+    return np.fromiter((term_id(token) for token in tokens), dtype=np.uint32, count=len(tokens))
+
+
+# FNV-1a 64-bit prime, used to fold term ids into n-gram ids
+_NGRAM_PRIME = np.uint64(0x100000001B3)
+
+
+def ngram_ids(ids, n):
+    """uint64 ids of every n-gram of a term id array, one per starting position"""
+    ids = np.asarray(ids, dtype=np.uint64)
+    count = len(ids) - n + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.uint64)
+    hashed = ids[:count].copy()
+    for offset in range(1, n):
+        # uint64 arithmetic wraps, which is what the hash wants
+        hashed = hashed * _NGRAM_PRIME ^ ids[offset:offset + count]
+    return hashed
+
+
+def section_term_ids(texts):
+    """Term id arrays of a list of section texts, as stored in sections.tokenIds"""
+    return [term_ids(tokenize(text)) for text in texts]
+
+
+def pack_term_ids(ids):
+    """Little-endian uint32 bytes of a term id array"""
+    return np.asarray(ids, dtype='<u4').tobytes()
+
+
+def unpack_term_ids(data):
+    """Term id array from `pack_term_ids` bytes (or a bytea memoryview)"""
+    return np.frombuffer(data, dtype='<u4').astype(np.uint32, copy=False)
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+from prometheus_client import Counter
+
+# Off unless pointed at a writable file, e.g. on a volume shared by the worker's restarts
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+
+CACHE_HITS = Counter("embedding_cache_hits_total", "Section texts served from the embedding cache")
+CACHE_MISSES = Counter("embedding_cache_misses_total", "Section texts that had to be encoded by the model")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Stay under SQLite's bound-parameter limit
+_SQL_CHUNK = 500
+
+
+def text_key(model_name, text):
+    """Hash of the model name and whitespace-normalised text"""
+    normalized = _WHITESPACE_RE.sub(" ", text).strip()
+    return hashlib.sha1(f"{model_name}\0{normalized}".encode()).digest()
+
+
+def open_embedding_cache(path=EMBEDDING_CACHE_PATH, dim=384):
+    """An EmbeddingCache at `path`, or None when the path is empty or cannot be opened"""
+    if not path:
+        return None
+    try:
+        return EmbeddingCache(path, dim=dim)
+    except (OSError, sqlite3.Error) as e:
+        # The cache only saves work; a read-only or missing volume must not stop the worker
+        print(f"Embedding cache disabled, cannot open {path}: {e}")
+        return None
+
+
+class EmbeddingCache:
+    """Persistent text-hash -> float32 vector cache in a local SQLite file.
+
+    Each row carries a `used` tick that is bumped on every hit; once the table grows
+    past `max_entries` the least recently used rows are deleted. Safe to share across
+    the worker's threads.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, dim=384, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.dim = dim
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (key BLOB PRIMARY KEY, vector BLOB NOT NULL, used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS vectors_used ON vectors(used)")
+        self._tick, self._size = self._conn.execute("SELECT COALESCE(MAX(used), 0), COUNT(*) FROM vectors").fetchone()
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys that are cached"""
+        found = {}
+        with self._lock, self._conn:
+            self._tick += 1
+            for i in range(0, len(keys), _SQL_CHUNK):
+                chunk = keys[i:i + _SQL_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(f"SELECT key, vector FROM vectors WHERE key IN ({marks})", chunk).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32, count=self.dim)
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE vectors SET used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [self._tick, *(key for key, _ in rows)]
+                    )
+        return found
+
+    def put_many(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, self._conn:
+            self._tick += 1
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO vectors (key, vector, used) VALUES (?, ?, ?)",
+                ((key, vector.tobytes(), self._tick) for key, vector in zip(keys, vectors, strict=True))
+            )
+            self._size += self._conn.total_changes - before
+            excess = self._size - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM vectors WHERE key IN (SELECT key FROM vectors ORDER BY used LIMIT ?)", (excess,)
+                )
+                self._size -= excess
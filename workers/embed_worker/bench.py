@@ -0,0 +1,97 @@
+"""Export the embedding model to quantized ONNX and compare it with the PyTorch backend.
+
+    python -m workers.embed_worker.bench export --model all-MiniLM-L6-v2 --output /models/minilm-onnx
+    python -m workers.embed_worker.bench compare --model-path /models/minilm-onnx --texts sections.txt
+
+`compare` reads one text per line and reports per-text cosine agreement between the
+two backends plus the throughput of each.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from workers.common.encoder import EMBEDDING_MODEL_NAME, OnnxSentenceEncoder
+
+
+def export(model, output, opset=17):
+    """Write a SentenceTransformer directory with model.onnx and its dynamic int8 model_quantized.onnx"""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    # Tokenizer, pooling and normalize config, so the ONNX backend needs nothing else
+    SentenceTransformer(model).save(output)
+    tokenizer = AutoTokenizer.from_pretrained(output)
+    transformer = AutoModel.from_pretrained(output).eval()
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = list(sample.keys())
+    torch.onnx.export(
+        transformer,
+        tuple(sample[name] for name in input_names),
+        os.path.join(output, "model.onnx"),
+        input_names=input_names,
+        output_names=["last_hidden_state"],
+        dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]},
+        opset_version=opset
+    )
+    quantize_dynamic(
+        os.path.join(output, "model.onnx"),
+        os.path.join(output, "model_quantized.onnx"),
+        weight_type=QuantType.QInt8
+    )
+    print(f"Exported {model} to {output}")
+
+
+def _timed_encode(model, texts, batch_size):
+    started = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+    return np.asarray(embeddings, dtype=np.float32), time.perf_counter() - started
+
+
+def compare(model_path, texts_path, onnx_file, batch_size, limit):
+    with open(texts_path) as f:
+        texts = [line.strip() for line in f if line.strip()][:limit]
+    if not texts:
+        raise SystemExit(f"No texts in {texts_path}")
+
+    reference, torch_seconds = _timed_encode(SentenceTransformer(model_path), texts, batch_size)
+    candidate, onnx_seconds = _timed_encode(OnnxSentenceEncoder(model_path, onnx_file), texts, batch_size)
+
+    reference /= np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    candidate /= np.maximum(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12)
+    cosine = np.einsum("ij,ij->i", reference, candidate)
+
+    print(f"texts: {len(texts)}")
+    print(f"cosine agreement: mean {cosine.mean():.5f}  p1 {np.percentile(cosine, 1):.5f}  min {cosine.min():.5f}")
+    print(f"torch: {len(texts) / torch_seconds:.1f} texts/s")
+    print(f"onnx ({onnx_file}): {len(texts) / onnx_seconds:.1f} texts/s ({torch_seconds / onnx_seconds:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    export_parser.add_argument("--output", required=True)
+    export_parser.add_argument("--opset", type=int, default=17)
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("--model-path", required=True)
+    compare_parser.add_argument("--texts", required=True)
+    compare_parser.add_argument("--onnx-file", default="model_quantized.onnx")
+    compare_parser.add_argument("--batch-size", type=int, default=32)
+    compare_parser.add_argument("--limit", type=int, default=2000)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export(args.model, args.output, args.opset)
+    else:
+        compare(args.model_path, args.texts, args.onnx_file, args.batch_size, args.limit)
+
+
+if __name__ == "__main__":
+    main()
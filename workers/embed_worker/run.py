@@ -1,66 +1,203 @@
 import os
 import asyncio
 import json
+from collections import defaultdict
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from nats.aio.client import Client as NATS
-from workers.common.db import create_db_engine, fetch_sections_without_embeddings, upsert_section_embeddings
+from prometheus_client import start_http_server
+from sqlalchemy import text
+from workers.common.db import (
+    EMBEDDING_WRITE_BATCH_SIZE,
+    bulk_upsert_section_embeddings,
+    cache_section_embeddings,
+    copy_cached_section_embeddings,
+    create_db_engine,
+    fetch_document_project_id,
+    insert_section_chunks,
+    iter_sections_without_embeddings,
+)
+from workers.common.embedding_pool import EMBED_POOL_PROCESSES, EmbeddingPool
+from workers.common.encoder import EMBEDDING_MODEL_KEY, EmbeddingTokenizer, load_embedding_model
+from workers.common.runtime import WorkerRuntime
+from workers.common.vector_cache import CACHE_HITS, CACHE_MISSES, open_embedding_cache, text_key
 
 
 class EmbeddingWorker:
-    def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, pool=None, model=None):
+        # With `pool`, `model` only needs the tokenizer and dimensions (see EmbeddingTokenizer)
+        self.model = model or load_embedding_model()
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.pool = pool
         self.batch_size = 32
-        self.max_length = 512
+        # Tokens shared by consecutive chunks of a long section
+        self.chunk_overlap = int(os.getenv("EMBED_CHUNK_OVERLAP", "32"))
+        # Padded tokens per model call; batches hold up to this many (longest length x count)
+        self.token_budget = int(os.getenv("EMBED_TOKEN_BUDGET", "8192"))
+        self.max_batch_size = int(os.getenv("EMBED_MAX_BATCH_SIZE", "256"))
+        # Boilerplate sections repeat across papers; None unless EMBEDDING_CACHE_PATH is set and writable
+        self.cache = open_embedding_cache(dim=self.dim)
         
     def preprocess_text(self, text):
         """Preprocess text for embedding"""
-        # Clean and truncate text
-        text = text.strip()
-        if len(text) > self.max_length * 4:  # Approximate character limit
-            text = text[:self.max_length * 4]
-        return text
+        # Clean text; long sections are chunked rather than truncated
+        return text.strip()
     
     def generate_embeddings(self, texts):
         """Generate embeddings for a batch of texts"""
         # Preprocess texts
         processed_texts = [self.preprocess_text(text) for text in texts]
         
-        # Generate embeddings
-        embeddings = self.model.encode(
-            processed_texts,
-            batch_size=self.batch_size,
-            show_progress_bar=False,
-            convert_to_numpy=True
+        if self.cache is None:
+            return self.encode_texts(processed_texts)
+
+        # Only texts missing from the cache reach the model
+        keys = [text_key(EMBEDDING_MODEL_KEY, body) for body in processed_texts]
+        cached = self.cache.get_many(list(set(keys)))
+        missing = {}
+        for key, body in zip(keys, processed_texts, strict=True):
+            if key not in cached:
+                missing.setdefault(key, body)
+
+        CACHE_HITS.inc(len(keys) - len(missing))
+        CACHE_MISSES.inc(len(missing))
+
+        if missing:
+            encoded = self.encode_texts(list(missing.values()))
+            self.cache.put_many(list(missing), encoded)
+            cached.update(zip(missing, encoded, strict=True))
+
+        embeddings = np.empty((len(keys), self.dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            embeddings[i] = cached[key]
+        return embeddings
+
+    def token_lengths(self, texts):
+        """Token count of each text as the model will see it (truncated to its max sequence length)"""
+        encoded = self.model.tokenizer(
+            texts,
+            truncation=True,
+            max_length=self.model.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            return_length=True
         )
+        return np.asarray(encoded['length'], dtype=np.int64)
+
+    def plan_batches(self, lengths):
+        """Group text indices into batches, shortest first, packed up to the token budget"""
+        order = np.argsort(lengths, kind='stable')
+        batches, start = [], 0
+        for end in range(1, len(order) + 1):
+            # Sorted ascending, so the padded cost of order[start:end] is its last length times its size
+            if end == len(order) or (end + 1 - start) * max(1, lengths[order[end]]) > self.token_budget \
+                    or end - start >= self.max_batch_size:
+                batches.append(order[start:end])
+                start = end
+        return batches
+
+    def encode_texts(self, texts):
+        """Run the model over a list of already preprocessed texts in length-bucketed batches"""
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return embeddings
         
-        return embeddings.tolist()
+        batches = self.plan_batches(self.token_lengths(texts))
+        if self.pool is not None:
+            # Every batch goes out at once so all pool processes stay busy
+            futures = [self.pool.submit([texts[i] for i in batch]) for batch in batches]
+            for batch, future in zip(batches, futures, strict=True):
+                embeddings[batch] = future.result()
+            return embeddings
+
+        for batch in batches:
+            batch_texts = [texts[i] for i in batch]
+            # Scatter back so results keep the input order
+            embeddings[batch] = self.model.encode(
+                batch_texts,
+                batch_size=len(batch_texts),
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
+
+        return embeddings
     
+    def chunk_spans(self, texts):
+        """Character spans of overlapping token windows covering each text"""
+        window = self.model.max_seq_length - 2  # room for the special tokens
+        # An overlap of a whole window or more would never advance past the first one
+        overlap = min(self.chunk_overlap, window - 1)
+        stride = window - overlap
+        encoded = self.model.tokenizer(
+            texts,
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            return_offsets_mapping=True
+        )
+
+        spans = []
+        for body, offsets in zip(texts, encoded['offset_mapping'], strict=True):
+            if len(offsets) <= window:
+                spans.append([(0, len(body))])
+                continue
+            # The last window starts less than `overlap` tokens from the end, so it reaches it
+            spans.append([
+                (offsets[i][0], offsets[min(i + window, len(offsets)) - 1][1])
+                for i in range(0, len(offsets) - overlap, stride)
+            ])
+        return spans
+
     def process_batch(self, sections_batch):
-        """Process a batch of sections"""
+        """Process a batch of sections into section vectors and, for long sections, chunk rows"""
         if not sections_batch:
-            return {}
+            return [], np.empty((0, self.dim), dtype=np.float32), []
         
         # Extract texts and IDs
         section_ids = [section['id'] for section in sections_batch]
         texts = [section['text'] for section in sections_batch]
         
-        # Generate embeddings
-        embeddings = self.generate_embeddings(texts)
-        
-        # Create mapping of ID to embedding
-        id_to_embedding = {}
-        for section_id, embedding in zip(section_ids, embeddings):
-            id_to_embedding[section_id] = embedding
+        # Embed every token window of every section
+        spans = self.chunk_spans(texts)
+        chunk_vectors = self.generate_embeddings([
+            body[start:end] for body, text_spans in zip(texts, spans, strict=True) for start, end in text_spans
+        ])
+
+        # A section's vector is the mean of its chunks; short sections have exactly one
+        counts = np.fromiter((len(text_spans) for text_spans in spans), dtype=np.int64, count=len(spans))
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        embeddings = (np.add.reduceat(chunk_vectors, offsets, axis=0) / counts[:, None]).astype(np.float32)
+
+        chunks = [
+            {
+                'section_id': section_id,
+                'ordinal': ordinal,
+                'start_char': start,
+                'end_char': end,
+                'embedding': chunk_vectors[offset + ordinal]
+            }
+            for section_id, text_spans, offset in zip(section_ids, spans, offsets, strict=True) if len(text_spans) > 1
+            for ordinal, (start, end) in enumerate(text_spans)
+        ]
         
-        return id_to_embedding
+        return section_ids, embeddings, chunks
 
 
 async def main():
     nc = NATS()
     await nc.connect(os.getenv("NATS_URL", "nats://localhost:4222"))
     engine = create_db_engine()
-    worker = EmbeddingWorker()
+    if EMBED_POOL_PROCESSES:
+        # Model-sized batches are spread over processes that each hold their own model; this
+        # process only tokenizes, so it loads the tokenizer and not the weights
+        worker = EmbeddingWorker(model=EmbeddingTokenizer())
+        worker.pool = EmbeddingPool(worker.dim, slot_rows=worker.max_batch_size)
+    else:
+        worker = EmbeddingWorker()
+    runtime = WorkerRuntime("embed", processes=0)
+    project_locks = defaultdict(asyncio.Lock)
+    if os.getenv("METRICS_PORT"):
+        # Exposes the embedding cache hit/miss counters
+        start_http_server(int(os.getenv("METRICS_PORT")))
 
     async def handle(msg):
         data = msg.data.decode()
@@ -72,55 +209,98 @@ async def main():
             return
 
         try:
-            # Fetch sections without embeddings
-            if document_id:
-                # Process specific document
-                sections = fetch_sections_for_document(engine, document_id)
-            elif project_id:
-                # Process entire project
-                sections = fetch_sections_without_embeddings(engine, project_id)
-            else:
-                return
-            
-            if not sections:
+            if not (document_id or project_id):
                 return
+
+            # One upsert per project at a time: concurrent ones would encode the same pending
+            # sections and race on their chunk rows
+            scope_project_id = project_id or await runtime.run_io(fetch_document_project_id, engine, document_id)
+            async with project_locks[scope_project_id]:
+                # Sections of PDFs already embedded elsewhere are copied from the content cache
+                cached_count = await runtime.run_io(
+                    copy_cached_section_embeddings, engine, EMBEDDING_MODEL_KEY,
+                    document_id=document_id, project_id=project_id
+                )
+
+                # Fetch sections without embeddings
+                if document_id:
+                    # Process specific document
+                    section_chunks = [await runtime.run_io(fetch_sections_for_document, engine, document_id)]
+                else:
+                    # Stream the entire project in keyset-paginated chunks
+                    section_chunks = iter_sections_without_embeddings(engine, project_id)
             
-            # Process in batches
-            batch_size = 32
-            for i in range(0, len(sections), batch_size):
-                batch = sections[i:i + batch_size]
-                
-                # Generate embeddings for batch
-                id_to_embedding = worker.process_batch(batch)
-                
-                # Upsert embeddings to database
-                if id_to_embedding:
-                    upsert_section_embeddings(engine, id_to_embedding)
-                
-                # Small delay to prevent overwhelming the database
-                await asyncio.sleep(0.1)
+                # Encode chunk by chunk in token-budget batches; write in bulk-sized batches
+                pending_ids, pending_vectors, pending_chunks = [], [], []
+                embedded_count = 0
+                pending_write = None
+                try:
+                    async for sections in runtime.iterate_io(section_chunks):
+                        # Generate embeddings for the chunk; torch releases the GIL, so a thread is enough
+                        section_ids, embeddings, chunks = await runtime.run_io(worker.process_batch, sections)
+                        embedded_count += len(section_ids)
+                        pending_ids.extend(section_ids)
+                        pending_vectors.append(embeddings)
+                        pending_chunks.extend(chunks)
+
+                        # One COPY + merge per write batch, overlapping with encoding of the next chunk
+                        if len(pending_ids) >= EMBEDDING_WRITE_BATCH_SIZE:
+                            if pending_write:
+                                await pending_write
+                            pending_write = asyncio.ensure_future(runtime.run_io(
+                                write_embeddings, engine, pending_ids, np.concatenate(pending_vectors), pending_chunks
+                            ))
+                            pending_ids, pending_vectors, pending_chunks = [], [], []
+                finally:
+                    # A write still in flight would otherwise outlive the project lock
+                    if pending_write:
+                        await pending_write
+
+                if pending_ids:
+                    await runtime.run_io(
+                        write_embeddings, engine, pending_ids, np.concatenate(pending_vectors), pending_chunks
+                    )
+
+                if embedded_count:
+                    await runtime.run_io(
+                        cache_section_embeddings, engine, EMBEDDING_MODEL_KEY,
+                        document_id=document_id, project_id=project_id
+                    )
+                embedded_count += cached_count
             
-            # Trigger clustering if processing entire project
-            if project_id:
-                await nc.publish("cluster.run", json.dumps({
-                    "projectId": project_id
-                }))
+                # Let readers holding cached project embeddings drop them
+                if embedded_count and scope_project_id:
+                    await nc.publish("embed.updated", json.dumps({
+                        "projectId": str(scope_project_id)
+                    }))
+
+                # Trigger clustering if processing entire project
+                if project_id:
+                    await nc.publish("cluster.run", json.dumps({
+                        "projectId": project_id
+                    }))
                 
         except Exception as e:
             print(f"Error generating embeddings: {e}")
 
-    await nc.subscribe("embed.upsert", cb=handle)
+    await runtime.subscribe(nc, "embed.upsert", handle)
     while True:
         await asyncio.sleep(5)
 
 
+def write_embeddings(engine, section_ids, vectors, chunks):
+    """Store section vectors, then the chunk rows of long sections"""
+    bulk_upsert_section_embeddings(engine, section_ids, vectors)
+    insert_section_chunks(engine, chunks)
+
+
 def fetch_sections_for_document(engine, document_id):
     """Fetch sections for a specific document"""
-    sql = """
+    sql = text("""
     SELECT s.id, s.text
     FROM sections s
     WHERE s."documentId" = :doc_id AND s.embedding IS NULL
-    """
+    """)
     with engine.connect() as conn:
         rows = conn.execute(sql, {"doc_id": document_id}).mappings().all()
     return rows
@@ -5,6 +5,7 @@ import uuid
 from datetime import datetime
 from nats.aio.client import Client as NATS
 from workers.common.db import create_db_engine, fetch_theme_summary_for_export, fetch_citation_bundle_for_export
+from workers.common.runtime import WorkerRuntime
 
 
 def generate_docx_content(project_data, themes_data, bundles_data):
@@ -99,6 +100,7 @@ async def main():
     nc = NATS()
     await nc.connect(os.getenv("NATS_URL", "nats://localhost:4222"))
     engine = create_db_engine()
+    runtime = WorkerRuntime("export", processes=0)
 
     async def handle(msg):
         data = msg.data.decode()
@@ -110,9 +112,9 @@ async def main():
             return
 
         # Fetch project data
-        project_data = fetch_project_for_export(engine, project_id)
-        themes_data = fetch_theme_summary_for_export(engine, project_id)
-        bundles_data = fetch_citation_bundle_for_export(engine, project_id)
+        project_data = await runtime.run_io(fetch_project_for_export, engine, project_id)
+        themes_data = await runtime.run_io(fetch_theme_summary_for_export, engine, project_id)
+        bundles_data = await runtime.run_io(fetch_citation_bundle_for_export, engine, project_id)
         
         if export_type == "docx":
             content = generate_docx_content(project_data, themes_data, bundles_data)
@@ -125,9 +127,9 @@ async def main():
                 json.dump(content, f, indent=2)
         
         # Store export record
-        insert_export_record(engine, project_id, export_type, file_path)
+        await runtime.run_io(insert_export_record, engine, project_id, export_type, file_path)
 
-    await nc.subscribe("export.make", cb=handle)
+    await runtime.subscribe(nc, "export.make", handle)
     while True:
         await asyncio.sleep(5)
 
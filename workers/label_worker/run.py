@@ -2,59 +2,156 @@ import os
 import asyncio
 import json
 import re
-from collections import Counter
+from collections import Counter, defaultdict, deque
+import numpy as np
 from nats.aio.client import Client as NATS
-from workers.common.db import create_db_engine, fetch_theme_sections_for_labeling, update_theme_label_and_provenance
+from workers.common.db import (
+    create_db_engine,
+    fetch_project_theme_assignments,
+    fetch_section_texts,
+    fetch_theme_project_id,
+    iter_project_section_tokens,
+    iter_project_sections_for_labeling,
+    store_section_token_ids,
+    update_theme_labels_and_provenance,
+)
+from workers.common.runtime import WorkerRuntime, worker_processes
+from workers.common.tokens import ngram_ids, pack_term_ids, section_term_ids, term_ids, tokenize, unpack_term_ids
+
+
+LABEL_HASH_BUCKETS = int(os.getenv("LABEL_HASH_BUCKETS", str(1 << 24)))
+# Pending (theme, n-gram) entries folded into the running totals at a time
+LABEL_FOLD_ENTRIES = int(os.getenv("LABEL_FOLD_ENTRIES", "4000000"))
+# Section chunks being counted in the process pool at once
+LABEL_COUNT_CONCURRENCY = int(os.getenv("LABEL_COUNT_CONCURRENCY", str(worker_processes("label"))))
 
 
 class LabelingWorker:
+    """Class-based TF-IDF (c-TF-IDF) labeling over hashed n-gram ids.
+
+    Counting reads the term ids stored with each section at ingest, so relabeling never
+    re-parses text. Each section's 2-4-grams are hashed into LABEL_HASH_BUCKETS columns
+    and counted against each theme its document belongs to. Counts live in flat numpy
+    arrays keyed by theme * buckets + column, and all themes are scored in one
+    vectorized pass. Several n-grams can share a column, so the winning columns are
+    recounted by full 64-bit n-gram id and rescored before any string is looked up;
+    strings are only recovered for the n-grams that win that recount.
+    """
+
     def __init__(self):
         self.min_ngram_length = 2
         self.max_ngram_length = 4
         self.top_n_terms = 10
-        self.stop_words = self._load_stop_words()
-        
-    def _load_stop_words(self):
-        """Load common stop words"""
-        return {
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
-            'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
-            'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could',
-            'should', 'may', 'might', 'can', 'this', 'that', 'these', 'those',
-            'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her',
-            'us', 'them', 'my', 'your', 'his', 'her', 'its', 'our', 'their'
-        }
+        self.hash_buckets = np.uint64(LABEL_HASH_BUCKETS)
     
-    def extract_ngrams(self, text, min_length=2, max_length=4):
-        """Extract n-grams from text"""
-        # Clean text
-        text = re.sub(r'[^\w\s]', ' ', text.lower())
-        words = text.split()
-        
-        # Filter stop words
-        words = [word for word in words if word not in self.stop_words and len(word) > 2]
+    def section_ngrams(self, ids):
+        """Per n, the full 64-bit n-gram id at each position of a section's term ids"""
+        return [ngram_ids(ids, n) for n in range(self.min_ngram_length, self.max_ngram_length + 1)]
+
+    def chunk_term_counts(self, section_terms, section_themes):
+        """(keys, counts) of theme n-gram occurrences for a chunk of sections.
+
+        `section_terms` holds each section's term id array and `section_themes` the theme
+        rows its document is assigned to.
+        """
+        keys, counts = [], []
+        for ids, theme_rows in zip(section_terms, section_themes, strict=True):
+            if not theme_rows:
+                continue
+            grams = self.section_ngrams(ids)
+            columns, column_counts = np.unique(np.concatenate(grams) % self.hash_buckets, return_counts=True)
+            for row in theme_rows:
+                keys.append(np.uint64(row) * self.hash_buckets + columns)
+                counts.append(column_counts)
+        if not keys:
+            return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+        return self.merge_counts(np.concatenate(keys), np.concatenate(counts))
+
+    def merge_counts(self, keys, counts):
+        """Sum counts of equal keys; returns sorted unique keys"""
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        return unique_keys, np.bincount(inverse, weights=counts, minlength=len(unique_keys)).astype(np.int64)
+
+    def theme_totals(self, keys, counts, n_themes):
+        """n-gram total of each theme (every n-gram lands in exactly one column)"""
+        return np.bincount((keys // self.hash_buckets).astype(np.int64), weights=counts, minlength=n_themes)
+
+    def score_themes(self, keys, counts, n_themes):
+        """Top c-TF-IDF n-gram columns per theme as [(column, score, count)], best first.
+
+        score = tf(t, c) / |c| * log(1 + A / f(t)), with |c| the n-gram total of theme c,
+        f(t) the total of n-gram t over all themes and A the mean theme total.
+        """
+        rows = (keys // self.hash_buckets).astype(np.int64)
+        columns = keys % self.hash_buckets
+        _, column_index = np.unique(columns, return_inverse=True)
         
-        ngrams = []
-        for n in range(min_length, max_length + 1):
-            for i in range(len(words) - n + 1):
-                ngram = ' '.join(words[i:i + n])
-                ngrams.append(ngram)
+        theme_totals = self.theme_totals(keys, counts, n_themes)
+        term_totals = np.bincount(column_index, weights=counts)
+        average_total = theme_totals.sum() / max(1, n_themes)
+        scores = counts / np.maximum(theme_totals[rows], 1) * np.log1p(average_total / term_totals[column_index])
         
-        return ngrams
+        # keys are sorted, so each theme's entries are contiguous
+        bounds = np.searchsorted(rows, np.arange(n_themes + 1))
+        top_terms = []
+        for start, stop in zip(bounds[:-1], bounds[1:], strict=True):
+            theme_scores = scores[start:stop]
+            top = np.argsort(-theme_scores, kind='stable')[:self.top_n_terms]
+            top_terms.append([
+                (int(columns[start + i]), float(theme_scores[i]), int(counts[start + i])) for i in top
+            ])
+        return top_terms
     
-    def get_top_ngrams(self, texts, min_length=2, max_length=4, top_n=10):
-        """Get top n-grams from a collection of texts"""
-        all_ngrams = []
-        
+    def chunk_candidate_counts(self, section_terms, section_themes, columns):
+        """Counter of (theme row, n-gram id) for a chunk of sections, over n-grams hashed into `columns`"""
+        candidates = Counter()
+        for ids, theme_rows in zip(section_terms, section_themes, strict=True):
+            if not theme_rows:
+                continue
+            grams = np.concatenate(self.section_ngrams(ids))
+            grams, gram_counts = np.unique(grams[np.isin(grams % self.hash_buckets, columns)], return_counts=True)
+            for gram, count in zip(grams.tolist(), gram_counts.tolist(), strict=True):
+                for row in theme_rows:
+                    candidates[row, gram] += count
+        return candidates
+
+    def rescore_candidates(self, top_terms, candidates, theme_totals):
+        """Replace each theme's top columns by the n-grams behind them as [(ngram_id, score, count)].
+
+        Per column the n-gram with the best exact c-TF-IDF score in that theme wins, so a
+        column shared by unrelated n-grams is labeled by the one that earned the score.
+        """
+        term_totals, by_column = Counter(), defaultdict(list)
+        for (row, gram), count in candidates.items():
+            term_totals[gram] += count
+            by_column[row, gram % int(self.hash_buckets)].append((gram, count))
+        average_total = theme_totals.sum() / max(1, len(theme_totals))
+
+        rescored = []
+        for row, terms in enumerate(top_terms):
+            theme_total = max(float(theme_totals[row]), 1.0)
+            best = []
+            for column, _, _ in terms:
+                scored = [
+                    (count / theme_total * float(np.log1p(average_total / term_totals[gram])), count, gram)
+                    for gram, count in by_column.get((row, column), ())
+                ]
+                if scored:
+                    score, count, gram = max(scored)
+                    best.append((gram, score, count))
+            best.sort(key=lambda term: term[1], reverse=True)
+            rescored.append(best)
+        return rescored
+
+    def resolve_ngrams(self, texts, targets, names):
+        """Fill `names` with the string of each target n-gram id found in `texts`"""
         for text in texts:
-            ngrams = self.extract_ngrams(text, min_length, max_length)
-            all_ngrams.extend(ngrams)
-        
-        # Count n-grams
-        ngram_counts = Counter(all_ngrams)
-        
-        # Return top n most frequent n-grams
-        return ngram_counts.most_common(top_n)
+            tokens = tokenize(text)
+            grams = self.section_ngrams(term_ids(tokens))
+            for n, ids in zip(range(self.min_ngram_length, self.max_ngram_length + 1), grams, strict=True):
+                for i in np.flatnonzero(np.isin(ids, targets)):
+                    names.setdefault(int(ids[i]), ' '.join(tokens[i:i + n]))
+        return names
     
     def generate_theme_label(self, top_ngrams, theme_texts):
         """Generate theme label from top n-grams"""
@@ -116,6 +213,7 @@ async def main():
     await nc.connect(os.getenv("NATS_URL", "nats://localhost:4222"))
     engine = create_db_engine()
     worker = LabelingWorker()
+    runtime = WorkerRuntime("label")
 
     async def handle(msg):
         data = msg.data.decode()
@@ -123,78 +221,165 @@ async def main():
             payload = json.loads(data)
             project_id = payload.get("projectId")
             theme_id = payload.get("themeId")
+            theme_ids = payload.get("themeIds")
         except Exception:
             return
 
         try:
+            if theme_id and not project_id:
+                # c-TF-IDF needs the whole project, even to relabel one theme
+                project_id = await runtime.run_io(fetch_theme_project_id, engine, theme_id)
+                theme_ids = [theme_id]
             if project_id:
-                # Label all themes in project
-                themes = fetch_project_themes(engine, project_id)
-                for theme in themes:
-                    await label_single_theme(engine, worker, theme['id'])
-            elif theme_id:
-                # Label single theme
-                await label_single_theme(engine, worker, theme_id)
+                await label_project(project_id, {str(t) for t in theme_ids} if theme_ids is not None else None)
                 
         except Exception as e:
             print(f"Error in labeling: {e}")
 
-    async def label_single_theme(engine, worker, theme_id):
-        """Label a single theme"""
-        # Fetch sections for this theme
-        sections = fetch_theme_sections_for_labeling(engine, theme_id)
-        
-        if not sections:
-            print(f"No sections found for theme {theme_id}")
+    async def label_project(project_id, only_themes=None):
+        """Label every theme of a project (or just `only_themes`) in one pass over its sections"""
+        theme_index, document_themes = {}, defaultdict(list)
+        for row in await runtime.run_io(fetch_project_theme_assignments, engine, project_id):
+            row_index = theme_index.setdefault(str(row['theme_id']), len(theme_index))
+            document_themes[str(row['document_id'])].append(row_index)
+        if not theme_index:
+            print(f"No assigned themes to label for project {project_id}")
             return
+        theme_ids = list(theme_index)
         
-        # Extract texts
-        texts = [section['text'] for section in sections]
+        # Count hashed n-grams per theme; chunks are counted in the process pool, several at
+        # a time, while the next chunk is read
+        keys, counts = np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+        pending_keys, pending_counts = [], []
+        counting = deque()
+        sample_ids = [[] for _ in theme_ids]
+        sections_analyzed = np.zeros(len(theme_ids), dtype=np.int64)
         
-        # Get top n-grams
-        top_ngrams = worker.get_top_ngrams(
-            texts, 
-            worker.min_ngram_length, 
-            worker.max_ngram_length, 
-            worker.top_n_terms
-        )
-        
-        # Generate label
-        label = worker.generate_theme_label(top_ngrams, texts)
-        
-        # Extract key phrases
-        key_phrases = worker.extract_key_phrases(texts, top_ngrams)
+        async def fold(task):
+            nonlocal keys, counts, pending_keys, pending_counts
+            chunk_keys, chunk_counts = await task
+            pending_keys.append(chunk_keys)
+            pending_counts.append(chunk_counts)
+            if sum(len(k) for k in pending_keys) >= LABEL_FOLD_ENTRIES:
+                keys, counts = worker.merge_counts(
+                    np.concatenate([keys, *pending_keys]), np.concatenate([counts, *pending_counts])
+                )
+                pending_keys, pending_counts = [], []
+
+        sections_chunks = iter_project_section_tokens(engine, project_id)
+        async for sections in runtime.iterate_io(sections_chunks, prefetch=True):
+            section_terms = await load_section_terms(sections)
+            section_themes = [document_themes.get(str(section['document_id']), []) for section in sections]
+            counting.append(asyncio.ensure_future(
+                runtime.run_cpu(worker.chunk_term_counts, section_terms, section_themes)
+            ))
+            if len(counting) >= LABEL_COUNT_CONCURRENCY:
+                await fold(counting.popleft())
+
+            for section, theme_rows in zip(sections, section_themes, strict=True):
+                for row in theme_rows:
+                    sections_analyzed[row] += 1
+                    # Key phrases only look at the first few texts
+                    if len(sample_ids[row]) < 3:
+                        sample_ids[row].append(str(section['id']))
         
-        # Create provenance
-        provenance = {
-            'method': 'ngram_extraction',
-            'top_ngrams': top_ngrams[:5],
-            'key_phrases': key_phrases,
-            'sections_analyzed': len(sections),
-            'min_ngram_length': worker.min_ngram_length,
-            'max_ngram_length': worker.max_ngram_length
-        }
+        while counting:
+            await fold(counting.popleft())
+        keys, counts = worker.merge_counts(
+            np.concatenate([keys, *pending_keys]), np.concatenate([counts, *pending_counts])
+        )
+        top_terms = await runtime.run_io(worker.score_themes, keys, counts, len(theme_ids))
         
-        # Update theme with label and provenance
-        update_theme_label_and_provenance(engine, theme_id, label, provenance)
+        # Second pass over the term ids recounts the winning columns by full n-gram id
+        columns = np.unique(np.array([column for terms in top_terms for column, _, _ in terms], dtype=np.uint64))
+        candidates = Counter()
+        if len(columns):
+            sections_chunks = iter_project_section_tokens(engine, project_id)
+            async for sections in runtime.iterate_io(sections_chunks, prefetch=True):
+                section_terms = await load_section_terms(sections)
+                section_themes = [document_themes.get(str(section['document_id']), []) for section in sections]
+                counting.append(asyncio.ensure_future(
+                    runtime.run_cpu(worker.chunk_candidate_counts, section_terms, section_themes, columns)
+                ))
+                if len(counting) >= LABEL_COUNT_CONCURRENCY:
+                    candidates.update(await counting.popleft())
+            while counting:
+                candidates.update(await counting.popleft())
+        top_terms = worker.rescore_candidates(
+            top_terms, candidates, worker.theme_totals(keys, counts, len(theme_ids))
+        )
+
+        # Third, early-stopping pass recovers the strings of the winning n-grams only
+        targets = np.unique(np.array([gram for terms in top_terms for gram, _, _ in terms], dtype=np.uint64))
+        names = {}
+        if len(targets):
+            sections_chunks = iter_project_sections_for_labeling(engine, project_id)
+            async for sections in runtime.iterate_io(sections_chunks, prefetch=True):
+                await runtime.run_io(worker.resolve_ngrams, [section['text'] for section in sections], targets, names)
+                if len(names) == len(targets):
+                    break
         
-        print(f"Labeled theme {theme_id}: {label}")
+        sample_lookup = await runtime.run_io(
+            fetch_section_texts, engine, list({i for ids in sample_ids for i in ids})
+        )
+        sample_texts = [[sample_lookup[i] for i in ids if i in sample_lookup] for ids in sample_ids]
 
-    await nc.subscribe("label.run", cb=handle)
-    await nc.subscribe("label.theme", cb=handle)
-    while True:
-        await asyncio.sleep(5)
+        updates = []
+        for row, theme_id in enumerate(theme_ids):
+            if only_themes is not None and theme_id not in only_themes:
+                continue
+            if not sections_analyzed[row]:
+                print(f"No sections found for theme {theme_id}")
+                continue
 
+            top_ngrams = [(names[gram], count) for gram, _, count in top_terms[row] if gram in names]
 
-def fetch_project_themes(engine, project_id):
-    """Fetch all themes for a project"""
-    sql = """
-    SELECT id FROM themes 
-    WHERE "projectId" = :project_id
-    """
-    with engine.connect() as conn:
-        rows = conn.execute(sql, {"project_id": project_id}).fetchall()
-        return [{'id': row[0]} for row in rows]
+            # Generate label
+            label = worker.generate_theme_label(top_ngrams, sample_texts[row])
+
+            # Extract key phrases
+            key_phrases = worker.extract_key_phrases(sample_texts[row], top_ngrams)
+
+            # Create provenance
+            provenance = {
+                'method': 'c-tf-idf',
+                'top_ngrams': top_ngrams[:5],
+                'scores': [round(score, 6) for gram, score, _ in top_terms[row] if gram in names][:5],
+                'key_phrases': key_phrases,
+                'sections_analyzed': int(sections_analyzed[row]),
+                'min_ngram_length': worker.min_ngram_length,
+                'max_ngram_length': worker.max_ngram_length
+            }
+
+            updates.append((theme_id, label, provenance))
+
+        # Every theme's label and provenance in one transaction
+        await runtime.run_io(update_theme_labels_and_provenance, engine, updates)
+        for theme_id, label, _ in updates:
+            print(f"Labeled theme {theme_id}: {label}")
+
+    async def load_section_terms(sections):
+        """Term id arrays of a chunk of sections, tokenizing (and storing) any not yet tokenized"""
+        section_terms = [
+            unpack_term_ids(section['token_ids']) if section['token_ids'] is not None else None
+            for section in sections
+        ]
+        missing = [i for i, ids in enumerate(section_terms) if ids is None]
+        if missing:
+            # Sections ingested before term ids were stored are tokenized once, here
+            backfill = await runtime.run_cpu(section_term_ids, [sections[i]['text'] for i in missing])
+            await runtime.run_io(
+                store_section_token_ids, engine,
+                [sections[i]['id'] for i in missing], [pack_term_ids(ids) for ids in backfill]
+            )
+            for i, ids in zip(missing, backfill, strict=True):
+                section_terms[i] = ids
+        return section_terms
+
+    await runtime.subscribe(nc, "label.run", handle)
+    await runtime.subscribe(nc, "label.theme", handle)
+    while True:
+        await asyncio.sleep(5)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+"""Time the matrix extractor on pathological sections, next to the per-pattern regexes it replaced.
+
+    python -m workers.matrix_worker.bench
+    python -m workers.matrix_worker.bench --sizes 10000 100000 1000000 --legacy-budget 2
+
+Each input is a single section of the given size in characters. Legacy timings stop
+for an input once one run exceeds --legacy-budget seconds; its cost grows
+quadratically, so larger sizes would only hang.
+"""
+import argparse
+import re
+import time
+
+from workers.matrix_worker.run import scan_text
+
+# The patterns extract_methods / extract_metrics / extract_datasets ran before scan_text
+LEGACY_PATTERNS = [
+    r'(?:using|with|via|through)\s+([A-Za-z\s]+(?:learning|network|algorithm|model|method|approach|technique))',
+    r'([A-Za-z\s]+(?:learning|network|algorithm|model|method|approach|technique))',
+    r'(?:implemented|developed|proposed)\s+([A-Za-z\s]+(?:learning|network|algorithm|model|method|approach|technique))',
+    r'(\d+(?:\.\d+)?)\s*(accuracy|precision|recall|f1|f1-score|auc|mse|mae|rmse|r2|correlation|p-value|t-statistic|z-score)',
+    r'(accuracy|precision|recall|f1|f1-score|auc|mse|mae|rmse|r2|correlation|p-value|t-statistic|z-score)\s*(?:of|is|was)\s*(\d+(?:\.\d+)?)',
+    r'(\d+(?:\.\d+)?)\s*(percent|%|seconds|minutes|hours|days|weeks|months|years|epochs|iterations|samples|instances|features|dimensions)',
+    r'([A-Za-z0-9\s]+(?:dataset|corpus|collection|benchmark))',
+    r'(?:using|on|with)\s+([A-Za-z0-9\s]+(?:dataset|corpus|collection|benchmark))',
+    r'([A-Za-z0-9\s]+)\s+(?:dataset|corpus|collection|benchmark)',
+    r'(\d+(?:,\d+)?(?:k|K|m|M)?)\s+(?:samples|instances|records|examples|data points)',
+]
+
+REFERENCE_ENTRY = (
+    "Smith J Jones K and Lee M Deep residual learning for image recognition in Proceedings of "
+    "the IEEE Conference on Computer Vision and Pattern Recognition pages 770 778 "
+)
+
+
+def _repeat_to(piece, size):
+    return (piece * (size // len(piece) + 1))[:size]
+
+
+# name -> builder of a section of `size` characters
+INPUTS = {
+    # Reference lists lose their punctuation in extraction: one long letters-and-digits run
+    "references": lambda size: _repeat_to(REFERENCE_ENTRY, size),
+    # Letters and spaces with no keyword anywhere
+    "keywordless": lambda size: _repeat_to("lorem ipsum dolor sit amet ", size),
+    # A keyword-like word that never completes
+    "near-miss": lambda size: _repeat_to("learnin networ datase ", size),
+    # Keywords everywhere
+    "dense": lambda size: _repeat_to("0.9 accuracy of 12 epochs deep learning model on 5k samples dataset ", size),
+}
+
+
+def _legacy_scan(text):
+    for pattern in LEGACY_PATTERNS:
+        for _ in re.finditer(pattern, text, re.IGNORECASE):
+            pass
+
+
+def _best_of(fn, text, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(sizes, repeat, legacy_budget):
+    print(f"{'input':<12} {'chars':>9} {'scan_text':>12} {'legacy':>12}")
+    for name, build in INPUTS.items():
+        legacy_done = legacy_budget <= 0
+        for size in sizes:
+            text = build(size)
+            seconds = _best_of(scan_text, text, repeat)
+            legacy = "skipped"
+            if not legacy_done:
+                legacy_seconds = _best_of(_legacy_scan, text, 1)
+                legacy = f"{legacy_seconds * 1000:.1f} ms"
+                legacy_done = legacy_seconds > legacy_budget
+            print(f"{name:<12} {size:>9} {seconds * 1000:>9.1f} ms {legacy:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--legacy-budget", type=float, default=5.0, help="seconds; 0 skips the legacy patterns")
+    args = parser.parse_args()
+    run(args.sizes, args.repeat, args.legacy_budget)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,101 +3,220 @@ import asyncio
 import json
 import re
 from nats.aio.client import Client as NATS
-from workers.common.db import create_db_engine
+from workers.common.db import (
+    create_db_engine,
+    fetch_parsed_document_ids,
+    iter_document_sections,
+    write_extracted_rows,
+)
+from workers.common.runtime import WorkerRuntime
+from workers.common.tokens import STOP_WORDS
 
 
-def extract_methods(text):
-    """Extract methods from text"""
-    methods = []
-    
-    # Common method patterns
-    method_patterns = [
-        r'(?:using|with|via|through)\s+([A-Za-z\s]+(?:learning|network|algorithm|model|method|approach|technique))',
-        r'([A-Za-z\s]+(?:learning|network|algorithm|model|method|approach|technique))',
-        r'(?:implemented|developed|proposed)\s+([A-Za-z\s]+(?:learning|network|algorithm|model|method|approach|technique))'
-    ]
+# Documents whose extracted rows are written together in one transaction
+MATRIX_WRITE_DOCUMENTS = int(os.getenv("MATRIX_WRITE_DOCUMENTS", "50"))
+# Sections sent to the process pool per call; a read chunk is split into calls of this size
+MATRIX_EXTRACT_BATCH = int(os.getenv("MATRIX_EXTRACT_BATCH", "200"))
+
+METHOD_KEYWORDS = ('learning', 'network', 'algorithm', 'model', 'method', 'approach', 'technique')
+METRIC_NAMES = (
+    'accuracy', 'precision', 'recall', 'f1', 'f1-score', 'auc', 'mse', 'mae', 'rmse', 'r2',
+    'correlation', 'p-value', 't-statistic', 'z-score'
+)
+METRIC_UNITS = (
+    'percent', '%', 'seconds', 'minutes', 'hours', 'days', 'weeks', 'months', 'years',
+    'epochs', 'iterations', 'samples', 'instances', 'features', 'dimensions'
+)
+DATASET_NOUNS = ('dataset', 'corpus', 'collection', 'benchmark')
+DATASET_SIZE_NOUNS = ('samples', 'instances', 'records', 'examples', 'data points')
+
+# Which collectors a keyword feeds; 'samples' and 'instances' are both a unit and a size noun
+_KEYWORD_KINDS = {}
+for _kind, _words in (
+    ('method', METHOD_KEYWORDS), ('metric', METRIC_NAMES), ('unit', METRIC_UNITS),
+    ('dataset', DATASET_NOUNS), ('size', DATASET_SIZE_NOUNS),
+):
+    for _word in _words:
+        _KEYWORD_KINDS.setdefault(_word, set()).add(_kind)
+
+
+def _keyword_pattern(word):
+    """A keyword as a whole word: not inside a longer word ("mae" in "maestro"), though a
+    number may run into it ("95accuracy"). Method and dataset nouns may be plural."""
+    pattern = re.escape(word).replace(r'\ ', r'\s+')
+    if _KEYWORD_KINDS[word] & {'method', 'dataset'}:
+        pattern += '(?:e?s)?'
+    if word[0].isalnum():
+        pattern = r'(?<![^\W\d])' + pattern
+    if word[-1].isalnum():
+        pattern += r'(?!\w)'
+    return pattern
+
+
+def _keyword_kinds(keyword):
+    """Collectors of a matched keyword, looking through plural endings"""
+    word = ' '.join(keyword.lower().split())
+    for candidate in (word, word[:-1], word[:-2]):
+        if candidate in _KEYWORD_KINDS:
+            return _KEYWORD_KINDS[candidate]
+    raise KeyError(keyword)
+
+
+# Every keyword in one alternation, longest first; each section is scanned with it once
+# and all other matching happens in bounded windows around its hits, so no pattern can
+# backtrack over more than a few dozen characters
+_KEYWORD_RE = re.compile('|'.join(
+    _keyword_pattern(word) for word in sorted(_KEYWORD_KINDS, key=len, reverse=True)
+), re.IGNORECASE)
+
+# Longest method / dataset phrase looked at in front of its keyword
+_PHRASE_MAX_CHARS = 96
+_PHRASE_MAX_WORDS = 6
+_METHOD_TAIL_RE = re.compile(r'[A-Za-z\s]*\Z')
+_DATASET_TAIL_RE = re.compile(r'[A-Za-z0-9\s-]*\Z')
+# A phrase starts after the last of these ("trained using deep learning" -> "deep learning")
+_BREAK_WORDS = STOP_WORDS | {'using', 'via', 'through', 'implemented', 'developed', 'proposed'}
+
+_NUMBER_WINDOW = 32
+_NUMBER_BEFORE_RE = re.compile(r'(\d+(?:\.\d+)?)\s*\Z')
+_NUMBER_AFTER_RE = re.compile(r'\s*(?:of|is|was)\s*(\d+(?:\.\d+)?)', re.IGNORECASE)
+_COUNT_BEFORE_RE = re.compile(
+    r'(\d+(?:,\d+)?(?:k|K|m|M)?)\s+(?:(?:training|test|validation)\s+)?\Z', re.IGNORECASE
+)
+
+_SIZE_RE = re.compile(
+    r'(\d+(?:,\d+)?(?:k|K|m|M)?)\s+(?:(?:training|test|validation)\s+)?'
+    r'(?:samples|instances|records|examples|data\s+points)',
+    re.IGNORECASE
+)
+
+
+def _phrase_before(tail_re, text, start, end):
+    """The keyword at [start, end) with the words of its phrase run in front of it"""
+    window_start = max(0, start - _PHRASE_MAX_CHARS)
+    tail_start = tail_re.search(text, window_start, start).start()
+    words = text[tail_start:end].split()
+    if tail_start == window_start and window_start and not text[window_start - 1].isspace():
+        # The window cut through a word
+        words = words[1:]
+    words = words[-_PHRASE_MAX_WORDS:]
+    for i in range(len(words) - 2, -1, -1):
+        if words[i].lower() in _BREAK_WORDS:
+            words = words[i + 1:]
+            break
+    return ' '.join(words)
+
+
+def _number_before(pattern, text, start):
+    match = pattern.search(text, max(0, start - _NUMBER_WINDOW), start)
+    return match.group(1) if match else None
+
+
+def scan_text(text):
+    """Single pass over a section routing keyword hits to the method, metric and dataset collectors"""
+    methods, metrics, datasets = set(), [], []
     
-    for pattern in method_patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            method = match.group(1).strip()
-            if len(method) > 3 and len(method) < 100:
-                methods.append(method)
+    for match in _KEYWORD_RE.finditer(text):
+        start, end = match.span()
+        keyword = match.group()
+        kinds = _keyword_kinds(keyword)
+
+        if 'method' in kinds:
+            method = _phrase_before(_METHOD_TAIL_RE, text, start, end)
+            if 3 < len(method) < 100:
+                methods.add(method)
+
+        if 'metric' in kinds or 'unit' in kinds:
+            # "0.93 accuracy", "12 epochs"
+            value = _number_before(_NUMBER_BEFORE_RE, text, start)
+            if value is not None:
+                metrics.append({'value': float(value), 'unit': keyword, 'metric': keyword})
+        if 'metric' in kinds:
+            # "accuracy of 0.93"
+            after = _NUMBER_AFTER_RE.match(text, end, end + _NUMBER_WINDOW)
+            if after:
+                metrics.append({'value': float(after.group(1)), 'unit': keyword, 'metric': keyword})
+
+        if 'dataset' in kinds:
+            name = _phrase_before(_DATASET_TAIL_RE, text, start, end)
+            if len(name) > 2:
+                datasets.append({'name': name, 'size': extract_dataset_size(name), 'type': 'dataset'})
+        if 'size' in kinds:
+            # "50,000 samples", "50,000 training samples"
+            count = _number_before(_COUNT_BEFORE_RE, text, start)
+            if count is not None and len(count) > 2:
+                datasets.append({'name': count, 'size': count, 'type': 'dataset'})
     
-    return list(set(methods))
+    return list(methods), metrics, datasets
+
+
+def extract_methods(text):
+    """Extract methods from text"""
+    return scan_text(text)[0]
 
 
 def extract_metrics(text):
     """Extract metrics with units from text"""
-    metrics = []
-    
-    # Metric patterns with units
-    metric_patterns = [
-        r'(\d+(?:\.\d+)?)\s*(accuracy|precision|recall|f1|f1-score|auc|mse|mae|rmse|r2|correlation|p-value|t-statistic|z-score)',
-        r'(accuracy|precision|recall|f1|f1-score|auc|mse|mae|rmse|r2|correlation|p-value|t-statistic|z-score)\s*(?:of|is|was)\s*(\d+(?:\.\d+)?)',
-        r'(\d+(?:\.\d+)?)\s*(percent|%|seconds|minutes|hours|days|weeks|months|years|epochs|iterations|samples|instances|features|dimensions)'
-    ]
-    
-    for pattern in metric_patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            if len(match.groups()) == 2:
-                value = match.group(1)
-                unit = match.group(2)
-                metrics.append({
-                    'value': float(value),
-                    'unit': unit,
-                    'metric': unit
-                })
-    
-    return metrics
+    return scan_text(text)[1]
 
 
 def extract_datasets(text):
     """Extract dataset information from text"""
-    datasets = []
-    
-    # Dataset patterns
-    dataset_patterns = [
-        r'([A-Za-z0-9\s]+(?:dataset|corpus|collection|benchmark))',
-        r'(?:using|on|with)\s+([A-Za-z0-9\s]+(?:dataset|corpus|collection|benchmark))',
-        r'([A-Za-z0-9\s]+)\s+(?:dataset|corpus|collection|benchmark)',
-        r'(\d+(?:,\d+)?(?:k|K|m|M)?)\s+(?:samples|instances|records|examples|data points)'
-    ]
-    
-    for pattern in dataset_patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            dataset_info = match.group(1).strip()
-            if len(dataset_info) > 2:
-                datasets.append({
-                    'name': dataset_info,
-                    'size': extract_dataset_size(dataset_info),
-                    'type': 'dataset'
-                })
-    
-    return datasets
+    return scan_text(text)[2]
 
 
 def extract_dataset_size(text):
     """Extract dataset size from text"""
-    size_patterns = [
-        r'(\d+(?:,\d+)?(?:k|K|m|M)?)\s+(?:samples|instances|records|examples|data points)',
-        r'(\d+(?:,\d+)?(?:k|K|m|M)?)\s+(?:training|test|validation)\s+(?:samples|instances|records|examples)'
-    ]
-    
-    for pattern in size_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return match.group(1)
-    
-    return None
+    match = _SIZE_RE.search(text)
+    return match.group(1) if match else None
+
+
+def parse_dataset_size(size):
+    """'50,000' -> 50000, '10k' -> 10000; None when missing or too large for an int column"""
+    if not size:
+        return None
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(size[-1].lower(), 1)
+    value = int(size.rstrip('kKmM').replace(',', '')) * multiplier
+    return value if value < 2 ** 31 else None
+
+
+def extract_sections(texts):
+    """(methods, metrics, datasets) of each of a batch of section texts; runs in a worker process"""
+    return [scan_text(text) for text in texts]
+
+
+class ExtractedRows:
+    """Extracted rows of a run of documents, deduplicated on the keys they are written under"""
+
+    def __init__(self):
+        self.document_ids = []
+        self._documents = set()
+        self.methods = {}
+        self.metrics = {}
+        self.datasets = {}
+
+    def add(self, document_id, methods, metrics, datasets):
+        document_id = str(document_id)
+        if document_id not in self._documents:
+            self._documents.add(document_id)
+            self.document_ids.append(document_id)
+        for method in methods:
+            self.methods.setdefault((document_id, method), None)
+        for metric in metrics:
+            self.metrics.setdefault((document_id, metric['metric'], metric['value'], metric['unit']), None)
+        for dataset in datasets:
+            key = (document_id, dataset['name'])
+            size = parse_dataset_size(dataset['size'])
+            # Keep the first mention, but fill in a size from a later one
+            if key not in self.datasets or self.datasets[key][0] is None:
+                self.datasets[key] = (size, dataset['type'])
 
 
 async def main():
     nc = NATS()
     await nc.connect(os.getenv("NATS_URL", "nats://localhost:4222"))
     engine = create_db_engine()
+    runtime = WorkerRuntime("matrix")
 
     async def handle(msg):
         data = msg.data.decode()
@@ -108,99 +227,45 @@ async def main():
             return
 
         try:
-            # Fetch project documents
-            documents = fetch_project_documents(engine, project_id)
+            document_ids = await runtime.run_io(fetch_parsed_document_ids, engine, project_id)
             
-            for document in documents:
-                # Extract methods, metrics, datasets
-                methods = extract_methods(document['text'])
-                metrics = extract_metrics(document['text'])
-                datasets = extract_datasets(document['text'])
-                
+            # A document's metrics are replaced on write, so its sections must all land in one
+            # run; sections are paged per run of MATRIX_WRITE_DOCUMENTS documents
+            for start in range(0, len(document_ids), MATRIX_WRITE_DOCUMENTS):
+                rows = ExtractedRows()
+                sections_chunks = iter_document_sections(engine, document_ids[start:start + MATRIX_WRITE_DOCUMENTS])
+                async for sections in runtime.iterate_io(sections_chunks, prefetch=True):
+                    # Extract methods, metrics, datasets in the process pool, a batch of sections per call
+                    texts = [section['text'] for section in sections]
+                    results = await asyncio.gather(*(
+                        runtime.run_cpu(extract_sections, texts[i:i + MATRIX_EXTRACT_BATCH])
+                        for i in range(0, len(texts), MATRIX_EXTRACT_BATCH)
+                    ))
+                    extracted = (result for batch in results for result in batch)
+                    for section, (methods, metrics, datasets) in zip(sections, extracted, strict=True):
+                        rows.add(section['document_id'], methods, metrics, datasets)
+
                 # Store extracted data
-                store_extracted_data(engine, document['id'], methods, metrics, datasets)
+                if rows.document_ids:
+                    await runtime.run_io(store_extracted_data, engine, rows)
                 
         except Exception as e:
             print(f"Error in matrix extraction: {e}")
 
-    await nc.subscribe("matrix.extract", cb=handle)
+    await runtime.subscribe(nc, "matrix.extract", handle)
     while True:
         await asyncio.sleep(5)
 
 
-def fetch_project_documents(engine, project_id):
-    """Fetch documents for matrix extraction"""
-    sql = """
-    SELECT d.id, s.text
-    FROM documents d
-    JOIN sections s ON s."documentId" = d.id
-    WHERE d."projectId" = :project_id AND d.status = 'parsed'
-    """
-    with engine.connect() as conn:
-        rows = conn.execute(sql, {"project_id": project_id}).mappings().all()
-    return rows
-
-
-def store_extracted_data(engine, document_id, methods, metrics, datasets):
-    """Store extracted methods, metrics, and datasets"""
-    # Store methods
-    for method in methods:
-        insert_method(engine, document_id, method)
-    
-    # Store metrics
-    for metric in metrics:
-        insert_metric(engine, document_id, metric)
-    
-    # Store datasets
-    for dataset in datasets:
-        insert_dataset(engine, document_id, dataset)
-
-
-def insert_method(engine, document_id, method_name):
-    """Insert method into database"""
-    sql = """
-    INSERT INTO methods ("documentId", name, metadata)
-    VALUES (:doc_id, :name, :metadata)
-    ON CONFLICT ("documentId", name) DO UPDATE SET metadata = EXCLUDED.metadata
-    """
-    with engine.begin() as conn:
-        conn.execute(sql, {
-            "doc_id": document_id,
-            "name": method_name,
-            "metadata": {"extracted": True}
-        })
-
-
-def insert_metric(engine, document_id, metric_data):
-    """Insert metric into database"""
-    sql = """
-    INSERT INTO metrics ("documentId", name, value, unit, metadata)
-    VALUES (:doc_id, :name, :value, :unit, :metadata)
-    """
-    with engine.begin() as conn:
-        conn.execute(sql, {
-            "doc_id": document_id,
-            "name": metric_data['metric'],
-            "value": metric_data['value'],
-            "unit": metric_data['unit'],
-            "metadata": {"extracted": True}
-        })
-
-
-def insert_dataset(engine, document_id, dataset_data):
-    """Insert dataset into database"""
-    sql = """
-    INSERT INTO datasets ("documentId", name, size, metadata)
-    VALUES (:doc_id, :name, :size, :metadata)
-    ON CONFLICT ("documentId", name) DO UPDATE SET size = EXCLUDED.size, metadata = EXCLUDED.metadata
-    """
-    with engine.begin() as conn:
-        conn.execute(sql, {
-            "doc_id": document_id,
-            "name": dataset_data['name'],
-            "size": dataset_data['size'],
-            "metadata": {"extracted": True, "type": dataset_data['type']}
-        })
+def store_extracted_data(engine, rows):
+    """Store extracted methods, metrics, and datasets of a run of documents in one transaction"""
+    write_extracted_rows(
+        engine,
+        rows.document_ids,
+        list(rows.methods),
+        list(rows.metrics),
+        [(document_id, name, size, kind) for (document_id, name), (size, kind) in rows.datasets.items()],
+    )
 
 
 if __name__ == "__main__":
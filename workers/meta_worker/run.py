@@ -1,20 +1,12 @@
 import os
 import asyncio
 import json
-import hashlib
 import requests
 from difflib import SequenceMatcher
 from nats.aio.client import Client as NATS
 from workers.common.db import create_db_engine, update_document_metadata, find_duplicate_documents
-
-
-def calculate_md5(file_path):
-    """Calculate MD5 hash of file"""
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+from workers.common.files import calculate_md5
+from workers.common.runtime import WorkerRuntime
 
 
 def extract_doi_from_text(text):
@@ -136,10 +128,55 @@ def apply_inclusion_filters(metadata, filters):
     return True
 
 
+def enrich_document(engine, document_id, file_path, filters):
+    """Hash, look up and dedupe one document; returns the status it was given"""
+    # Calculate file hash
+    file_hash = calculate_md5(file_path)
+
+    # Extract DOI from document text
+    doi = extract_doi_from_text(get_document_text(engine, document_id))
+
+    # Fetch metadata from APIs
+    metadata = None
+    if doi:
+        metadata = fetch_crossref_metadata(doi)
+        if not metadata:
+            metadata = fetch_openalex_metadata(doi)
+
+    # If no DOI found, try to extract from filename
+    if not metadata:
+        metadata = extract_metadata_from_filename(file_path)
+
+    # Add hash to metadata
+    if metadata:
+        metadata['hash'] = file_hash
+
+    # Apply inclusion filters
+    if metadata and apply_inclusion_filters(metadata, filters):
+        # Check for duplicates
+        duplicates = find_duplicate_documents(engine, metadata)
+
+        if duplicates:
+            # Mark as duplicate
+            update_document_status(engine, document_id, 'duplicate')
+            link_duplicate_documents(engine, document_id, duplicates[0]['id'])
+            return 'duplicate'
+
+        # Update document with metadata
+        update_document_metadata(engine, document_id, metadata)
+        update_document_status(engine, document_id, 'enriched')
+        return 'enriched'
+
+    # Excluded by filters
+    update_document_status(engine, document_id, 'excluded')
+    return 'excluded'
+
+
 async def main():
     nc = NATS()
     await nc.connect(os.getenv("NATS_URL", "nats://localhost:4222"))
     engine = create_db_engine()
+    runtime = WorkerRuntime("meta", processes=0)
 
     async def handle(msg):
         data = msg.data.decode()
@@ -152,54 +189,20 @@ async def main():
             return
 
         try:
-            # Calculate file hash
-            file_hash = calculate_md5(file_path)
-            
-            # Extract DOI from document text
-            doi = extract_doi_from_text(get_document_text(engine, document_id))
+            # Hashing, HTTP lookups and DB writes all block, so they run in the thread pool
+            status = await runtime.run_io(enrich_document, engine, document_id, file_path, filters)
             
-            # Fetch metadata from APIs
-            metadata = None
-            if doi:
-                metadata = fetch_crossref_metadata(doi)
-                if not metadata:
-                    metadata = fetch_openalex_metadata(doi)
-            
-            # If no DOI found, try to extract from filename
-            if not metadata:
-                metadata = extract_metadata_from_filename(file_path)
-            
-            # Add hash to metadata
-            if metadata:
-                metadata['hash'] = file_hash
-            
-            # Apply inclusion filters
-            if metadata and apply_inclusion_filters(metadata, filters):
-                # Check for duplicates
-                duplicates = find_duplicate_documents(engine, metadata)
-                
-                if duplicates:
-                    # Mark as duplicate
-                    update_document_status(engine, document_id, 'duplicate')
-                    link_duplicate_documents(engine, document_id, duplicates[0]['id'])
-                else:
-                    # Update document with metadata
-                    update_document_metadata(engine, document_id, metadata)
-                    update_document_status(engine, document_id, 'enriched')
-                    
-                    # Trigger next step in pipeline
-                    await nc.publish("embed.upsert", json.dumps({
-                        "documentId": document_id
-                    }))
-            else:
-                # Excluded by filters
-                update_document_status(engine, document_id, 'excluded')
+            if status == 'enriched':
+                # Trigger next step in pipeline
+                await nc.publish("embed.upsert", json.dumps({
+                    "documentId": document_id
+                }))
                 
         except Exception as e:
             print(f"Error enriching metadata for document {document_id}: {e}")
-            update_document_status(engine, document_id, 'failed')
+            await runtime.run_io(update_document_status, engine, document_id, 'failed')
 
-    await nc.subscribe("meta.enrich", cb=handle)
+    await runtime.subscribe(nc, "meta.enrich", handle)
     while True:
         await asyncio.sleep(5)
 
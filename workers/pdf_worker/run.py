@@ -1,147 +1,238 @@
 import os
 import asyncio
 import json
+import re
+from collections import deque
 import fitz  # PyMuPDF
 import pytesseract
 from PIL import Image
-import io
 from nats.aio.client import Client as NATS
-from workers.common.db import create_db_engine, insert_document_sections
-
-
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF using PyMuPDF"""
-    doc = fitz.open(pdf_path)
-    text_content = []
-    
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        text = page.get_text()
-        if text.strip():
-            text_content.append({
-                'page': page_num + 1,
-                'text': text.strip()
-            })
-    
-    doc.close()
-    return text_content
-
-
-def extract_text_with_ocr(pdf_path):
-    """Extract text using OCR when text extraction fails"""
-    doc = fitz.open(pdf_path)
-    ocr_text = []
-    
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        pix = page.get_pixmap()
-        img_data = pix.tobytes("png")
-        
-        # Convert to PIL Image for OCR
-        img = Image.open(io.BytesIO(img_data))
-        text = pytesseract.image_to_string(img)
-        
-        if text.strip():
-            ocr_text.append({
-                'page': page_num + 1,
-                'text': text.strip(),
-                'method': 'ocr'
-            })
-    
-    doc.close()
-    return ocr_text
-
-
-def sectionize_text(text_content):
-    """Sectionize text using IMRAD structure"""
-    sections = []
-    current_section = None
-    current_text = []
-    
-    # Common section headers
-    section_patterns = {
-        'abstract': ['abstract', 'summary'],
-        'introduction': ['introduction', 'intro'],
-        'methods': ['methods', 'methodology', 'materials and methods'],
-        'results': ['results', 'findings'],
-        'discussion': ['discussion', 'conclusion', 'conclusions'],
-        'references': ['references', 'bibliography', 'works cited']
-    }
-    
-    for page_data in text_content:
-        lines = page_data['text'].split('\n')
+from workers.common.db import (
+    create_db_engine,
+    fetch_cached_sections,
+    ingest_document_sections,
+    store_cached_sections,
+    update_document_status,
+)
+from workers.common.files import calculate_md5
+from workers.common.lexical_index import open_project_index
+from workers.common.runtime import WorkerRuntime, worker_processes
+from workers.common.tokens import pack_term_ids, section_term_ids
+
+
+PDF_PAGES_PER_SHARD = int(os.getenv("PDF_PAGES_PER_SHARD", "16"))
+# Shards extracted at once ahead of the one being sectionized
+PDF_SHARDS_IN_FLIGHT = max(1, int(os.getenv("PDF_SHARDS_IN_FLIGHT", str(worker_processes("pdf")))))
+
+try:
+    # In-process Tesseract (pip install .[ocr]); without it OCR goes through pytesseract
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# One Tesseract handle per worker process, created on its first scanned page
+_tess_api = None
+
+
+def count_pages(pdf_path):
+    """Number of pages in a PDF"""
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def page_shards(page_count, shard_size=PDF_PAGES_PER_SHARD):
+    """Split [0, page_count) into contiguous (start, stop) page ranges"""
+    return [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+
+
+def ocr_page(page):
+    """OCR a page from its pixmap samples.
+
+    With tesserocr the samples are handed to an in-process Tesseract, so no image file or
+    subprocess is involved. pytesseract always writes a temporary PNG and runs the
+    tesseract binary, which is the fallback when tesserocr is not installed.
+    """
+    global _tess_api
+    pix = page.get_pixmap(alpha=False)
+    if tesserocr is not None:
+        if _tess_api is None:
+            _tess_api = tesserocr.PyTessBaseAPI()
+        _tess_api.SetImageBytes(pix.samples, pix.width, pix.height, pix.n, pix.stride)
+        return _tess_api.GetUTF8Text()
+    img = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples, "raw", "RGB", pix.stride, 1)
+    return pytesseract.image_to_string(img)
+
+
+def iter_pdf_pages(pdf_path, start=0, stop=None):
+    """Yield extracted pages of a page range using PyMuPDF, OCRing only pages with no text layer.
+
+    Each call opens its own document, so page ranges can be extracted in separate processes.
+    """
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(start, doc.page_count if stop is None else stop):
+            page = doc.load_page(page_num)
+            text = page.get_text()
+            if text.strip():
+                yield {
+                    'page': page_num + 1,
+                    'text': text.strip()
+                }
+                continue
+
+            # Fallback to OCR for scanned pages
+            text = ocr_page(page)
+            if text.strip():
+                yield {
+                    'page': page_num + 1,
+                    'text': text.strip(),
+                    'method': 'ocr'
+                }
+
+
+def extract_text_from_pdf(pdf_path, start=0, stop=None):
+    """Extract a page range as a list, for shipping back from a worker process"""
+    return list(iter_pdf_pages(pdf_path, start, stop))
+
+
+# Common section headers, in priority order when a line mentions several
+SECTION_PATTERNS = {
+    'abstract': ['abstract', 'summary'],
+    'introduction': ['introduction', 'intro'],
+    'methods': ['methods', 'methodology', 'materials and methods'],
+    'results': ['results', 'findings'],
+    'discussion': ['discussion', 'conclusion', 'conclusions'],
+    'references': ['references', 'bibliography', 'works cited']
+}
+
+_SECTION_PRIORITY = {name: i for i, name in enumerate(SECTION_PATTERNS)}
+
+# One alternation for every header, figure and table keyword; the group name says which matched
+_LINE_MATCHER = re.compile('|'.join(
+    [
+        f"(?P<{name}>{'|'.join(sorted(map(re.escape, patterns), key=len, reverse=True))})"
+        for name, patterns in SECTION_PATTERNS.items()
+    ] + ['(?P<figure>figure)', '(?P<table>table)']
+), re.IGNORECASE)
+
+_DIGIT_RE = re.compile(r'\d')
+
+
+def _matched_lines(text):
+    """Yield (line_start, line_end, matched group names) for lines of `text` with any keyword"""
+    line_start, line_end, kinds = 0, -1, set()
+    for match in _LINE_MATCHER.finditer(text):
+        if match.start() > line_end:
+            if kinds:
+                yield line_start, line_end, kinds
+            line_start = text.rfind('\n', 0, match.start()) + 1
+            line_end = text.find('\n', match.start())
+            if line_end == -1:
+                line_end = len(text)
+            kinds = set()
+        kinds.add(match.lastgroup)
+    if kinds:
+        yield line_start, line_end, kinds
+
+
+class PageSectionizer:
+    """Incremental IMRAD sectionizer over extracted pages, fed in page order.
+
+    `feed` takes the next pages (e.g. one extraction shard) as they arrive and `close` ends
+    the last section. Pages are never split into lines, and between feeds only the slices
+    of the open section are kept, so a document is never held whole. Closed sections and
+    figure and table captions accumulate on the instance.
+    """
+
+    def __init__(self):
+        self.sections, self.figures, self.tables = [], [], []
+        self._current_section, self._pieces, self._page = None, [], None
+
+    def feed(self, pages):
+        for page_data in pages:
+            self._feed_page(page_data['text'], page_data['page'])
+
+    def _feed_page(self, text, page):
+        self._page = page
+        # Start of the part of this page that belongs to the open section
+        section_start = 0
+        line_number, counted_to = 0, 0
         
-        for line in lines:
-            line_lower = line.lower().strip()
+        for line_start, line_end, kinds in _matched_lines(text):
+            line_number += text.count('\n', counted_to, line_start)
+            counted_to = line_start
+            line = text[line_start:line_end]
             
-            # Check if line is a section header
-            detected_section = None
-            for section_name, patterns in section_patterns.items():
-                if any(pattern in line_lower for pattern in patterns):
-                    detected_section = section_name
-                    break
+            # Figure and table captions need a number on the same line
+            if ('figure' in kinds or 'table' in kinds) and _DIGIT_RE.search(line):
+                for kind, captions in (('figure', self.figures), ('table', self.tables)):
+                    if kind in kinds:
+                        captions.append({
+                            'caption': line,
+                            'page': page,
+                            'line_number': line_number
+                        })
             
+            detected_section = min(
+                (kind for kind in kinds if kind in _SECTION_PRIORITY), key=_SECTION_PRIORITY.get, default=None
+            )
             if detected_section:
-                # Save previous section
-                if current_section and current_text:
-                    sections.append({
-                        'label': current_section,
-                        'text': '\n'.join(current_text),
-                        'page': page_data['page']
+                # Close previous section
+                if self._current_section:
+                    if line_start:
+                        self._pieces.append(text[section_start:line_start - 1])
+                    self.sections.append({
+                        'label': self._current_section,
+                        'text': '\n'.join(self._pieces),
+                        'page': page
                     })
                 
-                # Start new section
-                current_section = detected_section
-                current_text = [line]
-            else:
-                if current_section:
-                    current_text.append(line)
-    
-    # Save last section
-    if current_section and current_text:
-        sections.append({
-            'label': current_section,
-            'text': '\n'.join(current_text),
-            'page': page_data['page']
-        })
-    
-    return sections
-
-
-def detect_figures_and_tables(text_content):
-    """Detect figures and tables in text"""
-    figures = []
-    tables = []
-    
-    for page_data in text_content:
-        lines = page_data['text'].split('\n')
-        
-        for i, line in enumerate(lines):
-            line_lower = line.lower().strip()
-            
-            # Figure detection
-            if 'figure' in line_lower and any(char.isdigit() for char in line):
-                figures.append({
-                    'caption': line,
-                    'page': page_data['page'],
-                    'line_number': i
-                })
-            
-            # Table detection
-            if 'table' in line_lower and any(char.isdigit() for char in line):
-                tables.append({
-                    'caption': line,
-                    'page': page_data['page'],
-                    'line_number': i
-                })
-    
-    return figures, tables
+                # Start new section at the header line
+                self._current_section, self._pieces = detected_section, []
+                section_start = line_start
+
+        if self._current_section:
+            self._pieces.append(text[section_start:])
+
+    def close(self):
+        """Close the last section and return all sections"""
+        if self._current_section and self._pieces:
+            self.sections.append({
+                'label': self._current_section,
+                'text': '\n'.join(self._pieces),
+                'page': self._page
+            })
+        self._current_section, self._pieces = None, []
+        return self.sections
+
+
+async def extract_sections(runtime, file_path):
+    """Extract a PDF shard by shard in the process pool and sectionize the shards in page order.
+
+    At most PDF_SHARDS_IN_FLIGHT shards are extracted at once, and each is fed to the
+    sectionizer as soon as the shards before it are done, so extracted pages are dropped
+    as they are consumed rather than collected and shipped to another process.
+    """
+    page_count = await runtime.run_io(count_pages, file_path)
+    sectionizer = PageSectionizer()
+    pending = deque()
+    try:
+        for start, stop in page_shards(page_count):
+            pending.append(asyncio.ensure_future(runtime.run_cpu(extract_text_from_pdf, file_path, start, stop)))
+            if len(pending) >= PDF_SHARDS_IN_FLIGHT:
+                await runtime.run_io(sectionizer.feed, await pending.popleft())
+        while pending:
+            await runtime.run_io(sectionizer.feed, await pending.popleft())
+    finally:
+        for future in pending:
+            future.cancel()
+    return sectionizer.close()
 
 
 async def main():
     nc = NATS()
     await nc.connect(os.getenv("NATS_URL", "nats://localhost:4222"))
     engine = create_db_engine()
+    runtime = WorkerRuntime("pdf")
 
     async def handle(msg):
         data = msg.data.decode()
@@ -153,55 +244,42 @@ async def main():
             return
 
         try:
-            # Extract text from PDF
-            text_content = extract_text_from_pdf(file_path)
-            
-            # Fallback to OCR if no text extracted
-            if not text_content:
-                text_content = extract_text_with_ocr(file_path)
-            
-            # Sectionize the text
-            sections = sectionize_text(text_content)
-            
-            # Detect figures and tables
-            figures, tables = detect_figures_and_tables(text_content)
-            
-            # Store sections in database
-            for section in sections:
-                insert_document_sections(engine, document_id, section)
-            
-            # Update document status
-            update_document_status(engine, document_id, 'parsed')
+            # The same PDF uploaded to another project reuses its earlier extraction
+            content_hash = await runtime.run_io(calculate_md5, file_path)
+            sections = await runtime.run_io(fetch_cached_sections, engine, content_hash)
+
+            if sections is None:
+                # Extract page ranges in parallel; each process opens the PDF itself
+                sections = await extract_sections(runtime, file_path)
+                await runtime.run_io(store_cached_sections, engine, content_hash, sections)
             
+            # Tokenize once here; labeling and the lexical index read the stored term ids
+            token_ids = await runtime.run_cpu(section_term_ids, [section['text'] for section in sections])
+
+            # Store sections and index them off the event loop
+            await runtime.run_io(store_parsed_sections, engine, document_id, sections, token_ids, content_hash)
+
         except Exception as e:
             print(f"Error processing PDF {file_path}: {e}")
-            update_document_status(engine, document_id, 'failed')
+            await runtime.run_io(update_document_status, engine, document_id, 'failed')
 
-    await nc.subscribe("pdf.parse", cb=handle)
+    await runtime.subscribe(nc, "pdf.parse", handle)
     while True:
         await asyncio.sleep(5)
 
 
-def insert_document_sections(engine, document_id, section):
-    """Insert document sections into database"""
-    sql = """
-    INSERT INTO sections ("documentId", label, text, "pageNumber")
-    VALUES (:doc_id, :label, :text, :page)
-    """
-    with engine.begin() as conn:
-        conn.execute(sql, {
-            "doc_id": document_id,
-            "label": section['label'],
-            "text": section['text'],
-            "page": section['page']
-        })
-
-
-def update_document_status(engine, document_id, status):
-    """Update document processing status"""
-    sql = "UPDATE documents SET status = :status WHERE id = :doc_id"
-    with engine.begin() as conn:
-        conn.execute(sql, {"status": status, "doc_id": document_id})
+def store_parsed_sections(engine, document_id, sections, token_ids, content_hash=None):
+    """Persist parsed sections with their term ids, mark the document parsed and add it to the lexical index"""
+    # One multi-row insert, committed together with the status change and the content hash
+    # the embed worker copies cached embeddings by
+    section_ids, project_id = ingest_document_sections(
+        engine, document_id, sections, 'parsed', token_ids=[pack_term_ids(ids) for ids in token_ids],
+        content_hash=content_hash
+    )
+
+    # Add the new sections to the project's lexical (BM25) index
+    if project_id:
+        open_project_index(project_id).add_section_terms(zip(section_ids, token_ids, strict=True))
 
 
 if __name__ == "__main__":
@@ -1,68 +1,251 @@
 import os
 import asyncio
 import json
+import threading
+from collections import OrderedDict
 import numpy as np
 from nats.aio.client import Client as NATS
-from workers.common.db import create_db_engine
+from workers.common.db import (
+    ANN_MAX_EF_SEARCH,
+    create_db_engine,
+    fetch_filtered_document_ids,
+    fetch_project_embedding_matrix,
+    fetch_sections_by_ids,
+    search_similar_chunks,
+    search_similar_sections,
+)
+from workers.common.encoder import QUERY_BATCH_SIZE, QUERY_BATCH_WAIT_MS, get_query_encoder
+from workers.common.lexical_index import sync_project_index
+from workers.common.runtime import WorkerRuntime
+
+
+class DenseScorer:
+    """Exact cosine scoring over a cached, pre-normalised float32 matrix per project.
+
+    Used when the HNSW path is unavailable or under-filled. The cache is dropped for a
+    project whenever its embeddings change (see the `embed.updated` subscription).
+    """
+
+    def __init__(self, engine, max_projects=int(os.getenv("RAG_DENSE_CACHE_PROJECTS", "4"))):
+        self.engine = engine
+        self.max_projects = max_projects
+        self._projects = OrderedDict()
+        # Queries are scored from the worker's thread pool; `_lock` only guards the dicts,
+        # a project's load holds that project's own lock
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        # Bumped by invalidate, so a load that raced with it is not cached
+        self._generations = {}
+
+    def invalidate(self, project_id):
+        with self._lock:
+            self._projects.pop(project_id, None)
+            self._generations[project_id] = self._generations.get(project_id, 0) + 1
+
+    def _load(self, project_id):
+        with self._lock:
+            entry = self._projects.get(project_id)
+            if entry is not None:
+                self._projects.move_to_end(project_id)
+                return entry
+            load_lock = self._load_locks.setdefault(project_id, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._projects.get(project_id)
+                generation = self._generations.get(project_id, 0)
+            if entry is None:
+                # Loaded outside `_lock`, so other projects keep being served meanwhile
+                rows, matrix = fetch_project_embedding_matrix(self.engine, project_id)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                matrix /= np.maximum(norms, np.finfo(np.float32).tiny)
+                document_ids = np.array([str(row['document_id']) for row in rows])
+                entry = (rows, matrix, document_ids)
+            with self._lock:
+                if self._generations.get(project_id, 0) == generation:
+                    self._projects[project_id] = entry
+                    self._projects.move_to_end(project_id)
+                    while len(self._projects) > self.max_projects:
+                        self._projects.popitem(last=False)
+                self._load_locks.pop(project_id, None)
+            return entry
+
+    def score_many(self, project_id, query_matrix, k, filters=None):
+        """Return, for each query row, up to k (section, similarity) pairs best first.
+
+        All queries share the project's filters and are scored with one matrix multiply.
+        """
+        rows, matrix, document_ids = self._load(project_id)
+        queries = np.atleast_2d(np.asarray(query_matrix, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), np.finfo(np.float32).tiny)
+
+        candidates = np.arange(len(rows))
+        if filters:
+            allowed = [str(doc_id) for doc_id in fetch_filtered_document_ids(self.engine, project_id, filters)]
+            candidates = np.flatnonzero(np.isin(document_ids, allowed))
+            matrix = matrix[candidates]
+        if not len(candidates):
+            return [[] for _ in queries]
+
+        similarities = queries @ matrix.T
+        k = min(k, len(candidates))
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        results = []
+        for query_similarities, query_top in zip(similarities, top, strict=True):
+            query_top = query_top[np.argsort(-query_similarities[query_top])]
+            results.append([(rows[candidates[i]], float(query_similarities[i])) for i in query_top])
+        return results
+
+
+class ExactScoringBatcher:
+    """Scores concurrent exact-retrieval queries of one project and filter set together.
+
+    Requests are collected for up to `max_wait_ms` (the QueryEncoder's batching window),
+    so questions encoded in the same micro-batch also share one DenseScorer.score_many
+    pass over the project matrix on the runtime's thread pool.
+    """
+
+    def __init__(self, scorer, runtime, k, max_batch_size=QUERY_BATCH_SIZE, max_wait_ms=QUERY_BATCH_WAIT_MS):
+        self.scorer = scorer
+        self.runtime = runtime
+        self.k = k
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._open = {}
+
+    async def score(self, project_id, query_vector, filters=None):
+        """Up to k (section, similarity) pairs for one query, best first"""
+        key = (project_id, json.dumps(filters or {}, sort_keys=True))
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = []
+            asyncio.get_running_loop().create_task(self._run(key, batch, project_id, filters))
+        future = asyncio.get_running_loop().create_future()
+        batch.append((query_vector, future))
+        if len(batch) >= self.max_batch_size:
+            # Full: later queries open a new batch
+            del self._open[key]
+        return await future
+
+    async def _run(self, key, batch, project_id, filters):
+        await asyncio.sleep(self.max_wait)
+        if self._open.get(key) is batch:
+            del self._open[key]
+        try:
+            results = await self.runtime.run_io(
+                self.scorer.score_many, project_id, np.stack([vector for vector, _ in batch]), self.k, filters
+            )
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), scored in zip(batch, results, strict=True):
+            future.set_result(scored)
 
 
 class RAGWorker:
     def __init__(self):
         self.top_k = 5
         self.similarity_threshold = 0.7
-        
-    def hybrid_retrieval(self, query, sections, embeddings):
-        """Perform hybrid retrieval (BM25 + dense)"""
-        # Simple implementation - in production would use proper BM25 + dense retrieval
-        # For now, use cosine similarity on embeddings
-        
-        if not embeddings:
-            return []
-        
-        # Convert query to embedding (simplified)
-        query_embedding = self.simple_query_embedding(query)
-        
-        # Calculate similarities
-        similarities = []
-        for i, section_embedding in enumerate(embeddings):
-            similarity = self.cosine_similarity(query_embedding, section_embedding)
-            similarities.append((i, similarity))
-        
-        # Sort by similarity
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        
-        # Return top k results
+        self.candidate_k = 50
+        self.rrf_k = 60
+
+    def hybrid_retrieval(self, dense_results, lexical_results):
+        """Perform hybrid retrieval (BM25 + dense) by reciprocal rank fusion"""
+        fused = {}
+        for results in (dense_results, lexical_results):
+            for result in results:
+                section_id = str(result['section']['id'])
+                entry = fused.setdefault(section_id, dict(result, score=0.0))
+                entry['score'] += 1.0 / (self.rrf_k + result['rank'])
+
+        # Return top k results by fused score
+        ranked = sorted(fused.values(), key=lambda r: r['score'], reverse=True)[:self.top_k]
+        for rank, result in enumerate(ranked, start=1):
+            result['rank'] = rank
+
+        return ranked
+
+    def exact_retrieval(self, scored):
+        """Rank exact (section, similarity) pairs above the threshold (fallback when ANN is unavailable)"""
         results = []
-        for idx, similarity in similarities[:self.top_k]:
+        for section, similarity in scored:
             if similarity > self.similarity_threshold:
                 results.append({
-                    'section': sections[idx],
+                    'section': section,
                     'similarity': similarity,
                     'rank': len(results) + 1
                 })
         
         return results
     
-    def simple_query_embedding(self, query):
-        """Simple query embedding (placeholder)"""
-        # In production, would use the same embedding model as sections
-        # For now, return a random vector
-        return np.random.rand(384).tolist()
-    
-    def cosine_similarity(self, vec1, vec2):
-        """Calculate cosine similarity between two vectors"""
-        vec1 = np.array(vec1)
-        vec2 = np.array(vec2)
-        
-        dot_product = np.dot(vec1, vec2)
-        norm1 = np.linalg.norm(vec1)
-        norm2 = np.linalg.norm(vec2)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0
-        
-        return dot_product / (norm1 * norm2)
-    
+    def lexical_retrieval(self, engine, project_id, query, query_embedding, filters=None):
+        """Retrieve BM25 candidates from the project's inverted index"""
+        hits = sync_project_index(engine, project_id).search(query, self.candidate_k)
+        rows = fetch_sections_by_ids(
+            engine, project_id, [section_id for section_id, _ in hits], query_embedding, filters=filters
+        )
+        rows_by_id = {str(row['id']): row for row in rows}
+
+        results = []
+        for section_id, bm25_score in hits:
+            row = rows_by_id.get(section_id)
+            # Sections filtered out or deleted since indexing are skipped
+            if row is None:
+                continue
+            results.append({
+                'section': {
+                    'id': row['id'],
+                    'text': row['text'],
+                    'document_id': row['document_id']
+                },
+                'similarity': float(row['similarity']),
+                'bm25': bm25_score,
+                'rank': len(results) + 1
+            })
+
+        return results
+
+    def ann_retrieval(self, engine, project_id, query_embedding, filters=None, ef_search=None):
+        """Retrieve the top k sections from Postgres using the HNSW indexes on sections and their chunks.
+
+        Returns None when the index yields fewer than `candidate_k` sections: the project or
+        filter may be too selective for the graph scan, so the caller scores exactly instead.
+        """
+        rows = search_similar_sections(
+            engine, project_id, query_embedding, self.candidate_k, ef_search=ef_search, filters=filters
+        )
+        if len(rows) < self.candidate_k:
+            return None
+        chunk_rows = search_similar_chunks(
+            engine, project_id, query_embedding, self.candidate_k, ef_search=ef_search, filters=filters
+        )
+
+        # Keep each section's best match; a chunk hit also pins down the passage
+        best = {}
+        for row in rows:
+            best[str(row['id'])] = (float(row['similarity']), row, None)
+        for row in chunk_rows:
+            section_id = str(row['id'])
+            if section_id not in best or row['similarity'] > best[section_id][0]:
+                best[section_id] = (float(row['similarity']), row, row['text'][row['start_char']:row['end_char']])
+
+        results = []
+        for similarity, row, passage in sorted(best.values(), key=lambda match: match[0], reverse=True):
+            if similarity > self.similarity_threshold:
+                results.append({
+                    'section': {
+                        'id': row['id'],
+                        'text': row['text'],
+                        'document_id': row['document_id']
+                    },
+                    'passage': passage,
+                    'similarity': similarity,
+                    'rank': len(results) + 1
+                })
+
+        return results
+
     def generate_answer(self, query, retrieved_sections):
         """Generate answer from retrieved sections"""
         if not retrieved_sections:
@@ -74,7 +257,7 @@ class RAGWorker:
         
         # Simple answer generation (in production would use LLM)
         # Combine top sections and create a summary
-        combined_text = ' '.join([section['section']['text'][:500] for section in retrieved_sections[:3]])
+        combined_text = ' '.join([_passage(section)[:500] for section in retrieved_sections[:3]])
         
         # Create a simple answer
         answer = f"Based on the literature, {combined_text[:200]}..."
@@ -90,7 +273,7 @@ class RAGWorker:
                 'document_id': section['section']['document_id'],
                 'section_id': section['section']['id'],
                 'similarity': section['similarity'],
-                'text_snippet': section['section']['text'][:200] + '...'
+                'text_snippet': _passage(section)[:200] + '...'
             })
         
         return {
@@ -100,11 +283,31 @@ class RAGWorker:
         }
 
 
+def parse_ef_search(value):
+    """efSearch of a request as an int in [1, ANN_MAX_EF_SEARCH], or None (the default) when it is not a number"""
+    try:
+        ef_search = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return min(max(ef_search, 1), ANN_MAX_EF_SEARCH)
+
+
+def _passage(result):
+    """The matched passage of a retrieved section, or the section itself"""
+    return result.get('passage') or result['section']['text']
+
+
 async def main():
     nc = NATS()
     await nc.connect(os.getenv("NATS_URL", "nats://localhost:4222"))
     engine = create_db_engine()
     worker = RAGWorker()
+    scorer = DenseScorer(engine)
+    runtime = WorkerRuntime("rag", processes=0)
+    exact_scorer = ExactScoringBatcher(scorer, runtime, worker.candidate_k)
+    # Load the shared encoder before subscribing so the first question is not cold
+    encoder = get_query_encoder()
+    encoder.warmup()
 
     async def handle(msg):
         data = msg.data.decode()
@@ -113,47 +316,38 @@ async def main():
             query = payload["query"]
             project_id = payload.get("projectId")
             filters = payload.get("filters", {})
+            ef_search = parse_ef_search(payload.get("efSearch"))
         except Exception:
             return
 
         try:
-            # Fetch sections with embeddings for the project
-            sections_data = fetch_project_sections_with_embeddings(engine, project_id)
-            
-            if not sections_data:
-                await nc.publish("qa.response", json.dumps({
-                    "query": query,
-                    "answer": "No relevant documents found in this project.",
-                    "confidence": 0.0,
-                    "sources": []
-                }))
-                return
-            
-            # Apply filters if specified
-            if filters:
-                sections_data = apply_filters(sections_data, filters)
-            
-            # Extract embeddings and section info
-            embeddings = []
-            sections = []
-            
-            for section in sections_data:
-                if section['embedding']:
-                    embeddings.append(section['embedding'])
-                    sections.append({
-                        'id': section['id'],
-                        'text': section['text'],
-                        'document_id': section['document_id']
-                    })
-            
-            # Perform retrieval
-            retrieved_sections = worker.hybrid_retrieval(query, sections, embeddings)
+            # Nearest-neighbour search runs in Postgres with filters applied in SQL
+            query_embedding = await encoder.encode(query)
+            try:
+                dense_results = await runtime.run_io(
+                    worker.ann_retrieval, engine, project_id, query_embedding, filters=filters, ef_search=ef_search
+                )
+            except Exception as e:
+                print(f"ANN retrieval unavailable, falling back to exact scoring: {e}")
+                dense_results = None
+            if dense_results is None:
+                # Small or heavily filtered projects are scored exactly within the project,
+                # batched with concurrent questions about the same project
+                scored = await exact_scorer.score(project_id, query_embedding, filters=filters)
+                dense_results = worker.exact_retrieval(scored)
             
+            # BM25 over the on-disk inverted index catches exact terms dense retrieval misses
+            lexical_results = await runtime.run_io(
+                worker.lexical_retrieval, engine, project_id, query, query_embedding, filters=filters
+            )
+
+            retrieved_sections = worker.hybrid_retrieval(dense_results, lexical_results)
+
             # Generate answer
             result = worker.generate_answer(query, retrieved_sections)
             
             # Store QA session
-            qa_session_id = store_qa_session(engine, project_id, query, result)
+            qa_session_id = await runtime.run_io(store_qa_session, engine, project_id, query, result)
             
             # Publish response
             await nc.publish("qa.response", json.dumps({
@@ -173,46 +367,19 @@ async def main():
                 "sources": []
             }))
 
-    await nc.subscribe("qa.ask", cb=handle)
+    async def handle_embeddings_updated(msg):
+        try:
+            project_id = json.loads(msg.data.decode())["projectId"]
+        except Exception:
+            return
+        scorer.invalidate(project_id)
+
+    await runtime.subscribe(nc, "qa.ask", handle)
+    await nc.subscribe("embed.updated", cb=handle_embeddings_updated)
     while True:
         await asyncio.sleep(5)
 
 
-def fetch_project_sections_with_embeddings(engine, project_id):
-    """Fetch sections with embeddings for RAG"""
-    sql = """
-    SELECT s.id, s.text, s.embedding, d.id as document_id, d.title
-    FROM sections s
-    JOIN documents d ON d.id = s."documentId"
-    WHERE d."projectId" = :project_id AND s.embedding IS NOT NULL
-    ORDER BY d."createdAt" DESC
-    LIMIT 1000
-    """
-    with engine.connect() as conn:
-        rows = conn.execute(sql, {"project_id": project_id}).mappings().all()
-    return rows
-
-
-def apply_filters(sections_data, filters):
-    """Apply filters to sections"""
-    filtered_sections = []
-    
-    for section in sections_data:
-        # Apply year filter
-        if filters.get('year'):
-            # Would need to join with document metadata for year filtering
-            pass
-        
-        # Apply venue filter
-        if filters.get('venue'):
-            # Would need to join with document metadata for venue filtering
-            pass
-        
-        filtered_sections.append(section)
-    
-    return filtered_sections
-
-
 def store_qa_session(engine, project_id, query, result):
     """Store QA session in database"""
     sql = """
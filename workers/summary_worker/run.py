@@ -3,6 +3,7 @@ import asyncio
 import json
 from nats.aio.client import Client as NATS
 from workers.common.db import create_db_engine, fetch_theme_sections_for_summary, insert_theme_summary
+from workers.common.runtime import WorkerRuntime
 
 
 def generate_structured_summary(sections_data):
@@ -29,6 +30,7 @@ async def main():
     nc = NATS()
     await nc.connect(os.getenv("NATS_URL", "nats://localhost:4222"))
     engine = create_db_engine()
+    runtime = WorkerRuntime("summary", processes=0)
 
     async def handle(msg):
         data = msg.data.decode()
@@ -38,14 +40,14 @@ async def main():
         except Exception:
             return
 
-        sections_data = fetch_theme_sections_for_summary(engine, theme_id)
+        sections_data = await runtime.run_io(fetch_theme_sections_for_summary, engine, theme_id)
         if not sections_data:
             return
             
         summary = generate_structured_summary(sections_data)
-        insert_theme_summary(engine, theme_id, summary)
+        await runtime.run_io(insert_theme_summary, engine, theme_id, summary)
 
-    await nc.subscribe("summary.make", cb=handle)
+    await runtime.subscribe(nc, "summary.make", handle)
     while True:
         await asyncio.sleep(5)
 
@@ -0,0 +1,76 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+
+class FakeNATS:
+    """Records subscriptions and publishes in place of a NATS connection"""
+
+    def __init__(self):
+        self.handlers = {}
+        self.published = []
+
+    async def connect(self, *args, **kwargs):
+        pass
+
+    async def subscribe(self, subject, cb):
+        self.handlers[subject] = cb
+
+    async def publish(self, subject, data):
+        self.published.append((subject, json.loads(data)))
+
+
+@pytest.fixture
+def run_worker(monkeypatch):
+    """Start a worker module's main() on a FakeNATS, deliver messages to it and wait for the handlers.
+
+    With `together`, every message is delivered before waiting, so their handlers overlap.
+    Returns the FakeNATS. Runtimes the worker creates are shut down afterwards.
+    """
+    runtimes = []
+
+    def run(module, *messages, together=False):
+        nc = FakeNATS()
+        monkeypatch.setattr(module, "NATS", lambda: nc)
+        runtime_class = module.WorkerRuntime
+
+        def make_runtime(*args, **kwargs):
+            runtime = runtime_class(*args, **kwargs)
+            runtimes.append(runtime)
+            return runtime
+
+        monkeypatch.setattr(module, "WorkerRuntime", make_runtime)
+
+        async def settle(main):
+            # Wait for the handler tasks the subscriptions spawned
+            while True:
+                pending = asyncio.all_tasks() - {asyncio.current_task(), main}
+                if not pending:
+                    return
+                await asyncio.wait(pending)
+
+        async def drive():
+            main = asyncio.ensure_future(module.main())
+            while not all(subject in nc.handlers for subject, _ in messages) and not main.done():
+                await asyncio.sleep(0.01)
+            for subject, payload in messages:
+                await nc.handlers[subject](SimpleNamespace(data=json.dumps(payload).encode()))
+                if not together:
+                    await settle(main)
+            await settle(main)
+            main.cancel()
+            try:
+                await main
+            except asyncio.CancelledError:
+                pass
+
+        try:
+            asyncio.run(drive())
+        finally:
+            for runtime in runtimes:
+                runtime.shutdown()
+        return nc
+
+    return run
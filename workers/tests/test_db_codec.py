@@ -0,0 +1,94 @@
+import struct
+import uuid
+
+import numpy as np
+import pytest
+
+from workers.common.db import (
+    PgVector,
+    _adapt_vector,
+    decode_vectors_into,
+    encode_copy_binary,
+    encode_vectors_copy_binary,
+)
+
+FORMATS = {"int2": "!h", "int4": "!i", "float4": "!f", "float8": "!d"}
+
+
+def parse_copy_binary(payload, kinds=("uuid", "vector")):
+    """Rows of a COPY (FORMAT binary) payload with the given column kinds, read field by field"""
+    assert payload[:11] == b"PGCOPY\n\xff\r\n\x00"
+    flags, extension = struct.unpack_from("!ii", payload, 11)
+    assert (flags, extension) == (0, 0)
+    offset, rows = 19, []
+    while True:
+        (nfields,) = struct.unpack_from("!h", payload, offset)
+        offset += 2
+        if nfields == -1:
+            break
+        assert nfields == len(kinds)
+        row = []
+        for kind in kinds:
+            (length,) = struct.unpack_from("!i", payload, offset)
+            field = payload[offset + 4:offset + 4 + length]
+            offset += 4 + length
+            if kind == "uuid":
+                row.append(uuid.UUID(bytes=field))
+            elif kind == "vector":
+                dim, unused = struct.unpack_from("!hh", field)
+                assert (length, unused) == (4 + 4 * dim, 0)
+                row.append(struct.unpack_from(f"!{dim}f", field, 4))
+            else:
+                row.append(struct.unpack(FORMATS[kind], field)[0])
+        rows.append(tuple(row))
+    assert offset == len(payload)
+    return rows
+
+
+def test_copy_binary_matches_wire_format():
+    ids = [uuid.uuid4(), uuid.UUID("12345678-0000-0000-0000-000000000000"), uuid.uuid4()]
+    vectors = np.random.default_rng(0).standard_normal((3, 5)).astype(np.float32)
+
+    rows = parse_copy_binary(encode_vectors_copy_binary([str(i) for i in ids], vectors))
+
+    assert [section_id for section_id, _ in rows] == ids
+    np.testing.assert_array_equal(np.array([values for _, values in rows], dtype=np.float32), vectors)
+
+
+def test_copy_binary_empty():
+    assert parse_copy_binary(encode_vectors_copy_binary([], np.empty((0, 4), dtype=np.float32))) == []
+
+
+def test_copy_binary_mixed_columns():
+    ids = [uuid.uuid4(), uuid.uuid4()]
+    vectors = np.array([[1.5, -2.0], [0.25, 3.0]], dtype=np.float32)
+    kinds = ("uuid", "int2", "int4", "float4", "float8", "vector")
+
+    payload = encode_copy_binary([
+        ("uuid", [str(i) for i in ids]), ("int2", [0, 7]), ("int4", [-5, 70000]),
+        ("float4", [0.5, -4.0]), ("float8", [0.1, 2.5]), ("vector", vectors),
+    ])
+
+    assert parse_copy_binary(payload, kinds) == [
+        (ids[0], 0, -5, 0.5, 0.1, (1.5, -2.0)),
+        (ids[1], 7, 70000, -4.0, 2.5, (0.25, 3.0)),
+    ]
+
+
+def test_decode_vectors_into():
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+    # vector_send: int16 dim, int16 unused, big-endian float4 values
+    buffers = [struct.pack("!hh", 4, 0) + row.astype(">f4").tobytes() for row in vectors]
+
+    out = decode_vectors_into(buffers, np.empty((3, 4), dtype=np.float32))
+
+    np.testing.assert_array_equal(out, vectors)
+
+
+def test_pg_vector_adapter():
+    assert _adapt_vector(PgVector([1, 2.5, -0.125])).getquoted() == b"'[1,2.5,-0.125]'::vector"
+
+
+def test_pg_vector_rejects_matrices():
+    with pytest.raises(ValueError):
+        PgVector(np.zeros((2, 3)))
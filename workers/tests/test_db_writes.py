@@ -0,0 +1,136 @@
+import uuid
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from workers.common.db import (
+    copy_cached_section_embeddings,
+    ingest_document_sections,
+    insert_section_chunks,
+    update_theme_centroids,
+)
+from workers.tests.test_db_codec import parse_copy_binary
+
+
+class FakeCursor:
+    def __init__(self, log):
+        self.log = log
+
+    def copy_expert(self, sql, file):
+        self.log.append(("copy", sql, file.read()))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Records statements and COPY payloads instead of sending them"""
+
+    def __init__(self, log, results):
+        self.log = log
+        self.results = results
+        self.connection = self
+
+    def cursor(self):
+        return FakeCursor(self.log)
+
+    def execute(self, sql, params=None):
+        self.log.append(("execute", " ".join(str(sql).split()), params))
+        return self.results.pop(0) if self.results else None
+
+
+class FakeEngine:
+    def __init__(self, results=()):
+        self.log = []
+        self.results = list(results)
+
+    @contextmanager
+    def begin(self):
+        yield FakeConnection(self.log, self.results)
+
+
+@pytest.fixture
+def engine():
+    return FakeEngine()
+
+
+def test_update_theme_centroids_copies_then_updates_once(engine):
+    ids = [uuid.uuid4(), uuid.uuid4(), uuid.uuid4()]
+    centroids = np.random.default_rng(0).standard_normal((3, 4)).astype(np.float32)
+    updates = [
+        {'id': str(theme_id), 'centroid': centroid, 'section_count': 10 + i,
+         'mean_sq_distance': 0.5 * i, 'max_distance': 1.0 + i}
+        for i, (theme_id, centroid) in enumerate(zip(ids, centroids, strict=True))
+    ]
+
+    update_theme_centroids(engine, updates)
+
+    kinds = [kind for kind, *_ in engine.log]
+    assert kinds == ["execute", "copy", "execute"]
+    _, copy_sql, payload = engine.log[1]
+    assert copy_sql.startswith("COPY tmp_theme_centroids")
+    rows = parse_copy_binary(payload, ("uuid", "vector", "int4", "float4", "float4"))
+    assert [row[0] for row in rows] == ids
+    np.testing.assert_array_equal(np.array([row[1] for row in rows], dtype=np.float32), centroids)
+    assert [row[2:] for row in rows] == [(10, 0.0, 1.0), (11, 0.5, 2.0), (12, 1.0, 3.0)]
+    assert engine.log[2][1].startswith("UPDATE themes t SET centroid = v.centroid")
+
+
+def test_update_theme_centroids_skips_empty_updates(engine):
+    update_theme_centroids(engine, [])
+
+    assert engine.log == []
+
+
+def test_ingest_document_sections_records_the_content_hash():
+    engine = FakeEngine(results=[None, SimpleNamespace(scalar=lambda: "p1")])
+    sections = [{'label': 'abstract', 'text': 'graph text', 'page': 1}]
+
+    section_ids, project_id = ingest_document_sections(engine, "d1", sections, content_hash="abc")
+
+    assert (len(section_ids), project_id) == (1, "p1")
+    _, status_sql, params = engine.log[1]
+    assert '"contentHash" = COALESCE(:content_hash, "contentHash")' in status_sql
+    assert params == {"status": "parsed", "content_hash": "abc", "doc_id": "d1"}
+
+
+def test_copy_cached_section_embeddings_joins_on_the_content_hash():
+    engine = FakeEngine(results=[None, SimpleNamespace(rowcount=2)])
+
+    assert copy_cached_section_embeddings(engine, "model", document_id="d2") == 2
+
+    # documents.hash is unset on duplicate uploads; the cache is keyed by "contentHash"
+    assert all('cc.hash = d."contentHash"' in sql for _, sql, _ in engine.log)
+
+
+def test_insert_section_chunks_copies_then_inserts_once(engine):
+    section_ids = [uuid.uuid4(), uuid.uuid4()]
+    embeddings = np.random.default_rng(1).standard_normal((3, 4)).astype(np.float32)
+    chunks = [
+        {'section_id': str(section_ids[0]), 'ordinal': 0, 'start_char': 0, 'end_char': 40, 'embedding': embeddings[0]},
+        {'section_id': str(section_ids[0]), 'ordinal': 1, 'start_char': 30, 'end_char': 75, 'embedding': embeddings[1]},
+        {'section_id': str(section_ids[1]), 'ordinal': 0, 'start_char': 0, 'end_char': 12, 'embedding': embeddings[2]},
+    ]
+
+    insert_section_chunks(engine, chunks)
+
+    assert [kind for kind, *_ in engine.log] == ["execute", "execute", "copy", "execute"]
+    _, delete_sql, params = engine.log[0]
+    assert delete_sql.startswith("DELETE FROM section_chunks")
+    assert sorted(params["ids"]) == sorted(map(str, section_ids))
+    _, copy_sql, payload = engine.log[2]
+    assert copy_sql.startswith("COPY tmp_section_chunks")
+    rows = parse_copy_binary(payload, ("uuid", "int2", "int4", "int4", "vector"))
+    assert [(row[0], *row[1:4]) for row in rows] == [
+        (section_ids[0], 0, 0, 40), (section_ids[0], 1, 30, 75), (section_ids[1], 0, 0, 12)
+    ]
+    np.testing.assert_array_equal(np.array([row[4] for row in rows], dtype=np.float32), embeddings)
+    assert engine.log[3][1].startswith("INSERT INTO section_chunks")
+
+
+def test_insert_section_chunks_skips_empty_chunks(engine):
+    insert_section_chunks(engine, [])
+
+    assert engine.log == []
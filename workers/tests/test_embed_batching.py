@@ -0,0 +1,139 @@
+import re
+
+import numpy as np
+import pytest
+
+from workers.common.vector_cache import open_embedding_cache
+from workers.embed_worker.run import EmbeddingWorker
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer speaking the slice of the Hugging Face call API the worker uses"""
+
+    def __call__(self, texts, truncation=False, max_length=None, add_special_tokens=True,
+                 return_length=False, return_offsets_mapping=False, **_):
+        offsets = [[m.span() for m in re.finditer(r'\S+', text)] for text in texts]
+        encoded = {}
+        if return_length:
+            lengths = [len(spans) + 2 * add_special_tokens for spans in offsets]
+            encoded['length'] = [min(n, max_length) if truncation else n for n in lengths]
+        if return_offsets_mapping:
+            encoded['offset_mapping'] = offsets
+        return encoded
+
+
+class FakeModel:
+    """Encodes a text as [number of words, number of characters, 1, 0]"""
+
+    tokenizer = FakeTokenizer()
+    max_seq_length = 10
+
+    def __init__(self):
+        self.calls = []
+
+    def get_sentence_embedding_dimension(self):
+        return 4
+
+    def encode(self, texts, batch_size=None, **_):
+        self.calls.append(list(texts))
+        return np.array([[len(t.split()), len(t), 1, 0] for t in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def worker():
+    worker = EmbeddingWorker(model=FakeModel())
+    worker.cache = None
+    worker.token_budget = 64
+    worker.max_batch_size = 8
+    worker.chunk_overlap = 2
+    return worker
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_plan_batches_respects_budget(worker, seed):
+    lengths = np.random.default_rng(seed).integers(0, 40, size=100)
+
+    batches = worker.plan_batches(lengths)
+
+    order = np.concatenate(batches)
+    assert sorted(order.tolist()) == list(range(len(lengths)))
+    # Shortest first, so every batch is padded to its last length
+    assert np.all(np.diff(lengths[order]) >= 0)
+    for batch in batches:
+        assert len(batch) <= worker.max_batch_size
+        assert len(batch) == 1 or len(batch) * max(1, lengths[batch[-1]]) <= worker.token_budget
+
+
+def test_plan_batches_empty(worker):
+    assert worker.plan_batches(np.empty(0, dtype=np.int64)) == []
+
+
+def test_chunk_spans_cover_long_texts_with_overlap(worker):
+    words = [f"w{i}" for i in range(30)]
+    text = " ".join(words)
+
+    short, long = worker.chunk_spans(["a short text", text])
+
+    assert short == [(0, len("a short text"))]
+    window = worker.model.max_seq_length - 2
+    chunks = [text[start:end].split() for start, end in long]
+    assert chunks[0][0] == "w0" and chunks[-1][-1] == "w29"
+    assert all(len(chunk) <= window for chunk in chunks)
+    for previous, chunk in zip(chunks, chunks[1:], strict=False):
+        assert previous[-worker.chunk_overlap:] == chunk[:worker.chunk_overlap]
+
+
+def test_chunk_spans_clamp_overlap_to_the_window(worker):
+    worker.chunk_overlap = 32
+    text = " ".join(f"w{i}" for i in range(25))
+
+    [spans] = worker.chunk_spans([text])
+
+    chunks = [text[start:end].split() for start, end in spans]
+    assert chunks[0][0] == "w0" and chunks[-1][-1] == "w24"
+    assert len(chunks) == 25 - (worker.model.max_seq_length - 2) + 1
+
+
+def test_encode_texts_keeps_input_order(worker):
+    texts = ["one two three four five", "one", "one two", "one two three"]
+
+    embeddings = worker.encode_texts(texts)
+
+    np.testing.assert_array_equal(embeddings[:, 0], [5, 1, 2, 3])
+    # Length-bucketed: each model call sees texts sorted by token count
+    assert [len(t.split()) for call in worker.model.calls for t in call] == [1, 2, 3, 5]
+
+
+def test_process_batch_averages_chunks(worker):
+    sections = [
+        {'id': 'a', 'text': 'tiny section'},
+        {'id': 'b', 'text': ' '.join(['word'] * 20)},
+    ]
+
+    section_ids, embeddings, chunks = worker.process_batch(sections)
+
+    assert section_ids == ['a', 'b']
+    assert embeddings.shape == (2, 4)
+    assert embeddings[0, 0] == 2
+    assert {chunk['section_id'] for chunk in chunks} == {'b'}
+    assert [chunk['ordinal'] for chunk in chunks] == list(range(len(chunks)))
+    np.testing.assert_allclose(embeddings[1], np.mean([chunk['embedding'] for chunk in chunks], axis=0))
+
+
+def test_process_batch_empty_uses_model_dimension(worker):
+    section_ids, embeddings, chunks = worker.process_batch([])
+
+    assert (section_ids, chunks) == ([], [])
+    assert embeddings.shape == (0, 4)
+
+
+def test_generate_embeddings_serves_repeats_from_cache(worker, tmp_path):
+    worker.cache = open_embedding_cache(str(tmp_path / "cache.sqlite3"), dim=4)
+
+    first = worker.generate_embeddings(["alpha beta", "gamma", "alpha  beta "])
+    second = worker.generate_embeddings(["gamma", "delta"])
+
+    # Whitespace-equal texts share a key, so each distinct text is encoded once
+    assert [t for call in worker.model.calls for t in call] == ["gamma", "alpha beta", "delta"]
+    np.testing.assert_array_equal(first[0], first[2])
+    np.testing.assert_array_equal(second[0], first[1])
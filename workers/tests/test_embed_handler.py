@@ -0,0 +1,178 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from workers.embed_worker import run as embed_run
+from workers.tests.test_embed_batching import FakeModel
+
+
+@pytest.fixture
+def store(monkeypatch):
+    sections = [
+        {'id': str(uuid.uuid4()), 'text': text}
+        for text in ["short text", " ".join(f"w{i}" for i in range(25)), "another short one", "four", "five six"]
+    ]
+    store = {'vectors': {}, 'chunks': [], 'cached_for': [], 'written': []}
+
+    def upsert(engine, section_ids, vectors):
+        assert len(section_ids) == len(vectors)
+        store['written'].extend(section_ids)
+        store['vectors'].update(zip(section_ids, vectors, strict=True))
+
+    def pending(rows):
+        return [section for section in rows if section['id'] not in store['vectors']]
+
+    def iter_sections(engine, project_id):
+        rows = pending(sections)
+        for i in range(0, len(rows), 2):
+            yield rows[i:i + 2]
+
+    monkeypatch.setattr(embed_run, "create_db_engine", lambda: None)
+    monkeypatch.setattr(embed_run, "load_embedding_model", FakeModel)
+    monkeypatch.setattr(embed_run, "copy_cached_section_embeddings", lambda engine, model, **scope: 0)
+    monkeypatch.setattr(embed_run, "iter_sections_without_embeddings", iter_sections)
+    monkeypatch.setattr(embed_run, "fetch_sections_for_document", lambda engine, document_id: pending(sections[:1]))
+    monkeypatch.setattr(embed_run, "bulk_upsert_section_embeddings", upsert)
+    monkeypatch.setattr(embed_run, "insert_section_chunks", lambda engine, chunks: store['chunks'].extend(chunks))
+    monkeypatch.setattr(embed_run, "cache_section_embeddings", lambda engine, model, **scope: store['cached_for'].append(scope))
+    monkeypatch.setattr(embed_run, "fetch_document_project_id", lambda engine, document_id: "p1")
+    monkeypatch.setattr(embed_run, "EMBEDDING_WRITE_BATCH_SIZE", 3)
+    monkeypatch.setattr(embed_run, "EMBED_POOL_PROCESSES", 0)
+    return sections, store
+
+
+def test_project_upsert_embeds_every_section(run_worker, store):
+    sections, written = store
+
+    nc = run_worker(embed_run, ("embed.upsert", {"projectId": "p1"}))
+
+    assert set(written['vectors']) == {section['id'] for section in sections}
+    assert written['vectors'][sections[0]['id']].tolist() == [2, 10, 1, 0]
+    # Only the long section is split into chunks
+    assert {chunk['section_id'] for chunk in written['chunks']} == {sections[1]['id']}
+    np.testing.assert_allclose(
+        written['vectors'][sections[1]['id']], np.mean([c['embedding'] for c in written['chunks']], axis=0)
+    )
+    assert written['cached_for'] == [{'document_id': None, 'project_id': 'p1'}]
+    assert nc.published == [("embed.updated", {"projectId": "p1"}), ("cluster.run", {"projectId": "p1"})]
+
+
+def test_document_upsert_does_not_trigger_clustering(run_worker, store):
+    sections, written = store
+
+    nc = run_worker(embed_run, ("embed.upsert", {"documentId": "d1"}))
+
+    assert list(written['vectors']) == [sections[0]['id']]
+    assert nc.published == [("embed.updated", {"projectId": "p1"})]
+
+
+def test_concurrent_upserts_of_a_project_embed_each_section_once(run_worker, store):
+    sections, written = store
+
+    nc = run_worker(
+        embed_run, ("embed.upsert", {"projectId": "p1"}), ("embed.upsert", {"documentId": "d1"}),
+        ("embed.upsert", {"projectId": "p1"}), together=True,
+    )
+
+    assert sorted(written['written']) == sorted(section['id'] for section in sections)
+    assert [subject for subject, _ in nc.published].count("cluster.run") == 2
+
+
+class FakeContentStore:
+    """In-memory documents, sections and content caches, joined on documents."contentHash" like the SQL"""
+
+    def __init__(self, documents):
+        self.documents = {doc_id: {'projectId': project_id, 'contentHash': None}
+                          for doc_id, project_id in documents.items()}
+        self.content = {}
+        self.embedding_cache = {}
+        self.sections = []
+
+    def fetch_cached_sections(self, engine, content_hash):
+        return self.content.get(content_hash)
+
+    def store_cached_sections(self, engine, content_hash, sections):
+        self.content.setdefault(content_hash, sections)
+
+    def ingest_document_sections(self, engine, document_id, sections, status, token_ids, content_hash=None):
+        document = self.documents[document_id]
+        document['contentHash'] = content_hash or document['contentHash']
+        rows = [{'id': str(uuid.uuid4()), 'documentId': document_id, 'text': section['text'], 'embedding': None}
+                for section in sections]
+        self.sections.extend(rows)
+        return [row['id'] for row in rows], document['projectId']
+
+    def _cached_sections(self, document_id):
+        content_hash = self.documents[document_id]['contentHash']
+        ordinals = {section['text']: i for i, section in enumerate(self.content.get(content_hash) or [], 1)}
+        for row in self.sections:
+            if row['documentId'] == document_id and row['text'] in ordinals:
+                yield row, (content_hash, ordinals[row['text']])
+
+    def copy_cached_section_embeddings(self, engine, model, document_id=None, project_id=None):
+        copied = 0
+        for row, key in self._cached_sections(document_id):
+            if row['embedding'] is None and key in self.embedding_cache:
+                row['embedding'] = self.embedding_cache[key]
+                copied += 1
+        return copied
+
+    def cache_section_embeddings(self, engine, model, document_id=None, project_id=None):
+        for row, key in self._cached_sections(document_id):
+            if row['embedding'] is not None:
+                self.embedding_cache.setdefault(key, row['embedding'])
+
+    def fetch_sections_for_document(self, engine, document_id):
+        return [{'id': row['id'], 'text': row['text']} for row in self.sections
+                if row['documentId'] == document_id and row['embedding'] is None]
+
+    def bulk_upsert_section_embeddings(self, engine, section_ids, vectors):
+        embeddings = dict(zip(section_ids, vectors, strict=True))
+        for row in self.sections:
+            row['embedding'] = embeddings.get(row['id'], row['embedding'])
+
+
+def test_same_pdf_in_a_second_document_copies_its_embeddings(run_worker, monkeypatch, tmp_path):
+    from workers.common.lexical_index import LexicalIndex
+    from workers.pdf_worker import run as pdf_run
+    from workers.tests.test_pdf_extract import write_pdf
+    from workers.tests.test_pdf_handler import PAGES
+
+    db = FakeContentStore({'d1': 'p1', 'd2': 'p2'})
+    for module in (pdf_run, embed_run):
+        monkeypatch.setattr(module, "create_db_engine", lambda: None)
+        for name in dir(db):
+            if not name.startswith('_') and hasattr(module, name):
+                monkeypatch.setattr(module, name, getattr(db, name))
+    monkeypatch.setattr(pdf_run, "open_project_index", lambda pid: LexicalIndex(pid, root=str(tmp_path / "lexical")))
+    monkeypatch.setenv("WORKER_PROCESSES_PDF", "2")
+    models = []
+
+    def load_embedding_model():
+        models.append(FakeModel())
+        return models[-1]
+
+    monkeypatch.setattr(embed_run, "load_embedding_model", load_embedding_model)
+    monkeypatch.setattr(embed_run, "fetch_document_project_id", lambda engine, document_id: db.documents[document_id]['projectId'])
+    monkeypatch.setattr(embed_run, "insert_section_chunks", lambda engine, chunks: None)
+    monkeypatch.setattr(embed_run, "EMBED_POOL_PROCESSES", 0)
+    # The same file uploaded under another name
+    first = write_pdf(tmp_path / "paper.pdf", PAGES)
+    second = tmp_path / "copy.pdf"
+    second.write_bytes(open(first, "rb").read())
+
+    run_worker(pdf_run, ("pdf.parse", {"documentId": "d1", "filePath": first}),
+               ("pdf.parse", {"documentId": "d2", "filePath": str(second)}))
+    run_worker(embed_run, ("embed.upsert", {"documentId": "d1"}))
+    run_worker(embed_run, ("embed.upsert", {"documentId": "d2"}))
+
+    assert db.documents['d1']['contentHash'] == db.documents['d2']['contentHash'] is not None
+    first_rows, second_rows = ([row for row in db.sections if row['documentId'] == d] for d in ('d1', 'd2'))
+    assert [row['text'] for row in second_rows] == [row['text'] for row in first_rows]
+    for a, b in zip(first_rows, second_rows, strict=True):
+        np.testing.assert_array_equal(a['embedding'], b['embedding'])
+    # d2's vectors came from the cache: its upsert never reached the model
+    encoded = [text for model in models for call in model.calls for text in call]
+    assert sorted(encoded) == sorted(row['text'] for row in first_rows)
+    assert models[-1].calls == []
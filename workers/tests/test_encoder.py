@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from workers.common.encoder import EmbeddingTokenizer, QueryEncoder
+
+
+class FakeModel:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def encode(self, queries, normalize_embeddings=False, **_):
+        self.calls.append(list(queries))
+        if self.fail:
+            raise RuntimeError("model down")
+        return np.array([[len(q), 1.0] for q in queries])
+
+
+def test_concurrent_queries_share_one_batch():
+    model = FakeModel()
+    encoder = QueryEncoder(model=model, max_wait_ms=20)
+
+    async def run():
+        return await asyncio.gather(
+            encoder.encode("graph networks"), encoder.encode("graph   networks "), encoder.encode("proteins"),
+        )
+
+    first, duplicate, other = asyncio.run(run())
+
+    assert model.calls == [["graph networks", "proteins"]]
+    np.testing.assert_array_equal(first, duplicate)
+    assert first.dtype == np.float32 and other[0] == len("proteins")
+
+
+def test_recent_queries_come_from_cache():
+    model = FakeModel()
+    encoder = QueryEncoder(model=model, max_wait_ms=0, cache_size=1)
+
+    async def run():
+        await encoder.encode("a query")
+        await encoder.encode("a query")
+        await encoder.encode("another")
+        await encoder.encode("a query")
+
+    asyncio.run(run())
+
+    # The cache holds one entry, so the first query is encoded again after "another"
+    assert model.calls == [["a query"], ["another"], ["a query"]]
+
+
+def test_model_errors_reach_every_waiter():
+    encoder = QueryEncoder(model=FakeModel(fail=True), max_wait_ms=5)
+
+    async def run():
+        return await asyncio.gather(encoder.encode("one"), encoder.encode("two"), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_warmup_encodes_once():
+    model = FakeModel()
+    QueryEncoder(model=model).warmup()
+
+    assert model.calls == [["warmup"]]
+
+
+@pytest.mark.parametrize("batch_size", [1, 2])
+def test_batches_are_capped(batch_size):
+    model = FakeModel()
+    encoder = QueryEncoder(model=model, max_batch_size=batch_size, max_wait_ms=10)
+
+    async def run():
+        await asyncio.gather(*(encoder.encode(f"query {i}") for i in range(4)))
+
+    asyncio.run(run())
+
+    assert all(len(call) <= batch_size for call in model.calls)
+    assert sorted(q for call in model.calls for q in call) == [f"query {i}" for i in range(4)]
+
+
+@pytest.mark.parametrize("dense_features", [None, 16])
+def test_embedding_tokenizer_reads_dimensions_without_weights(tmp_path, dense_features):
+    from transformers import BertConfig, BertTokenizerFast
+
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "graph", "networks"]))
+    BertTokenizerFast(str(vocab)).save_pretrained(tmp_path)
+    BertConfig(hidden_size=48, num_attention_heads=4).save_pretrained(tmp_path)
+    (tmp_path / "sentence_bert_config.json").write_text(json.dumps({"max_seq_length": 128}))
+    modules = [{"idx": 0, "name": "0", "path": "", "type": "sentence_transformers.models.Transformer"}]
+    if dense_features:
+        modules.append({"idx": 1, "name": "1", "path": "2_Dense", "type": "sentence_transformers.models.Dense"})
+        (tmp_path / "2_Dense").mkdir()
+        (tmp_path / "2_Dense" / "config.json").write_text(json.dumps({"out_features": dense_features}))
+    (tmp_path / "modules.json").write_text(json.dumps(modules))
+
+    model = EmbeddingTokenizer(model_path=str(tmp_path))
+
+    assert model.max_seq_length == 128
+    assert model.get_sentence_embedding_dimension() == (dense_features or 48)
+    assert model.tokenizer(["graph networks"])["input_ids"] == [[2, 5, 6, 3]]
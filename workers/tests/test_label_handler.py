@@ -0,0 +1,91 @@
+import uuid
+
+import pytest
+
+from workers.common.tokens import pack_term_ids, section_term_ids
+from workers.label_worker import run as label_run
+
+THEMES = {
+    "t-graph": ["graph neural networks learn molecule graphs", "graph neural networks for molecule property prediction"],
+    "t-protein": ["protein folding dynamics simulation", "protein folding with molecular dynamics simulation"],
+}
+
+
+@pytest.fixture
+def project(monkeypatch):
+    """An in-memory project: one document per section, each assigned to its theme"""
+    sections = []
+    for theme_id, texts in THEMES.items():
+        for text in texts:
+            sections.append({'id': str(uuid.uuid4()), 'document_id': str(uuid.uuid4()), 'theme_id': theme_id, 'text': text})
+    sections.sort(key=lambda section: section['id'])
+    # The first section predates stored term ids
+    tokens = {s['id']: None if i == 0 else pack_term_ids(section_term_ids([s['text']])[0]) for i, s in enumerate(sections)}
+    written = {'labels': [], 'backfilled': []}
+
+    def chunks(rows, size=2):
+        for i in range(0, len(rows), size):
+            yield rows[i:i + size]
+
+    def iter_tokens(engine, project_id):
+        rows = [
+            {'id': s['id'], 'document_id': s['document_id'], 'token_ids': tokens[s['id']],
+             'text': s['text'] if tokens[s['id']] is None else None}
+            for s in sections
+        ]
+        yield from chunks(rows)
+
+    def store_tokens(engine, section_ids, token_ids):
+        written['backfilled'].extend(section_ids)
+        tokens.update(zip(section_ids, token_ids, strict=True))
+
+    monkeypatch.setattr(label_run, "create_db_engine", lambda: None)
+    monkeypatch.setattr(label_run, "fetch_project_theme_assignments", lambda engine, project_id: [
+        {'theme_id': s['theme_id'], 'document_id': s['document_id']} for s in sections
+    ])
+    monkeypatch.setattr(label_run, "fetch_theme_project_id", lambda engine, theme_id: "p1")
+    monkeypatch.setattr(label_run, "iter_project_section_tokens", iter_tokens)
+    monkeypatch.setattr(label_run, "iter_project_sections_for_labeling", lambda engine, project_id: chunks(sections))
+    monkeypatch.setattr(label_run, "store_section_token_ids", store_tokens)
+    monkeypatch.setattr(label_run, "fetch_section_texts", lambda engine, ids: {
+        s['id']: s['text'] for s in sections if s['id'] in ids
+    })
+    monkeypatch.setattr(label_run, "update_theme_labels_and_provenance", lambda engine, updates: written['labels'].extend(updates))
+    monkeypatch.setattr(label_run, "LABEL_COUNT_CONCURRENCY", 1)
+    monkeypatch.setenv("WORKER_PROCESSES_LABEL", "1")
+    return sections, written
+
+
+def test_label_run_labels_every_theme(run_worker, project):
+    sections, written = project
+
+    run_worker(label_run, ("label.run", {"projectId": "p1"}))
+
+    labels = {theme_id: (label, provenance) for theme_id, label, provenance in written['labels']}
+    assert set(labels) == set(THEMES)
+    assert labels["t-graph"][0] == "Graph Neural Networks"
+    assert labels["t-protein"][0] == "Protein Folding"
+    for theme_id, (_, provenance) in labels.items():
+        assert provenance['method'] == 'c-tf-idf'
+        assert provenance['sections_analyzed'] == 2
+        assert provenance['top_ngrams'] and len(provenance['scores']) == len(provenance['top_ngrams'])
+        theme_text = ' '.join(THEMES[theme_id])
+        assert all(set(ngram.split()) <= set(theme_text.split()) for ngram, _ in provenance['top_ngrams'])
+    # Only the section without stored term ids is tokenized and written back
+    assert written['backfilled'] == [sections[0]['id']]
+
+
+def test_label_theme_relabels_one_theme(run_worker, project):
+    _, written = project
+
+    run_worker(label_run, ("label.theme", {"themeId": "t-protein"}))
+
+    assert [theme_id for theme_id, _, _ in written['labels']] == ["t-protein"]
+
+
+def test_label_run_with_theme_ids(run_worker, project):
+    _, written = project
+
+    run_worker(label_run, ("label.run", {"projectId": "p1", "themeIds": ["t-graph"]}))
+
+    assert [theme_id for theme_id, _, _ in written['labels']] == ["t-graph"]
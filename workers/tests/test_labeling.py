@@ -0,0 +1,115 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from workers.common.tokens import ngram_ids, section_term_ids, tokenize
+from workers.label_worker.run import LabelingWorker
+
+THEME_TEXTS = [
+    ["graph neural networks learn molecule graphs", "graph neural networks for molecule property prediction"],
+    ["protein folding dynamics simulation", "protein folding with molecular dynamics simulation"],
+    ["random forests for tabular data", "gradient boosted random forests on tabular benchmarks"],
+]
+
+
+def ngrams(text, n_range=range(2, 5)):
+    tokens = tokenize(text)
+    return [' '.join(tokens[i:i + n]) for n in n_range for i in range(len(tokens) - n + 1)]
+
+
+def label(worker, theme_texts):
+    """Run the worker's counting, scoring, recount and resolve steps the way the handler does"""
+    texts = [text for texts in theme_texts for text in texts]
+    themes = [[row] for row, texts in enumerate(theme_texts) for _ in texts]
+    terms = section_term_ids(texts)
+    keys, counts = worker.chunk_term_counts(terms, themes)
+    top_terms = worker.score_themes(keys, counts, len(theme_texts))
+    columns = np.unique(np.array([c for terms_ in top_terms for c, _, _ in terms_], dtype=np.uint64))
+    candidates = worker.chunk_candidate_counts(terms, themes, columns)
+    top_terms = worker.rescore_candidates(top_terms, candidates, worker.theme_totals(keys, counts, len(theme_texts)))
+    targets = np.unique(np.array([g for terms_ in top_terms for g, _, _ in terms_], dtype=np.uint64))
+    names = worker.resolve_ngrams(texts, targets, {})
+    return [[(names[gram], score, count) for gram, score, count in terms_] for terms_ in top_terms]
+
+
+def reference_ctfidf(theme_texts):
+    """c-TF-IDF of every n-gram string per theme, computed directly"""
+    theme_counts = [Counter(g for text in texts for g in ngrams(text)) for texts in theme_texts]
+    totals = Counter()
+    for counts in theme_counts:
+        totals.update(counts)
+    average = sum(sum(c.values()) for c in theme_counts) / len(theme_counts)
+    return [
+        {g: n / sum(counts.values()) * math.log1p(average / totals[g]) for g, n in counts.items()}
+        for counts in theme_counts
+    ]
+
+
+def test_chunk_term_counts_matches_direct_count():
+    worker = LabelingWorker()
+    texts = ["deep graph neural networks", "graph neural networks again and deep graph"]
+    terms = section_term_ids(texts)
+
+    keys, counts = worker.chunk_term_counts(terms, [[0], [0, 1]])
+
+    expected = Counter()
+    for text, rows in ((texts[0], [0]), (texts[1], [0, 1])):
+        ids = np.concatenate([ngram_ids(t, n) for t in [section_term_ids([text])[0]] for n in range(2, 5)])
+        for row in rows:
+            for column in (ids % worker.hash_buckets).tolist():
+                expected[row * int(worker.hash_buckets) + column] += 1
+    assert dict(zip(keys.tolist(), counts.tolist(), strict=True)) == dict(expected)
+    assert np.all(np.diff(keys.astype(np.float64)) > 0)
+
+
+def test_sections_without_themes_are_skipped():
+    worker = LabelingWorker()
+    keys, counts = worker.chunk_term_counts(section_term_ids(["graph neural networks"]), [[]])
+
+    assert len(keys) == len(counts) == 0
+
+
+def test_labels_match_reference_ctfidf():
+    worker = LabelingWorker()
+    reference = reference_ctfidf(THEME_TEXTS)
+
+    for terms, expected in zip(label(worker, THEME_TEXTS), reference, strict=True):
+        assert terms
+        best = max(expected.values())
+        assert terms[0][1] == pytest.approx(best)
+        assert expected[terms[0][0]] == pytest.approx(best)
+        for name, score, _ in terms:
+            assert score == pytest.approx(expected[name])
+
+
+def test_colliding_columns_resolve_to_their_own_ngrams():
+    # With 7 columns nearly every n-gram shares one with n-grams of other themes
+    worker = LabelingWorker()
+    worker.hash_buckets = np.uint64(7)
+    reference = reference_ctfidf(THEME_TEXTS)
+
+    for row, terms in enumerate(label(worker, THEME_TEXTS)):
+        theme_ngrams = {g for text in THEME_TEXTS[row] for g in ngrams(text)}
+        assert terms
+        for name, score, _ in terms:
+            assert name in theme_ngrams
+            assert score == pytest.approx(reference[row][name])
+
+
+def test_merge_counts_sums_equal_keys():
+    worker = LabelingWorker()
+    keys, counts = worker.merge_counts(
+        np.array([5, 1, 5, 3], dtype=np.uint64), np.array([1, 2, 3, 4], dtype=np.int64)
+    )
+
+    assert keys.tolist() == [1, 3, 5]
+    assert counts.tolist() == [2, 4, 4]
+
+
+def test_generate_theme_label_prefers_phrases():
+    worker = LabelingWorker()
+
+    assert worker.generate_theme_label([], []) == "Unnamed Theme"
+    assert worker.generate_theme_label([("graph", 5), ("graph neural", 3)], []) == "Graph Neural"
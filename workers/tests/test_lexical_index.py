@@ -0,0 +1,152 @@
+import math
+import uuid
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from workers.common import lexical_index
+from workers.common.lexical_index import (
+    LexicalIndex,
+    section_fingerprint,
+    sync_project_index,
+)
+from workers.common.tokens import term_ids, tokenize
+
+DOCS = [
+    "graph neural networks for molecule property prediction",
+    "convolutional networks for image classification on imagenet",
+    "transformer language models and graph attention",
+    "protein folding prediction with attention networks",
+    "random forests for tabular prediction tasks",
+    "graph graph graph partitioning heuristics",
+]
+
+
+def reference_bm25(docs, query, k1=1.2, b=0.75):
+    """Textbook BM25 over tokenized docs, for checking the index"""
+    tokenized = [tokenize(doc) for doc in docs]
+    avg_length = max(1.0, sum(len(t) for t in tokenized) / len(tokenized))
+    scores = []
+    for tokens in tokenized:
+        tf, score = Counter(tokens), 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in t for t in tokenized)
+            if not tf[term]:
+                continue
+            idf = math.log1p((len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf[term] * (k1 + 1) / (tf[term] + k1 * (1 - b + b * len(tokens) / avg_length))
+        scores.append(score)
+    return scores
+
+
+@pytest.fixture
+def sections():
+    return [(str(uuid.uuid4()), doc) for doc in DOCS]
+
+
+def check_against_reference(index, sections, query):
+    hits = index.search(query, k=len(sections))
+    expected = reference_bm25([doc for _, doc in sections], query)
+    by_id = dict(hits)
+    for (section_id, _), score in zip(sections, expected, strict=True):
+        if score:
+            assert by_id[section_id] == pytest.approx(score, rel=1e-5)
+        else:
+            assert section_id not in by_id
+    assert [score for _, score in hits] == sorted(by_id.values(), reverse=True)
+
+
+@pytest.mark.parametrize("query", ["graph prediction", "attention networks", "imagenet", "unseen words"])
+def test_search_matches_reference_bm25(tmp_path, sections, query):
+    index = LexicalIndex("p", root=tmp_path)
+    index.add_sections(sections)
+
+    check_against_reference(index, sections, query)
+
+
+def test_segments_and_merge_score_alike(tmp_path, sections, monkeypatch):
+    monkeypatch.setattr(lexical_index, "LEXICAL_MAX_SEGMENTS", 3)
+    index = LexicalIndex("p", root=tmp_path)
+    for section in sections:
+        index.add_sections([section])
+        check_against_reference(index, sections[:sections.index(section) + 1], "graph prediction networks")
+
+    # Six single-section segments, merged whenever the count passed three
+    assert len(index._read_manifest()["segments"]) <= 3
+    assert len(list(tmp_path.joinpath("p").glob("*.ids.npy"))) == len(index._read_manifest()["segments"])
+
+
+def test_search_top_k(tmp_path, sections):
+    index = LexicalIndex("p", root=tmp_path)
+    index.add_sections(sections)
+
+    assert index.search("graph", k=1) == index.search("graph", k=10)[:1]
+    assert index.search("graph", k=1)[0][0] == sections[5][0]
+
+
+def test_rebuild_replaces_segments_and_sets_fingerprint(tmp_path, sections):
+    index = LexicalIndex("p", root=tmp_path)
+    index.add_sections(sections)
+    assert index.fingerprint() is None
+
+    kept = sections[:2]
+    index.rebuild((section_id, term_ids(tokenize(doc))) for section_id, doc in kept)
+
+    assert index.fingerprint() == section_fingerprint([uuid.UUID(i).bytes for i, _ in kept])
+    assert {section_id for section_id, _ in index.search("networks prediction graph", k=10)} <= {i for i, _ in kept}
+    assert len(list(tmp_path.joinpath("p").glob("*.terms.npy"))) == 1
+
+    # Appends keep the fingerprint up to date
+    index.add_sections(sections[2:3])
+    assert index.fingerprint() == section_fingerprint([uuid.UUID(i).bytes for i, _ in sections[:3]])
+
+
+def test_sync_rebuilds_from_postgres_when_fingerprint_drifts(tmp_path, sections, monkeypatch):
+    stored = {section_id: term_ids(tokenize(doc)) for section_id, doc in sections}
+    backfilled = []
+
+    def fingerprint(engine, project_id):
+        return section_fingerprint([uuid.UUID(i).bytes for i in stored])
+
+    def iter_terms(engine, project_id):
+        # The first section was ingested before term ids were stored
+        yield [
+            {"id": section_id, "token_ids": None if n == 0 else ids.astype("<u4").tobytes(), "text": sections[0][1]}
+            for n, (section_id, ids) in enumerate(stored.items())
+        ]
+
+    monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(lexical_index, "fetch_project_section_fingerprint", fingerprint)
+    monkeypatch.setattr(lexical_index, "iter_project_section_terms", iter_terms)
+    monkeypatch.setattr(lexical_index, "store_section_token_ids", lambda engine, ids, tokens: backfilled.extend(ids))
+    monkeypatch.setattr(lexical_index, "LEXICAL_SYNC_SECONDS", 0)
+    monkeypatch.setattr(lexical_index, "open_project_index", lambda project_id: LexicalIndex(project_id, tmp_path))
+
+    index = sync_project_index(None, "p")
+
+    assert backfilled == [sections[0][0]]
+    check_against_reference(index, sections, "graph prediction")
+
+    # A deleted section changes the fingerprint, so the next sync drops it
+    del stored[sections[5][0]]
+    index = sync_project_index(None, "p")
+    assert sections[5][0] not in dict(index.search("graph", k=10))
+
+
+def test_empty_index(tmp_path):
+    index = LexicalIndex("p", root=tmp_path)
+
+    assert index.search("anything", k=5) == []
+    index.rebuild([])
+    assert index.fingerprint() == [0, 0]
+    assert index.search("anything", k=5) == []
+
+
+def test_fingerprint_is_additive():
+    ids = [uuid.uuid4().bytes for _ in range(5)]
+
+    whole = section_fingerprint(ids)
+    parts = np.add(section_fingerprint(ids[:2]), section_fingerprint(ids[2:])).tolist()
+
+    assert whole == parts
@@ -0,0 +1,65 @@
+import pytest
+
+from workers.matrix_worker.run import ExtractedRows, parse_dataset_size, scan_text
+
+
+@pytest.mark.parametrize("text", [
+    "the maestro conducted",      # mae
+    "a sauce recipe",             # auc
+    "methodology matters",        # method
+    "we remodeled the kitchen",   # model
+    "a recollection of events",   # collection
+])
+def test_keywords_inside_words_do_not_match(text):
+    assert scan_text(text) == ([], [], [])
+
+
+def test_plural_method_and_dataset_nouns():
+    methods, _, datasets = scan_text("results for convolutional networks on the ImageNet datasets")
+
+    assert methods == ["convolutional networks"]
+    assert [d["name"] for d in datasets] == ["ImageNet datasets"]
+
+
+def test_metrics_before_and_after_keyword():
+    _, metrics, _ = scan_text("MAE was 0.31, an accuracy of 0.93 after 12 epochs, 95% recall and 0.9accuracy")
+
+    assert [(m["metric"], m["value"]) for m in metrics] == [
+        ("MAE", 0.31), ("accuracy", 0.93), ("epochs", 12.0), ("%", 95.0), ("accuracy", 0.9),
+    ]
+
+
+def test_dataset_size():
+    _, _, datasets = scan_text("trained on 50,000 training samples from the CIFAR benchmark")
+
+    assert {"name": "50,000", "size": "50,000", "type": "dataset"} in datasets
+    assert any(d["name"] == "CIFAR benchmark" for d in datasets)
+
+
+def test_methods_start_after_break_words():
+    assert scan_text("the system was implemented using deep reinforcement learning")[0] == [
+        "deep reinforcement learning"
+    ]
+
+
+@pytest.mark.parametrize("size, expected", [
+    ("50,000", 50000), ("10k", 10000), ("2M", 2000000), (None, None), ("9999M", None),
+])
+def test_parse_dataset_size(size, expected):
+    assert parse_dataset_size(size) == expected
+
+
+def test_extracted_rows_deduplicate_per_document():
+    rows = ExtractedRows()
+    rows.add("d1", ["deep learning"], [{"metric": "auc", "value": 0.9, "unit": "auc"}], [
+        {"name": "MNIST dataset", "size": None, "type": "dataset"},
+    ])
+    rows.add("d1", ["deep learning"], [{"metric": "auc", "value": 0.9, "unit": "auc"}], [
+        {"name": "MNIST dataset", "size": "60,000", "type": "dataset"},
+    ])
+    rows.add("d2", [], [], [])
+
+    assert rows.document_ids == ["d1", "d2"]
+    assert list(rows.methods) == [("d1", "deep learning")]
+    assert list(rows.metrics) == [("d1", "auc", 0.9, "auc")]
+    assert rows.datasets == {("d1", "MNIST dataset"): (60000, "dataset")}
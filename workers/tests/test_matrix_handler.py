@@ -0,0 +1,41 @@
+import uuid
+
+from workers.matrix_worker import run as matrix_run
+
+
+def test_matrix_extract_writes_whole_documents_per_run(run_worker, monkeypatch):
+    documents = [str(uuid.uuid4()) for _ in range(5)]
+    sections = sorted(
+        (
+            {'id': str(uuid.uuid4()), 'document_id': document_id, 'text': text}
+            for document_id in documents
+            for text in ("trained using deep learning on the MNIST dataset", "an accuracy of 0.9 after 10 epochs")
+        ),
+        key=lambda section: section['id'],
+    )
+    reads, writes = [], []
+
+    def iter_document_sections(engine, document_ids):
+        reads.append(list(document_ids))
+        rows = [section for section in sections if section['document_id'] in document_ids]
+        for i in range(0, len(rows), 3):
+            yield rows[i:i + 3]
+
+    monkeypatch.setattr(matrix_run, "create_db_engine", lambda: None)
+    monkeypatch.setattr(matrix_run, "fetch_parsed_document_ids", lambda engine, project_id: documents)
+    monkeypatch.setattr(matrix_run, "iter_document_sections", iter_document_sections)
+    monkeypatch.setattr(matrix_run, "write_extracted_rows", lambda engine, *rows: writes.append(rows))
+    monkeypatch.setattr(matrix_run, "MATRIX_WRITE_DOCUMENTS", 2)
+    monkeypatch.setattr(matrix_run, "MATRIX_EXTRACT_BATCH", 2)
+    monkeypatch.setenv("WORKER_PROCESSES_MATRIX", "2")
+
+    run_worker(matrix_run, ("matrix.extract", {"projectId": "p1"}))
+
+    assert reads == [documents[0:2], documents[2:4], documents[4:5]]
+    assert [sorted(document_ids) for document_ids, *_ in writes] == [sorted(ids) for ids in reads]
+    for document_ids, methods, metrics, datasets in writes:
+        for document_id in document_ids:
+            assert (document_id, "deep learning") in methods
+            assert (document_id, "accuracy", 0.9, "accuracy") in metrics
+            assert (document_id, "epochs", 10.0, "epochs") in metrics
+            assert (document_id, "MNIST dataset", None, "dataset") in datasets
@@ -0,0 +1,77 @@
+import asyncio
+
+import fitz
+import pytest
+
+from workers.common.runtime import WorkerRuntime
+from workers.pdf_worker import run as pdf_run
+from workers.pdf_worker.run import (
+    count_pages,
+    extract_sections,
+    iter_pdf_pages,
+    page_shards,
+)
+
+PAGES = [
+    "Abstract\nWe study graph networks.",
+    "Introduction\nGraphs are everywhere.\nFigure 1 shows one.",
+    "",
+    "Methods\nWe train on Table 2 data.",
+    "Results\nIt works.",
+    "References\nSmith 2020",
+]
+
+
+def write_pdf(path, pages):
+    with fitz.open() as doc:
+        for text in pages:
+            page = doc.new_page()
+            if text:
+                page.insert_text((72, 72), text)
+        doc.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    return write_pdf(tmp_path / "paper.pdf", PAGES)
+
+
+def test_page_shards():
+    assert page_shards(0, 4) == []
+    assert page_shards(10, 4) == [(0, 4), (4, 8), (8, 10)]
+
+
+def test_iter_pdf_pages_ocrs_only_pages_without_text(pdf_path, monkeypatch):
+    ocred = []
+    monkeypatch.setattr(pdf_run, "ocr_page", lambda page: ocred.append(page.number) or "scanned text")
+
+    pages = list(iter_pdf_pages(pdf_path))
+
+    assert count_pages(pdf_path) == len(PAGES)
+    assert ocred == [2]
+    assert [page['page'] for page in pages] == [1, 2, 3, 4, 5, 6]
+    assert pages[2] == {'page': 3, 'text': 'scanned text', 'method': 'ocr'}
+    assert pages[0]['text'] == PAGES[0]
+
+
+def test_iter_pdf_pages_range(pdf_path):
+    assert [page['page'] for page in iter_pdf_pages(pdf_path, 3, 5)] == [4, 5]
+
+
+@pytest.mark.parametrize("shard_size, in_flight", [(1, 1), (2, 2), (4, 8)])
+def test_extract_sections_in_page_order(tmp_path, monkeypatch, shard_size, in_flight):
+    # Pool processes cannot see a patched ocr_page, so this PDF has a text layer on every page
+    pdf_path = write_pdf(tmp_path / "paper.pdf", [text for text in PAGES if text])
+    monkeypatch.setattr(pdf_run, "PDF_PAGES_PER_SHARD", shard_size)
+    monkeypatch.setattr(pdf_run, "PDF_SHARDS_IN_FLIGHT", in_flight)
+    runtime = WorkerRuntime("pdf", processes=2)
+    try:
+        sections = asyncio.run(extract_sections(runtime, pdf_path))
+    finally:
+        runtime.shutdown()
+
+    assert [(s['label'], s['page']) for s in sections] == [
+        ('abstract', 2), ('introduction', 3), ('methods', 4), ('results', 5), ('references', 5),
+    ]
+    assert sections[1]['text'] == "Introduction\nGraphs are everywhere.\nFigure 1 shows one."
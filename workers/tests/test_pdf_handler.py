@@ -0,0 +1,80 @@
+import uuid
+
+from workers.common.files import calculate_md5
+from workers.common.lexical_index import LexicalIndex
+from workers.pdf_worker import run as pdf_run
+from workers.tests.test_pdf_extract import write_pdf
+
+PAGES = [
+    "Abstract\nWe study graph networks.",
+    "Introduction\nGraphs are everywhere.",
+    "Methods\nWe train graph networks on citations.",
+]
+
+
+def _patch_db(monkeypatch, tmp_path, cached=None):
+    calls = {"stored": [], "ingested": [], "status": []}
+    project_id = str(uuid.uuid4())
+    index = LexicalIndex(project_id, root=str(tmp_path / "lexical"))
+
+    def ingest_document_sections(engine, document_id, sections, status, token_ids, content_hash):
+        calls["ingested"].append((document_id, sections, status, token_ids, content_hash))
+        return [str(uuid.uuid4()) for _ in sections], project_id
+
+    monkeypatch.setattr(pdf_run, "create_db_engine", lambda: None)
+    monkeypatch.setattr(pdf_run, "fetch_cached_sections", lambda engine, content_hash: cached)
+    monkeypatch.setattr(pdf_run, "store_cached_sections", lambda engine, *args: calls["stored"].append(args))
+    monkeypatch.setattr(pdf_run, "ingest_document_sections", ingest_document_sections)
+    monkeypatch.setattr(pdf_run, "update_document_status", lambda engine, *args: calls["status"].append(args))
+    monkeypatch.setattr(pdf_run, "open_project_index", lambda pid: index)
+    monkeypatch.setenv("WORKER_PROCESSES_PDF", "2")
+    return calls, index
+
+
+def test_parse_extracts_caches_and_indexes(run_worker, monkeypatch, tmp_path):
+    calls, index = _patch_db(monkeypatch, tmp_path)
+    path = write_pdf(tmp_path / "paper.pdf", PAGES)
+
+    run_worker(pdf_run, ("pdf.parse", {"documentId": "d1", "filePath": path}))
+
+    [(content_hash, sections)] = calls["stored"]
+    assert content_hash == calculate_md5(path)
+    [(document_id, ingested, status, token_ids, ingested_hash)] = calls["ingested"]
+    assert (document_id, status, ingested_hash) == ("d1", "parsed", content_hash)
+    assert ingested == sections and len(token_ids) == len(sections)
+    assert index.search("graph networks", 10)
+    assert calls["status"] == []
+
+
+def test_parse_reuses_cached_sections(run_worker, monkeypatch, tmp_path):
+    cached = [{'label': 'abstract', 'text': 'cached graph text', 'page': 1}]
+    calls, index = _patch_db(monkeypatch, tmp_path, cached=[dict(section) for section in cached])
+    extracted = []
+
+    async def extract_sections(runtime, file_path):
+        extracted.append(file_path)
+        return []
+
+    monkeypatch.setattr(pdf_run, "extract_sections", extract_sections)
+    path = write_pdf(tmp_path / "paper.pdf", PAGES)
+
+    run_worker(pdf_run, ("pdf.parse", {"documentId": "d1", "filePath": path}))
+
+    assert extracted == [] and calls["stored"] == []
+    [(_, ingested, status, _, content_hash)] = calls["ingested"]
+    assert ingested == cached
+    assert (status, content_hash) == ("parsed", calculate_md5(path))
+    assert len(index.search("cached", 10)) == 1
+
+
+def test_parse_failure_marks_document_failed(run_worker, monkeypatch, tmp_path):
+    calls, _ = _patch_db(monkeypatch, tmp_path)
+
+    run_worker(
+        pdf_run,
+        ("pdf.parse", {"documentId": "d1", "filePath": str(tmp_path / "missing.pdf")}),
+        ("pdf.parse", {"filePath": "no document id"}),
+    )
+
+    assert calls["ingested"] == []
+    assert calls["status"] == [("d1", "failed")]
@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+from workers.pdf_worker.run import PageSectionizer, page_shards
+
+# The line-by-line sectionizer and caption detector PageSectionizer replaced, kept as the oracle
+LEGACY_SECTION_PATTERNS = {
+    'abstract': ['abstract', 'summary'],
+    'introduction': ['introduction', 'intro'],
+    'methods': ['methods', 'methodology', 'materials and methods'],
+    'results': ['results', 'findings'],
+    'discussion': ['discussion', 'conclusion', 'conclusions'],
+    'references': ['references', 'bibliography', 'works cited']
+}
+
+
+def legacy_sectionize_text(text_content):
+    sections = []
+    current_section = None
+    current_text = []
+
+    for page_data in text_content:
+        for line in page_data['text'].split('\n'):
+            line_lower = line.lower().strip()
+
+            detected_section = None
+            for section_name, patterns in LEGACY_SECTION_PATTERNS.items():
+                if any(pattern in line_lower for pattern in patterns):
+                    detected_section = section_name
+                    break
+
+            if detected_section:
+                if current_section and current_text:
+                    sections.append({
+                        'label': current_section,
+                        'text': '\n'.join(current_text),
+                        'page': page_data['page']
+                    })
+                current_section = detected_section
+                current_text = [line]
+            elif current_section:
+                current_text.append(line)
+
+    if current_section and current_text:
+        sections.append({
+            'label': current_section,
+            'text': '\n'.join(current_text),
+            'page': page_data['page']
+        })
+
+    return sections
+
+
+def legacy_detect_figures_and_tables(text_content):
+    figures = []
+    tables = []
+
+    for page_data in text_content:
+        for i, line in enumerate(page_data['text'].split('\n')):
+            line_lower = line.lower().strip()
+            if 'figure' in line_lower and any(char.isdigit() for char in line):
+                figures.append({'caption': line, 'page': page_data['page'], 'line_number': i})
+            if 'table' in line_lower and any(char.isdigit() for char in line):
+                tables.append({'caption': line, 'page': page_data['page'], 'line_number': i})
+
+    return figures, tables
+
+
+WORDS = [
+    'Abstract', 'SUMMARY', 'Introduction', 'intro', 'methods', 'Methodology', 'Materials and Methods',
+    'results', 'Findings', 'discussion', 'Conclusions', 'References', 'bibliography', 'works cited',
+    'Figure', 'figure 2', 'Table', 'TABLE 3', 'entropy', 'model', 'we', 'the', 'data', '12', '0.5',
+    'conclusion of results', 'summary table 4', 'introductory', 'method', '',
+]
+
+
+def random_pages(rng, page_count):
+    pages = []
+    for page in range(1, page_count + 1):
+        lines = [
+            ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 5)))
+            for _ in range(rng.randint(1, 12))
+        ]
+        # Extraction strips each page, so pages never start or end with a newline
+        pages.append({'page': page, 'text': '\n'.join(lines).strip()})
+    return pages
+
+
+def sectionize(pages, shard_size):
+    sectionizer = PageSectionizer()
+    for start, stop in page_shards(len(pages), shard_size):
+        sectionizer.feed(pages[start:stop])
+    return sectionizer.close(), sectionizer.figures, sectionizer.tables
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_legacy_sectionizer(seed):
+    rng = random.Random(seed)
+    pages = random_pages(rng, rng.randint(0, 8))
+    sections, figures, tables = sectionize(pages, rng.randint(1, 4))
+
+    assert sections == legacy_sectionize_text(pages)
+    assert (figures, tables) == legacy_detect_figures_and_tables(pages)
+
+
+def test_section_spans_pages():
+    pages = [
+        {'page': 1, 'text': 'Title\nAbstract\nWe study things.'},
+        {'page': 2, 'text': 'More text\nsee Figure 1\nIntroduction\nBackground.'},
+    ]
+    sections, figures, tables = sectionize(pages, 1)
+
+    assert [(s['label'], s['page']) for s in sections] == [('abstract', 2), ('introduction', 2)]
+    assert sections[0]['text'] == 'Abstract\nWe study things.\nMore text\nsee Figure 1'
+    assert figures == [{'caption': 'see Figure 1', 'page': 2, 'line_number': 1}]
+    assert tables == []
+
+
+def test_no_header_no_sections():
+    assert sectionize([{'page': 1, 'text': 'just some text\nwith lines'}], 1)[0] == []
@@ -0,0 +1,88 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from workers.common.db import ANN_MAX_EF_SEARCH
+from workers.common.runtime import WorkerRuntime
+from workers.rag_worker import run as rag_run
+from workers.rag_worker.run import DenseScorer, ExactScoringBatcher, parse_ef_search
+
+
+@pytest.mark.parametrize("value, expected", [
+    (64, 64),
+    ("128", 128),
+    (12.7, 12),
+    (0, 1),
+    (-5, 1),
+    (10 ** 6, ANN_MAX_EF_SEARCH),
+    (None, None),
+    ("fast", None),
+    ([40], None),
+    (float("inf"), None),
+    (float("nan"), None),
+])
+def test_parse_ef_search(value, expected):
+    assert parse_ef_search(value) == expected
+
+
+@pytest.fixture
+def scorer(monkeypatch):
+    rng = np.random.default_rng(0)
+    rows = [{'id': f"s{i}", 'text': f"section {i}", 'document_id': f"d{i % 5}"} for i in range(200)]
+    matrix = rng.standard_normal((len(rows), 16)).astype(np.float32)
+    monkeypatch.setattr(rag_run, "fetch_project_embedding_matrix", lambda engine, project_id: (rows, matrix.copy()))
+    monkeypatch.setattr(
+        rag_run, "fetch_filtered_document_ids", lambda engine, project_id, filters: filters["documentIds"]
+    )
+    return DenseScorer(engine=None)
+
+
+@pytest.mark.parametrize("filters", [None, {"documentIds": ["d1", "d3"]}, {"documentIds": []}])
+def test_score_many_matches_one_query_at_a_time(scorer, filters):
+    queries = np.random.default_rng(1).standard_normal((6, 16)).astype(np.float32)
+
+    batched = scorer.score_many("p1", queries, 10, filters=filters)
+
+    assert len(batched) == len(queries)
+    for query, scored in zip(queries, batched, strict=True):
+        [single] = scorer.score_many("p1", query, 10, filters=filters)
+        assert [section['id'] for section, _ in scored] == [section['id'] for section, _ in single]
+        assert [s for _, s in scored] == pytest.approx([s for _, s in single], abs=1e-6)
+    if filters:
+        allowed = set(filters["documentIds"])
+        assert all(section['document_id'] in allowed for scored in batched for section, _ in scored)
+        assert all(len(scored) == (10 if allowed else 0) for scored in batched)
+
+
+def test_concurrent_queries_share_one_pass(scorer):
+    calls = []
+    score_many = scorer.score_many
+
+    def counting_score_many(project_id, query_matrix, k, filters=None):
+        calls.append((project_id, len(query_matrix)))
+        return score_many(project_id, query_matrix, k, filters)
+
+    scorer.score_many = counting_score_many
+    queries = np.random.default_rng(2).standard_normal((5, 16)).astype(np.float32)
+    runtime = WorkerRuntime("rag", processes=0)
+    batcher = ExactScoringBatcher(scorer, runtime, k=3, max_batch_size=4, max_wait_ms=20)
+
+    async def run():
+        return await asyncio.gather(
+            *(batcher.score("p1", query) for query in queries),
+            batcher.score("p2", queries[0]),
+        )
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        runtime.shutdown()
+
+    # Four queries fill one batch, the fifth opens another; p2 is scored on its own
+    assert sorted(calls) == [("p1", 1), ("p1", 4), ("p2", 1)]
+    for query, scored in zip(queries, results, strict=False):
+        [single] = scorer.score_many("p1", query, 3)
+        assert [section['id'] for section, _ in scored] == [section['id'] for section, _ in single]
+        assert [s for _, s in scored] == pytest.approx([s for _, s in single], abs=1e-6)
+    assert [section['id'] for section, _ in results[-1]] == [section['id'] for section, _ in results[0]]
@@ -0,0 +1,56 @@
+import asyncio
+import operator
+
+import pytest
+
+from workers.common.runtime import WorkerRuntime, subject_concurrency, worker_processes
+
+
+def test_worker_processes_reads_per_worker_override(monkeypatch):
+    monkeypatch.setenv("WORKER_PROCESSES_PDF", "3")
+
+    assert worker_processes("pdf") == 3
+    assert worker_processes("label", default=5) == 5
+
+
+def test_subject_concurrency_reads_per_subject_override(monkeypatch):
+    monkeypatch.setenv("WORKER_CONCURRENCY_EMBED_UPSERT", "2")
+
+    assert subject_concurrency("embed.upsert") == 2
+    assert subject_concurrency("qa.ask", default=7) == 7
+
+
+def test_runtime_without_process_pool():
+    runtime = WorkerRuntime("export", processes=0)
+
+    async def run():
+        assert await runtime.run_io(operator.add, 1, 2) == 3
+        with pytest.raises(RuntimeError):
+            await runtime.run_cpu(operator.add, 1, 2)
+
+    try:
+        assert runtime.process_pool is None
+        asyncio.run(run())
+    finally:
+        runtime.shutdown()
+
+
+def test_run_cpu_uses_process_pool():
+    runtime = WorkerRuntime("matrix", processes=1)
+    try:
+        assert asyncio.run(runtime.run_cpu(operator.mul, 6, 7)) == 42
+    finally:
+        runtime.shutdown()
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_iterate_io_yields_in_order(prefetch):
+    runtime = WorkerRuntime("rag", processes=0)
+
+    async def collect():
+        return [item async for item in runtime.iterate_io(range(5), prefetch=prefetch)]
+
+    try:
+        assert asyncio.run(collect()) == [0, 1, 2, 3, 4]
+    finally:
+        runtime.shutdown()